@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# archive.py -- export a whole tournament to CSV files and import it back, and register a list of
+# players from a file, with COPY instead of one statement per row.
+#
+# Usage: python archive.py export TOURNAMENT_ID DIRECTORY [--compress]
+#        python archive.py import DIRECTORY
+#        python archive.py register TOURNAMENT_ID FILE
+#
+#   export:   write tournament.csv, players.csv, registrations.csv and matches.csv into DIRECTORY
+#             (gzip-compressed .csv.gz files with --compress).
+#   import:   create a new tournament from an exported DIRECTORY; the players get new ids.
+#   register: register the names of FILE (a CSV file with a "name" header line) as new players of
+#             a tournament which has no round yet.
+
+import os
+import gzip
+import argparse
+
+from tournament import *
+
+# The files of an exported tournament: (file name, staging table, columns, export query).
+ARCHIVE_FILES = [
+    ("tournament", "stage_tournament", ["id", "name"],
+     "select id, name from Tournaments where id = %s"),
+    ("players", "stage_players", ["id", "name"],
+     "select p.id, p.name from Players p join Players_Tournaments pt on pt.player_id = p.id \
+      where pt.tourNumber = %s order by p.id"),
+    ("registrations", "stage_registrations", ["player_id", "bye"],
+     "select player_id, bye from Players_Tournaments where tourNumber = %s order by player_id"),
+    ("matches", "stage_matches", ["roundNumber", "p1", "p2", "win"],
+     "select roundNumber, p1, p2, win from Matches where tourNumber = %s order by roundNumber, p1, p2"),
+]
+
+STAGE_TABLES = [
+    "create temp table stage_tournament (id integer, name text);",
+    "create temp table stage_registrations (player_id integer, bye integer);",
+    "create temp table stage_matches (roundNumber integer, p1 integer, p2 integer, win integer);",
+    "create temp table stage_ids (id integer primary key, new_id integer);",
+]
+
+# The staged players, numbered by the database when they come from a list of names.
+STAGE_PLAYERS = {
+    "postgresql" : "create temp table stage_players (id serial, name text);",
+    "sqlite" : "create temp table stage_players (id integer primary key, name text);",
+}
+
+# Give the staged players new ids, in the order of their former ids, so that p1 < p2 still holds
+# for every imported match. The dummy player keeps the id 0.
+NEW_PLAYER_IDS = {
+    "postgresql" : "insert into stage_ids select id, nextval(pg_get_serial_sequence('players', 'id')) \
+                    from (select id from stage_players where id <> 0 order by id) s;",
+    "sqlite" : "insert into stage_ids select id, (select coalesce(max(id), 0) from Players) \
+                                                 + row_number() over (order by id) \
+                from stage_players where id <> 0;",
+}
+
+# The matches of an archive are inserted with the triggers of Matches bypassed, in the transaction of
+# the import only, and Opponents and Standings built once afterwards (rebuildStandings) instead of
+# row by row. PostgreSQL: the trigger functions return at once while tournament.bulk_load is on
+# (migration 002). SQLite: the insert trigger is dropped, then created again from its definition.
+BULK_LOAD_ON = {
+    "postgresql" : "select set_config('tournament.bulk_load', 'on', true);",
+    "sqlite" : "drop trigger matches_insert_standings_trg;",
+}
+BULK_LOAD_OFF = {
+    "postgresql" : "select set_config('tournament.bulk_load', 'off', true);",
+    "sqlite" : "select sql from sqlite_master where type = 'trigger' and name = 'matches_insert_standings_trg';",
+}
+
+# Read the whole tournament from one snapshot of the database.
+EXPORT_SNAPSHOT = {
+    "postgresql" : "set transaction isolation level repeatable read, read only;",
+}
+
+def openFile(path, mode):
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+def archivePath(directory, fileName, compress=False):
+    path = os.path.join(directory, fileName + ".csv")
+    if compress or (not os.path.exists(path) and os.path.exists(path + ".gz")):
+        path += ".gz"
+    return path
+
+def exportTournament(tourNum, directory, compress=False):
+    """ Write the tournament 'tourNum', its players, registrations (with the bye flags) and matches
+        into 'directory', one CSV file each. Returns the paths of the files.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    paths = []
+    with transaction() as conn:
+        if backend.name in EXPORT_SNAPSHOT:
+            db_CRUD([{"sql" : EXPORT_SNAPSHOT[backend.name], "args" : []}])
+        if db_CRUD([{"sql" : "select id from Tournaments where id = %s;", "args" : [tourNum]}]) == []:
+            raise UnknownTournament("Invalid tournament ID.")
+
+        for fileName, table, columns, sql in ARCHIVE_FILES:
+            path = archivePath(directory, fileName, compress)
+            with openFile(path, "wb") as fileObj:
+                backend.copyOut(conn, sql, [tourNum], fileObj)
+            paths.append(path)
+    return paths
+
+def stageTables():
+    return [{"sql" : sql, "args" : []} for sql in STAGE_TABLES + [STAGE_PLAYERS[backend.name]]]
+
+def dropStageTables():
+    return [{"sql" : "drop table stage_{0};".format(name), "args" : []}
+            for name in ["tournament", "registrations", "matches", "ids", "players"]]
+
+def bulkLoadOff():
+    """ The statements which turn the triggers of Matches back on after BULK_LOAD_ON."""
+    if backend.name == "sqlite":
+        return [{"sql" : db_CRUD([{"sql" : BULK_LOAD_OFF["sqlite"], "args" : []}])[0][0], "args" : []}]
+    return [{"sql" : BULK_LOAD_OFF[backend.name], "args" : []}]
+
+def importTournament(directory):
+    """ Create a new tournament from the files written by exportTournament into 'directory'.
+        The players are added as new players, with new ids. Returns the id of the new tournament.
+    """
+    with transaction() as conn:
+        db_CRUD(stageTables())
+        for fileName, table, columns, sql in ARCHIVE_FILES:
+            with openFile(archivePath(directory, fileName), "rb") as fileObj:
+                backend.copyIn(conn, table, columns, fileObj)
+
+        result = db_CRUD([{"sql" : "insert into Tournaments (name) select name from stage_tournament returning id;",
+                           "args" : []}])
+        if len(result) != 1:
+            raise ValueError("The archive must hold exactly one tournament.")
+        tourNum = result[0][0]
+
+        triggersOn = bulkLoadOff() # read before the SQLite trigger is dropped.
+        db_CRUD([{"sql" : "insert into stage_ids values (0, 0);", "args" : []},
+                 {"sql" : NEW_PLAYER_IDS[backend.name], "args" : []},
+                 {"sql" : "insert into Players (id, name) \
+                           select i.new_id, p.name from stage_players p join stage_ids i on i.id = p.id \
+                           where p.id <> 0 order by i.new_id;",
+                  "args" : []},
+                 {"sql" : "insert into Players_Tournaments \
+                           select %s, i.new_id, r.bye from stage_registrations r join stage_ids i on i.id = r.player_id;",
+                  "args" : [tourNum]},
+                 {"sql" : BULK_LOAD_ON[backend.name], "args" : []},
+                 {"sql" : "insert into Matches (tourNumber, roundNumber, p1, p2, win) \
+                           select %s, m.roundNumber, i1.new_id, i2.new_id, \
+                                  case when m.win = -1 then -1 else w.new_id end \
+                           from stage_matches m join stage_ids i1 on i1.id = m.p1 \
+                                join stage_ids i2 on i2.id = m.p2 \
+                                left join stage_ids w on w.id = m.win \
+                           order by m.roundNumber, m.p1, m.p2;",
+                  "args" : [tourNum]}]
+                + triggersOn + dropStageTables())
+        # The matches are in, without their opponents and standings: build both in one pass each.
+        rebuildStandings(tourNum)
+    return tourNum
+
+def importRegistrations(tourNum, path):
+    """ Register every name of the CSV file 'path' (with a "name" header line) as a new player of the
+        tournament 'tourNum', which must not have any round yet. The dummy player is added to or
+        removed from the tournament so that the number of its players stays even.
+        Returns the number of players of the tournament.
+    """
+    with transaction() as conn:
+        if db_CRUD([{"sql" : "select id from Tournaments where id = %s for update;", "args" : [tourNum]}]) == []:
+            raise UnknownTournament("Invalid tournament ID.")
+        if lastRoundNumber(tourNum) > 0:
+            raise ValueError("Players cannot be added after the first round.")
+
+        db_CRUD(stageTables())
+        with openFile(path, "rb") as fileObj:
+            backend.copyIn(conn, "stage_players", ["name"], fileObj)
+
+        db_CRUD([{"sql" : NEW_PLAYER_IDS[backend.name], "args" : []},
+                 {"sql" : "insert into Players (id, name) \
+                           select i.new_id, p.name from stage_players p join stage_ids i on i.id = p.id \
+                           order by i.new_id;",
+                  "args" : []},
+                 {"sql" : "insert into Players_Tournaments select %s, new_id, 0 from stage_ids;",
+                  "args" : [tourNum]},
+                 {"sql" : "delete from Players_Tournaments where tourNumber = %s and player_id = 0;",
+                  "args" : [tourNum]}]
+                + dropStageTables())
+
+        playerNumber = countPlayers(tourNum)
+        if playerNumber > MAX_NUMBER_OF_PLAYERS:
+            raise ValueError("A tournament can have {0} players at most.".format(MAX_NUMBER_OF_PLAYERS))
+        if playerNumber % 2 != 0: # Add a dummy player to this tournament.
+            db_CRUD([{"bulk" : "insertRegistrations", "values" : [(tourNum, 0, 0)]}])
+        invalidateTournament(tourNum)
+    return playerNumber
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export, import and register tournaments in bulk.")
+    commands = parser.add_subparsers(dest="command")
+    exportParser = commands.add_parser("export", help="export a tournament into a directory")
+    exportParser.add_argument("tournament", type=int)
+    exportParser.add_argument("directory")
+    exportParser.add_argument("--compress", action="store_true", help="write gzip-compressed files")
+    importParser = commands.add_parser("import", help="create a tournament from an exported directory")
+    importParser.add_argument("directory")
+    registerParser = commands.add_parser("register", help="register a list of names in a tournament")
+    registerParser.add_argument("tournament", type=int)
+    registerParser.add_argument("file")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            showRows("Exported files:", exportTournament(args.tournament, args.directory, args.compress))
+        elif args.command == "import":
+            print "\n Imported as the tournament", importTournament(args.directory)
+        else:
+            print "\n The tournament has now", importRegistrations(args.tournament, args.file), "players."
+    finally:
+        connectionPool.closeAll()
@@ -0,0 +1,355 @@
+"""
+ async_tournament.py -- asyncio counterpart of the public functions of tournament.py (Python 3.5+).
+
+ One event loop can serve many concurrent standings reads and result submissions over an async
+ connection pool, without a thread per request:
+
+    backend = AsyncpgBackend("postgresql:///tournament")
+    await backend.open()
+    tournament = AsyncTournament(backend)
+    standingList = await tournament.playerStandings(tourNum, roundNum)
+    await backend.close()
+
+ The backend is pluggable: AsyncTournament only needs an object with a 'name' ("postgresql" or
+ "sqlite", the SQL dialect), the coroutines fetch(sql, *args), execute(sql, *args) and
+ executeMany(sql, rows), and transaction(), an async context manager giving an object with the same
+ three coroutines bound to one connection in one transaction.
+ AsyncpgBackend implements it with the asyncpg driver (an optional dependency), AsyncSQLiteBackend
+ with a connection of backends.SQLiteBackend used from the executor, a local stand-in (no database
+ server) for tests and small events.
+
+ The statements are the ones of queries.PREPARED (with their $1, $2, ... placeholders, or their
+ SQLite dialect); asyncpg prepares and caches them per connection by itself.
+
+ The writes publish the change events of events.py as tournament.py does: on the bus of this process
+ once committed, and with notify=True on PostgreSQL with NOTIFY in their transaction, so the
+ processes of the sync API following them (tournament.listenForChanges) drop their cached reads
+ of the tournament and update their live standing lists.
+"""
+import re
+import asyncio
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+import queries
+import events
+import backends
+from pairing import swissPairs, OpponentGraph
+
+
+class AsyncpgBackend(object):
+    """ An async backend on a pool of asyncpg connections."""
+
+    name = "postgresql"
+
+    def __init__(self, dsn="postgresql:///tournament", minConnections=1, maxConnections=20):
+        self.dsn = dsn
+        self.minConnections = minConnections
+        self.maxConnections = maxConnections
+        self.pool = None
+
+    async def open(self):
+        if asyncpg is None:
+            raise RuntimeError("The asyncpg package is needed by AsyncpgBackend (pip install asyncpg).")
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.minConnections,
+                                              max_size=self.maxConnections)
+
+    async def close(self):
+        await self.pool.close()
+
+    async def fetch(self, sql, *args):
+        async with self.pool.acquire() as conn:
+            return [tuple(row) for row in await conn.fetch(sql, *args)]
+
+    async def execute(self, sql, *args):
+        async with self.pool.acquire() as conn:
+            await conn.execute(sql, *args)
+
+    async def executeMany(self, sql, rows):
+        async with self.pool.acquire() as conn:
+            await conn.executemany(sql, rows)
+
+    def transaction(self):
+        return AsyncpgTransaction(self.pool)
+
+
+class AsyncpgTransaction(object):
+    """ async with backend.transaction() as db: ... runs everything on one connection, in one transaction."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.conn = await self.pool.acquire()
+        self.transaction = self.conn.transaction()
+        await self.transaction.start()
+        return self
+
+    async def __aexit__(self, excType, exc, traceback):
+        try:
+            if excType is None:
+                await self.transaction.commit()
+            else:
+                await self.transaction.rollback()
+        finally:
+            await self.pool.release(self.conn)
+
+    async def fetch(self, sql, *args):
+        return [tuple(row) for row in await self.conn.fetch(sql, *args)]
+
+    async def execute(self, sql, *args):
+        await self.conn.execute(sql, *args)
+
+    async def executeMany(self, sql, rows):
+        await self.conn.executemany(sql, rows)
+
+
+class AsyncSQLiteBackend(object):
+    """ An async backend on one SQLite connection ('path' a database file or ":memory:", created with
+        its tables as for backends.SQLiteBackend). The calls run in the default executor, one
+        statement or one transaction at a time.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.conn = None
+        self.lock = None
+
+    async def open(self):
+        self.lock = asyncio.Lock()
+        self.conn = await self.run(backends.SQLiteBackend(self.path).connect)
+
+    async def close(self):
+        await self.run(self.conn.close)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def fetchRows(self, sql, args):
+        return [tuple(row) for row in self.conn.execute(sqliteDialect(sql), args).fetchall()]
+
+    def executeRows(self, sql, rows):
+        self.conn.executemany(sqliteDialect(sql), rows)
+
+    async def fetch(self, sql, *args):
+        async with self.lock:
+            return await self.run(self.fetchRows, sql, args)
+
+    async def execute(self, sql, *args):
+        await self.fetch(sql, *args)
+
+    async def executeMany(self, sql, rows):
+        async with self.lock:
+            await self.run(self.executeRows, sql, rows)
+
+    def transaction(self):
+        return AsyncSQLiteTransaction(self)
+
+
+class AsyncSQLiteTransaction(object):
+    """ async with backend.transaction() as db: ... holds the connection of an AsyncSQLiteBackend
+        for one immediate transaction.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def __aenter__(self):
+        await self.backend.lock.acquire()
+        try:
+            await self.backend.run(self.backend.conn.execute, "begin immediate")
+        except BaseException:
+            self.backend.lock.release()
+            raise
+        return self
+
+    async def __aexit__(self, excType, exc, traceback):
+        try:
+            await self.backend.run(self.backend.conn.execute, "commit" if excType is None else "rollback")
+        finally:
+            self.backend.lock.release()
+
+    async def fetch(self, sql, *args):
+        return await self.backend.run(self.backend.fetchRows, sql, args)
+
+    async def execute(self, sql, *args):
+        await self.fetch(sql, *args)
+
+    async def executeMany(self, sql, rows):
+        await self.backend.run(self.backend.executeRows, sql, rows)
+
+
+def sqliteDialect(sql):
+    """ The SQLite form of a statement with $1, $2, ... placeholders (row locks are not needed)."""
+    return re.sub(r"\$(\d+)", r"?\1", sql).replace(" for update", "")
+
+# The results of a round written in one statement on PostgreSQL (one per match on SQLite).
+UPDATE_RESULTS = "update Matches m set win = v.win \
+                  from unnest($3::integer[], $4::integer[], $5::integer[]) as v(p1, p2, win) \
+                  where m.tourNumber = $1 and m.roundNumber = $2 and m.p1 = v.p1 and m.p2 = v.p2"
+
+
+class AsyncTournament(object):
+    """ The tournament operations of tournament.py as coroutines over an async backend."""
+
+    def __init__(self, backend, byePolicy="random", notify=False):
+        self.backend = backend
+        self.byePolicy = byePolicy
+        self.notify = notify and backend.name == "postgresql"
+
+    def statement(self, name):
+        """ The statement 'name' of queries.PREPARED in the dialect of the backend."""
+        if self.backend.name == "sqlite":
+            return queries.sqliteStatement(name)
+        return queries.PREPARED[name][1]
+
+    def publishing(self):
+        """ True if the change events are built: someone subscribed to them, or they are NOTIFYed."""
+        return events.bus.subscribed() or self.notify
+
+    async def sendChange(self, db, event):
+        """ NOTIFY the change event 'event' in the transaction 'db' of the change, if notify."""
+        if self.notify:
+            for payload in events.notifyPayloads(event):
+                await db.execute("select pg_notify($1, $2)", events.NOTIFY_CHANNEL, payload)
+
+    async def opponentGraph(self, tourNum, db=None):
+        return OpponentGraph(await (db or self.backend).fetch(self.statement("opponents"), tourNum))
+
+    async def countPlayers(self, tourNum):
+        """ Returns the number of players registered for the tournament "tourNum"."""
+        result = await self.backend.fetch("select count(*) from Players_Tournaments where tourNumber = $1",
+                                          tourNum)
+        return int(result[0][0])
+
+    async def registerPlayer(self, name):
+        """ Adds a player to the database and returns his or her id."""
+        result = await self.backend.fetch("insert into Players (name) values ($1) returning id", name)
+        return result[0][0]
+
+    async def playerStandings(self, tourNum, roundNum, db=None):
+        """ Returns the standing list (id, name, wins, opp_wins, matches) at the end of the round
+            "roundNum" of the tournament "tourNum", as tournament.playerStandings.
+        """
+        result = await (db or self.backend).fetch(self.statement("standings"), tourNum, roundNum)
+        if not result: # no round played yet.
+            result = await (db or self.backend).fetch(self.statement("registrations"), tourNum)
+        return [row for row in result if row[0] != 0] # eliminate dummy player if exists.
+
+    async def swissPairings(self, tourNum, roundNum, db=None):
+        """ Set the bye player if needed and return the pairingList (id1, name1, id2, name2) of the
+            round "roundNum", as tournament.swissPairings.
+        """
+        db = db or self.backend
+        pairingList = []
+        byePlayer = 0
+
+        if await db.fetch("select 1 from Players_Tournaments where tourNumber = $1 and player_id = 0", tourNum):
+            result = await db.fetch(self.statement(queries.BYE_POLICIES[self.byePolicy]), tourNum)
+            if result == []:
+                raise ValueError("The round number is over the actual available round of the tournament.")
+            byePlayer, name = result[0]
+            pairingList.append((byePlayer, name, 0, ""))
+
+        opponents = await self.opponentGraph(tourNum, db)
+        if len(opponents) > 0:
+            playersList = await self.playerStandings(tourNum, roundNum, db)
+        else:
+            playersList = await db.fetch("select p.id, name, 0 \
+                                          from players p join Players_Tournaments pt on p.id = pt.Player_id \
+                                          where tourNumber = $1 and p.id <> 0", tourNum)
+
+        playerIds, scores, names = [], [], {}
+        for row in playersList:
+            if row[0] != byePlayer:
+                playerIds.append(row[0])
+                scores.append(row[2])
+                names[row[0]] = row[1]
+
+        # The pairing engine is CPU-bound: run it outside of the event loop.
+        pairs = await asyncio.get_running_loop().run_in_executor(None, swissPairs, playerIds, scores, opponents)
+        for id1, id2 in pairs:
+            pairingList.append((id1, names[id1], id2, names[id2]))
+        return pairingList
+
+    async def newRound(self, tourNum, roundNum):
+        """ Create the round "roundNum" of the tournament "tourNum" atomically, as
+            tournament.generateRound, and return its pairingList.
+        """
+        event = None
+        async with self.backend.transaction() as db:
+            if await db.fetch("select id from Tournaments where id = $1 for update", tourNum) == []:
+                raise ValueError("Invalid tournament ID.")
+            result = await db.fetch("select max(roundNumber) from Matches where tourNumber = $1", tourNum)
+            lastRoundNum = result[0][0] or 0
+            if roundNum != lastRoundNum + 1:
+                raise ValueError("The round {0} cannot be created after the round {1}.".format(roundNum, lastRoundNum))
+
+            pairingList = await self.swissPairings(tourNum, roundNum, db)
+            if self.publishing():
+                wins = dict((row[0], row[2]) for row in await self.playerStandings(tourNum, roundNum - 1, db))
+                event = events.matchesCreated(tourNum, roundNum, pairingList, wins,
+                                              await self.opponentGraph(tourNum, db))
+
+            await db.executeMany("insert into Matches (tourNumber, roundNumber, p1, p2) values ($1, $2, $3, $4)",
+                                 [(tourNum, roundNum, min(id1, id2), max(id1, id2))
+                                  for id1, name1, id2, name2 in pairingList])
+            if event is not None:
+                await self.sendChange(db, event)
+
+        if event is not None:
+            events.bus.publish(event)
+        return pairingList
+
+    async def matchResults(self, tourNum, roundNum, results):
+        """ Record the results (p1, p2, winner) of the round "roundNum" of the tournament "tourNum"
+            in one transaction, as tournament.recordMatchResults.
+        """
+        rows = []
+        for p1, p2, winner in results:
+            if winner not in [-1, p1, p2]:
+                raise ValueError("The winner {0} did not play in the match between {1} and {2}."
+                                 .format(winner, p1, p2))
+            rows.append((min(p1, p2), max(p1, p2), winner))
+
+        event = None
+        async with self.backend.transaction() as db:
+            if self.publishing():
+                formerWinners = dict(((p1, p2), win) for p1, p2, win in
+                                     await db.fetch("select p1, p2, win from Matches \
+                                                     where tourNumber = $1 and roundNumber = $2",
+                                                    tourNum, roundNum))
+                event = events.resultsRecorded(tourNum, roundNum, rows, formerWinners,
+                                               await self.opponentGraph(tourNum, db))
+
+            if self.backend.name == "sqlite":
+                await db.executeMany(queries.sqliteBulkStatement("updateResults"),
+                                     [(tourNum, roundNum) + row for row in rows])
+            else:
+                await db.execute(UPDATE_RESULTS, tourNum, roundNum,
+                                 [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows])
+            if event is not None:
+                await self.sendChange(db, event)
+
+        if event is not None:
+            events.bus.publish(event)
+
+    async def deleteRound(self, tourNum, lastRoundNum):
+        """ Delete the last round of the tournament "tourNum" and reset its bye player, as tournament.deleteRound."""
+        event = None
+        async with self.backend.transaction() as db:
+            standingsBefore = await self.playerStandings(tourNum, lastRoundNum, db) if self.publishing() else None
+            await db.execute(self.statement("resetBye"), tourNum, lastRoundNum)
+            await db.execute("delete from Matches where tourNumber = $1 and roundNumber = $2", tourNum, lastRoundNum)
+            if standingsBefore is not None:
+                event = events.roundDeleted(tourNum, lastRoundNum, standingsBefore,
+                                            await self.playerStandings(tourNum, lastRoundNum - 1, db))
+                await self.sendChange(db, event)
+
+        if event is not None:
+            events.bus.publish(event)
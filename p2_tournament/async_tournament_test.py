@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# async_tournament_test.py -- tests of async_tournament.py on its local stand-in backend
+# (AsyncSQLiteBackend on an in-memory database), no database server needed.
+#
+# Usage: python3 async_tournament_test.py
+
+import asyncio
+import unittest
+from math import ceil, log
+
+import events
+from async_tournament import AsyncTournament, AsyncSQLiteBackend
+
+
+def standingOrder(row):
+    """ The order of playerStandings, the ties broken by id."""
+    return (-row[2], row[3] is not None, -(row[3] or 0), row[0])
+
+
+class AsyncTournamentTest(unittest.TestCase):
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.backend = AsyncSQLiteBackend(":memory:")
+        self.wait(self.backend.open())
+        self.tournament = AsyncTournament(self.backend)
+
+    def tearDown(self):
+        self.wait(self.backend.close())
+        self.loop.close()
+
+    async def createTournament(self, playerNum):
+        """ A tournament of 'playerNum' new players (and the dummy player for an odd number)."""
+        result = await self.backend.fetch("insert into Tournaments (name) values ($1) returning id", "Async")
+        tourNum = result[0][0]
+        playerIds = [await self.tournament.registerPlayer("Player {0}".format(i)) for i in range(playerNum)]
+        await self.backend.executeMany("insert into Players_Tournaments values ($1, $2, 0)",
+                                       [(tourNum, playerId) for playerId in playerIds + [0] * (playerNum % 2)])
+        return tourNum, playerIds
+
+    async def playRound(self, tourNum, roundNum):
+        """ Create the round 'roundNum' and record its results, the lower id winning (a draw every
+            third match). Returns its pairingList.
+        """
+        pairingList = await self.tournament.newRound(tourNum, roundNum)
+        results = []
+        for i, (id1, name1, id2, name2) in enumerate(pairingList):
+            if id1 == 0 or id2 == 0:
+                results.append((id1, id2, id1 or id2))
+            else:
+                results.append((id1, id2, -1 if i % 3 == 2 else min(id1, id2)))
+        await self.tournament.matchResults(tourNum, roundNum, results)
+        return pairingList
+
+    def testWholeTournament(self):
+        async def play():
+            tourNum, playerIds = await self.createTournament(9)
+            self.assertEqual(await self.tournament.countPlayers(tourNum), 10)
+
+            met, byePlayers = set(), []
+            for roundNum in range(1, int(ceil(log(9, 2))) + 1):
+                pairingList = await self.playRound(tourNum, roundNum)
+                self.assertEqual(len(pairingList), 5)
+                for id1, name1, id2, name2 in pairingList:
+                    self.assertNotIn((min(id1, id2), max(id1, id2)), met, "a rematch")
+                    met.add((min(id1, id2), max(id1, id2)))
+                    if id1 == 0 or id2 == 0:
+                        byePlayers.append(id1 or id2)
+
+            self.assertEqual(len(set(byePlayers)), len(byePlayers), "a second bye")
+            standingList = await self.tournament.playerStandings(tourNum, roundNum)
+            self.assertEqual(sorted(row[0] for row in standingList), sorted(playerIds))
+            self.assertEqual([row[2] for row in standingList], sorted([row[2] for row in standingList], reverse=True))
+        self.wait(play())
+
+    def testDeleteRound(self):
+        async def play():
+            tourNum, playerIds = await self.createTournament(5)
+            await self.playRound(tourNum, 1)
+            before = await self.tournament.playerStandings(tourNum, 1)
+            await self.playRound(tourNum, 2)
+
+            await self.tournament.deleteRound(tourNum, 2)
+            self.assertEqual(await self.backend.fetch("select count(*) from Matches where roundNumber = 2"), [(0,)])
+            self.assertEqual(await self.backend.fetch("select count(*) from Players_Tournaments where bye = 1"), [(1,)])
+            self.assertEqual(sorted(await self.tournament.playerStandings(tourNum, 2)), sorted(before))
+            await self.playRound(tourNum, 2) # the round can be created again.
+        self.wait(play())
+
+    def testRoundChecks(self):
+        async def play():
+            tourNum, playerIds = await self.createTournament(4)
+            with self.assertRaises(ValueError):
+                await self.tournament.newRound(tourNum + 1, 1) # no such tournament.
+            with self.assertRaises(ValueError):
+                await self.tournament.newRound(tourNum, 2) # not the next round.
+            pairingList = await self.tournament.newRound(tourNum, 1)
+            id1, name1, id2, name2 = pairingList[0]
+            with self.assertRaises(ValueError):
+                await self.tournament.matchResults(tourNum, 1, [(id1, id2, playerIds[-1] + 1)])
+        self.wait(play())
+
+    def testLiveStandingsFollowTheEvents(self):
+        async def play():
+            tourNum, playerIds = await self.createTournament(7)
+            live = events.LiveStandings(tourNum)
+            live.load(0, [], [])
+            subscription = events.bus.subscribe(live.apply, tourNum)
+            try:
+                for roundNum in range(1, 4):
+                    await self.playRound(tourNum, roundNum)
+                    roundNumber, rows, version = live.standings()
+                    self.assertEqual(roundNumber, roundNum)
+                    self.assertEqual(rows, sorted(await self.tournament.playerStandings(tourNum, roundNum),
+                                                  key=standingOrder))
+
+                await self.tournament.deleteRound(tourNum, 3)
+                roundNumber, rows, version = live.standings()
+                self.assertEqual(roundNumber, 2)
+                self.assertEqual(rows, sorted(await self.tournament.playerStandings(tourNum, 2), key=standingOrder))
+            finally:
+                events.bus.unsubscribe(subscription)
+        self.wait(play())
+
+
+if __name__ == '__main__':
+    unittest.main()
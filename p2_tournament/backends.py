@@ -0,0 +1,359 @@
+"""
+ backends.py -- the storage backends of tournament.py.
+
+ A backend opens the connections of the pool and runs the sqlList of db_CRUD in its SQL dialect:
+   - PostgresBackend: the PostgreSQL database created by tournament.sql (the default).
+   - SQLiteBackend: an embedded SQLite database file, or an in-memory one, created from
+     tournament_sqlite.sql. It needs no database server, e.g. for local benchmarks, tests and
+     small events, and gives the same standing lists and pairings.
+
+ The backend is chosen with the environment variable TOURNAMENT_DATABASE: "postgresql" or a
+ libpq connection string for PostgreSQL, "sqlite:<file>" or "sqlite::memory:" for SQLite.
+"""
+import os
+import csv
+import time
+import sqlite3
+from itertools import islice, count
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:
+    psycopg2 = None
+
+import queries
+import instrumentation
+
+
+class PostgresBackend(object):
+    """ The PostgreSQL backend: named prepared statements and multi-row VALUES bulk writes."""
+
+    name = "postgresql"
+    maxConnections = None # as many as the pool allows.
+
+    def __init__(self, dsn="dbname=tournament", pageSize=1000):
+        self.dsn = dsn
+        self.pageSize = pageSize
+        self.cursorNumbers = count(1) # the names of the server-side cursors of streamRows.
+
+    def connect(self):
+        if psycopg2 is None:
+            raise RuntimeError("The psycopg2 package is needed by the PostgreSQL backend.")
+        return psycopg2.connect(self.dsn, connection_factory=postgresConnectionClass())
+
+    def begin(self, conn, immediate=False):
+        """ psycopg2 opens a transaction by itself with the first statement."""
+
+    def executeSqlList(self, conn, sqlList):
+        """ execute every sql in sqlList with the connection 'conn' and return the result of the last one
+            ([] if it returns no rows). Every statement is reported to the instrumentation.
+        """
+        c = conn.cursor()
+        result = []
+        for sql in sqlList:
+            start = time.time()
+            if "prepared" in sql:
+                kind, text = "prepared", sql["prepared"]
+                if text not in conn.preparedNames:
+                    c.execute(queries.prepareStatement(text))
+                    conn.preparedNames.add(text)
+                if text in instrumentation.explainStatements:
+                    # EXPLAIN ANALYZE runs the statement: a write would be done twice, so only its plan.
+                    explain = "explain analyze " if text in queries.READ_ONLY else "explain "
+                    c.execute(explain + queries.executeStatement(text), sql["args"])
+                    instrumentation.recordPlan(text, "\n".join(row[0] for row in c.fetchall()))
+                    start = time.time()
+                c.execute(queries.executeStatement(text), sql["args"])
+            elif "bulk" in sql:
+                statement, template = queries.BULK[sql["bulk"]]
+                result = self.executeValues(c, statement, sql["values"], template, sql["bulk"])
+                continue
+            else:
+                kind, text = "sql", sql["sql"]
+                c.execute(sql["sql"], sql["args"])
+            result = c.fetchall() if c.description is not None else []
+            instrumentation.recordStatement(kind, text, time.time() - start,
+                                            len(result) if c.description is not None else c.rowcount)
+        c.close()
+        return result
+
+    def streamRows(self, conn, sql, args, fetchSize):
+        """ Yields the rows of the query 'sql' through a server-side (named) cursor, 'fetchSize' rows
+            per round-trip, so the client never holds more than one batch in memory.
+        """
+        c = conn.cursor(name="tournament_stream_{0}".format(next(self.cursorNumbers)))
+        c.itersize = fetchSize
+        try:
+            for row in instrumentedStream(c, sql, args, fetchSize):
+                yield row
+        finally:
+            c.close()
+
+    def copyOut(self, conn, sql, args, fileObj):
+        """ Write the rows of the query 'sql' to 'fileObj' as CSV with a header line, with COPY."""
+        c = conn.cursor()
+        start = time.time()
+        c.copy_expert("copy ({0}) to stdout with csv header".format(c.mogrify(sql, args)), fileObj)
+        instrumentation.recordStatement("sql", sql, time.time() - start, c.rowcount)
+        c.close()
+
+    def copyIn(self, conn, table, columns, fileObj):
+        """ Load the CSV rows (with a header line) of 'fileObj' into the 'columns' of 'table', with COPY."""
+        c = conn.cursor()
+        start = time.time()
+        c.copy_expert("copy {0} ({1}) from stdin with csv header".format(table, ", ".join(columns)), fileObj)
+        instrumentation.recordStatement("sql", "copy " + table, time.time() - start, c.rowcount)
+        c.close()
+
+    def executeScript(self, conn, script):
+        """ Run the statements of the SQL script 'script' (a migration) in the transaction of 'conn';
+            the caller commits it.
+        """
+        if script.strip() == "":
+            return
+        c = conn.cursor()
+        start = time.time()
+        c.execute(script)
+        instrumentation.recordStatement("sql", "script", time.time() - start)
+        c.close()
+
+    def executeValues(self, c, sql, rows, template, name=None):
+        """ Write 'rows' (a list or any iterable) with one statement per 'pageSize' rows instead of one
+            statement per row: the %s of 'sql' is replaced by a multi-row VALUES list, every row of which
+            is quoted by the driver with 'template', e.g.
+                executeValues(c, "insert into Matches values %s", rows, "(%s, %s, %s, %s)")
+            Every page is reported to the instrumentation as a statement 'name' (or 'sql').
+            Returns the rows returned by the pages (with a RETURNING clause), [] otherwise.
+        """
+        rows = iter(rows)
+        result = []
+        while True:
+            page = list(islice(rows, self.pageSize))
+            if page == []:
+                break
+            start = time.time()
+            values = ",".join(c.mogrify(template, row) for row in page)
+            c.execute(sql.replace("%s", values, 1))
+            if c.description is not None:
+                result += c.fetchall()
+            instrumentation.recordStatement("bulk", name or sql, time.time() - start, c.rowcount)
+        return result
+
+
+postgresConnection = None
+
+def postgresConnectionClass():
+    """ The psycopg2 connection class remembering the statements of queries.PREPARED it has already
+        prepared (defined on first use, so that psycopg2 is only needed by the PostgreSQL backend).
+    """
+    global postgresConnection
+    if postgresConnection is None:
+        class TournamentConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super(TournamentConnection, self).__init__(*args, **kwargs)
+                self.preparedNames = set()
+        postgresConnection = TournamentConnection
+    return postgresConnection
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """ A SQLite connection with the 'closed' attribute of a psycopg2 connection, used by the pool."""
+
+    def __init__(self, *args, **kwargs):
+        sqlite3.Connection.__init__(self, *args, **kwargs)
+        self.closed = 0
+
+    def close(self):
+        sqlite3.Connection.close(self)
+        self.closed = 1
+
+
+class SQLiteBackend(object):
+    """ The embedded SQLite backend. 'path' is a database file (created with its tables if it does
+        not exist) or ":memory:"; an in-memory database lives in a single connection, so the pool
+        must have one connection at most (see maxConnections).
+    """
+
+    name = "sqlite"
+    schemaFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tournament_sqlite.sql")
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.maxConnections = 1 if path == ":memory:" else None
+
+    def connect(self):
+        # The transactions are opened explicitly by begin() (isolation_level=None), and a connection
+        # may be used by another thread than the one which opened it (the pool lends it to any thread).
+        conn = sqlite3.connect(self.path, factory=SQLiteConnection, isolation_level=None,
+                               check_same_thread=False, timeout=30)
+        conn.execute("pragma foreign_keys = on")
+        if not self.hasSchema(conn):
+            # Another connection may be creating the tables too (e.g. the worker processes of
+            # simulation.py on a new file): the write lock lets one of them in, the others find them.
+            conn.execute("begin immediate")
+            if not self.hasSchema(conn):
+                with open(self.schemaFile) as schema:
+                    for statement in scriptStatements(schema.read()):
+                        conn.execute(statement)
+            conn.execute("commit")
+        return conn
+
+    def hasSchema(self, conn):
+        return conn.execute("select count(*) from sqlite_master where name = 'Matches'").fetchone()[0] > 0
+
+    def begin(self, conn, immediate=False):
+        """ Open a transaction; an immediate one takes the write lock at once, so two transactions
+            reading then writing the same tournament cannot both go on.
+        """
+        conn.execute("begin immediate" if immediate else "begin")
+
+    def executeSqlList(self, conn, sqlList):
+        """ execute every sql in sqlList with the connection 'conn' and return the result of the last one."""
+        c = conn.cursor()
+        result = []
+        for sql in sqlList:
+            start = time.time()
+            if "prepared" in sql:
+                kind, text = "prepared", sql["prepared"]
+                if text in instrumentation.explainStatements:
+                    c.execute("explain query plan " + queries.sqliteStatement(text), sql["args"])
+                    instrumentation.recordPlan(text, "\n".join(row[-1] for row in c.fetchall()))
+                    start = time.time()
+                c.execute(queries.sqliteStatement(text), sql["args"])
+            elif "bulk" in sql and " returning " in queries.BULK[sql["bulk"]][0]:
+                result = self.executeValues(c, sql["bulk"], sql["values"])
+                continue
+            elif "bulk" in sql:
+                kind, text = "bulk", sql["bulk"]
+                c.executemany(queries.sqliteBulkStatement(text), sql["values"])
+            else:
+                kind, text = "sql", sql["sql"]
+                c.execute(self.dialect(text), sql["args"])
+            result = c.fetchall() if c.description is not None else []
+            instrumentation.recordStatement(kind, text, time.time() - start,
+                                            len(result) if c.description is not None else c.rowcount)
+        c.close()
+        return result
+
+    def executeValues(self, c, name, rows):
+        """ Write 'rows' with the bulk write 'name' of queries.BULK, which returns rows (executemany
+            returns none): one multi-row VALUES statement per page, of as many rows as the 999 bound
+            parameters of a statement allow. Returns the rows returned.
+        """
+        sql, template = queries.BULK[name]
+        template = template.replace("%s", "?")
+        pageSize = 999 // template.count("?")
+        rows = iter(rows)
+        result = []
+        while True:
+            page = list(islice(rows, pageSize))
+            if page == []:
+                break
+            start = time.time()
+            c.execute(sql.replace("%s", ",".join([template] * len(page)), 1), [value for row in page for value in row])
+            pageResult = c.fetchall()
+            instrumentation.recordStatement("bulk", name, time.time() - start, len(pageResult))
+            result += pageResult
+        return result
+
+    def streamRows(self, conn, sql, args, fetchSize):
+        """ Yields the rows of the query 'sql' as SQLite steps through them, 'fetchSize' rows at a time."""
+        c = conn.cursor()
+        try:
+            for row in instrumentedStream(c, self.dialect(sql), args, fetchSize):
+                yield row
+        finally:
+            c.close()
+
+    def copyOut(self, conn, sql, args, fileObj):
+        """ Write the rows of the query 'sql' to 'fileObj' as CSV with a header line (NULL as an empty field)."""
+        c = conn.cursor()
+        start = time.time()
+        c.execute(self.dialect(sql), args)
+        writer = csv.writer(fileObj)
+        writer.writerow([column[0] for column in c.description])
+        while True:
+            rows = c.fetchmany(1000)
+            if rows == []:
+                break
+            writer.writerows([encodeField(field) for field in row] for row in rows)
+        instrumentation.recordStatement("sql", sql, time.time() - start)
+        c.close()
+
+    def copyIn(self, conn, table, columns, fileObj):
+        """ Load the CSV rows (with a header line) of 'fileObj' into the 'columns' of 'table'."""
+        reader = csv.reader(fileObj)
+        next(reader, None)
+        start = time.time()
+        c = conn.executemany("insert into {0} ({1}) values ({2})".format(table, ", ".join(columns),
+                                                                     ", ".join("?" * len(columns))),
+                         ([decodeField(field) for field in row] for row in reader))
+        instrumentation.recordStatement("sql", "copy " + table, time.time() - start, c.rowcount)
+
+    def executeScript(self, conn, script):
+        """ Run the statements of the SQL script 'script' (a migration) in a new transaction of 'conn',
+            left open for the caller to commit (executescript commits the pending one first).
+        """
+        start = time.time()
+        conn.executescript("begin immediate;\n" + script)
+        instrumentation.recordStatement("sql", "script", time.time() - start)
+
+    def dialect(self, sql):
+        """ The SQLite form of a statement with %s placeholders.
+            Row locks are not needed: the transactions of SQLite lock the whole database.
+        """
+        return sql.replace("%s", "?").replace(" for update", "")
+
+
+def instrumentedStream(c, sql, args, fetchSize):
+    """ Yields the rows of the query 'sql' run with the cursor 'c', 'fetchSize' rows at a time, and
+        reports it to the instrumentation with the time spent in the database once all are read.
+    """
+    start = time.time()
+    c.execute(sql, args)
+    seconds = time.time() - start
+    rowNumber = 0
+    while True:
+        start = time.time()
+        rows = c.fetchmany(fetchSize)
+        seconds += time.time() - start
+        if rows == []:
+            break
+        rowNumber += len(rows)
+        for row in rows:
+            yield row
+    instrumentation.recordStatement("sql", sql, seconds, rowNumber)
+
+def encodeField(field):
+    """ A value of a SQLite row as a CSV field, as the CSV format of COPY writes it."""
+    if field is None:
+        return ""
+    if isinstance(field, unicode):
+        return field.encode("utf-8")
+    return field
+
+def scriptStatements(script):
+    """ The statements of the SQL script 'script', one by one (executescript would commit the
+        transaction they run in first).
+    """
+    statement = ""
+    for line in script.splitlines(True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+def decodeField(field):
+    """ A CSV field as a SQLite value: an empty field is NULL, as for COPY."""
+    return None if field == "" else field.decode("utf-8")
+
+
+def backendFromEnvironment(pageSize=1000):
+    """ Returns the backend chosen by the environment variable TOURNAMENT_DATABASE."""
+    database = os.environ.get("TOURNAMENT_DATABASE", "postgresql")
+    if database.startswith("sqlite:"):
+        return SQLiteBackend(database[len("sqlite:"):])
+    if database == "postgresql":
+        return PostgresBackend(pageSize=pageSize)
+    return PostgresBackend(database, pageSize)
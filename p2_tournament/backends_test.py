@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# backends_test.py -- tests of the storage backends of backends.py: the default configuration and
+# the SQLite schema created by connections opened at once. No database server needed.
+#
+# Usage: python backends_test.py
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+from backends import SQLiteBackend
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class BackendsTest(unittest.TestCase):
+
+    def testDefaultBackendImports(self):
+        """ tournament.py imports with the default (PostgreSQL) backend; no connection is opened."""
+        env = dict(os.environ)
+        env.pop("TOURNAMENT_DATABASE", None)
+        output = subprocess.check_output([sys.executable, "-c", "import tournament; print tournament.backend.name"],
+                                         cwd=DIRECTORY, env=env, stderr=subprocess.STDOUT)
+        self.assertEqual(output.strip(), "postgresql")
+
+    def testSchemaCreatedOnce(self):
+        """ Connections opened at once on a new SQLite file create its tables once, without error."""
+        directory = tempfile.mkdtemp()
+        try:
+            backend = SQLiteBackend(os.path.join(directory, "tournament.db"))
+            errors, players = [], []
+
+            def connect():
+                try:
+                    conn = backend.connect()
+                    players.append(conn.execute("select count(*) from Players").fetchone()[0])
+                    conn.close()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=connect) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(players, [1] * 8) # the dummy player, inserted once.
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# batch.py -- process many tournaments at once, without the interactive menu.
+#
+# Usage: python batch.py pairings|standings [--workers N] [--processes] (--all | tournament ids...)
+#
+#   pairings:  create the next round of every tournament.
+#   standings: recompute the Standings table of every tournament.
+
+import sys
+import time
+import argparse
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from tournament import *
+
+def processTournament(task):
+    """ Run the operation on one tournament, in its own transaction.
+        Returns (tourNum, None, seconds) or (tourNum, error message, seconds); an error of one
+        tournament never stops the others.
+    """
+    operation, tourNum = task
+    start = time.time()
+    try:
+        if operation == "pairings":
+            addRound(tourNum)
+        elif operation == "standings":
+            rebuildStandings(tourNum)
+        else:
+            raise ValueError("Unknown operation: {0}".format(operation))
+        return tourNum, None, time.time() - start
+    except Exception as e:
+        return tourNum, "{0}: {1}".format(type(e).__name__, e), time.time() - start
+
+def runBatch(operation, tourNums, workers=POOL_MAX_CONNECTIONS, processes=False):
+    """ Run the operation ("pairings" or "standings") on all the tournaments 'tourNums' with a pool
+        of 'workers' threads sharing the connection pool, or 'workers' processes with a connection
+        pool each if 'processes' is True (the pairing engine then runs in parallel too).
+
+        Returns a summary dict:
+            operation, tournaments, succeeded, failed (a list of (tourNum, error)),
+            seconds (wall-clock), perSecond (tournaments per second), slowest (tourNum, seconds).
+    """
+    tasks = [(operation, tourNum) for tourNum in tourNums]
+    start = time.time()
+
+    if processes:
+        connectionPool.closeAll() # the child processes must not share the connections of this one.
+        workerPool = Pool(workers)
+    else:
+        workerPool = ThreadPool(workers)
+    try:
+        results = workerPool.map(processTournament, tasks)
+    finally:
+        workerPool.close()
+        workerPool.join()
+
+    seconds = time.time() - start
+    failed = [(tourNum, error) for tourNum, error, taskSeconds in results if error is not None]
+    slowest = max(results, key=lambda result: result[2]) if results else (None, None, 0)
+    return {"operation" : operation,
+            "tournaments" : len(tasks),
+            "succeeded" : len(tasks) - len(failed),
+            "failed" : failed,
+            "seconds" : seconds,
+            "perSecond" : len(tasks) / seconds if seconds > 0 else 0.0,
+            "slowest" : (slowest[0], slowest[2])}
+
+def showSummary(summary):
+    print "\n {0} of {1} tournaments: {2} succeeded, {3} failed in {4:.2f} s ({5:.1f} tournaments/s)".format(
+        summary["operation"], summary["tournaments"], summary["succeeded"], len(summary["failed"]),
+        summary["seconds"], summary["perSecond"])
+    print " slowest: tournament {0} ({1:.1f} ms)".format(summary["slowest"][0], summary["slowest"][1] * 1000)
+    showRows("Failures:\n\n tourNumber, error", summary["failed"])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Process many tournaments at once.")
+    parser.add_argument("operation", choices=["pairings", "standings"])
+    parser.add_argument("tournaments", nargs="*", type=int, help="the ids of the tournaments")
+    parser.add_argument("--all", action="store_true", help="process all the tournaments")
+    parser.add_argument("--workers", type=int, default=POOL_MAX_CONNECTIONS)
+    parser.add_argument("--processes", action="store_true", help="use processes instead of threads")
+    args = parser.parse_args()
+
+    tourNums = args.tournaments
+    if args.all:
+        tourNums = [row[0] for row in db_CRUD([{"sql" : "select id from Tournaments order by id;", "args" : []}])]
+    try:
+        showSummary(runBatch(args.operation, tourNums, args.workers, args.processes))
+    finally:
+        connectionPool.closeAll()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py, run against the tournament database (or the SQLite backend, e.g.
+# TOURNAMENT_DATABASE=sqlite::memory: python benchmark.py suite).
+#
+# Usage: python benchmark.py standings [player numbers...]
+#        python benchmark.py pairings [player numbers...]
+#        python benchmark.py tiebreaks [player numbers...] [--rounds N]
+#        python benchmark.py suite [player numbers...] [--rounds N] [--draw-rate X] [--repeat N]
+#                                  [--json FILE] [--compare FILE]
+#
+#   standings: the standing list of the former function chain (PostgreSQL only), of standings_fn
+#              (the computedStandings statement) and of the Standings table kept by the triggers (the
+#              standings statement), checked against each other.
+#   pairings:  the pairing engine alone, in memory.
+#   tiebreaks: the standing list of tiebreaks.py (points, Buchholz, Sonneborn-Berger) alone, in memory.
+#   suite:     registerPlayer, setByePlayer, swissPairings, playerStandings, insertPairs and
+#              recordMatchResults in isolation, and whole rounds end to end, on synthetic tournaments
+#              of growing sizes (odd sizes have byes): latency percentiles, queries per call and the
+#              scaling curves, optionally saved as JSON and compared with a former run.
+
+import time
+import json
+import argparse
+from random import random, shuffle
+from math import log, ceil
+
+import tournament
+from tournament import *
+from pairing import swissPairs
+import tiebreaks
+from instrumentation import percentile
+
+# The standing list computed with the former chain of functions, to compare with standings_fn.
+FUNCTION_CHAIN_STANDINGS = "select t1.id, name, wins, opp_wins, matches \
+                            from (select p.id as id, p.name as name, wins, matches \
+                                  from matches_number_fn(%s, %s) p \
+                                       left join wins_fn(%s, %s) w \
+                                       on p.id = w.id) t1 \
+                                 left join total_opponent_wins_fn(%s, %s) t2 \
+                                 on t1.id = t2.id \
+                            order by wins desc, opp_wins desc;"
+
+DRAW_RATE = 0.1
+
+def createSyntheticTournament(playerNum, roundsToPlay, drawRate=DRAW_RATE):
+    """ Create a tournament of 'playerNum' new players and play 'roundsToPlay' rounds with random
+        pairs and random results ('drawRate' of them draws). With an odd number of players, the
+        dummy player is registered and every round has a bye player chosen by setByePlayer.
+        Returns the id of the tournament.
+    """
+    tourNum = db_CRUD([{"sql" : "insert into Tournaments (name) values (%s) returning id;",
+                        "args" : ["Benchmark {0} players".format(playerNum)]}])[0][0]
+
+    playerIds = registerPlayers(tourNum, ["Benchmark player {0}".format(i) for i in range(1, playerNum + 1)])
+
+    for roundNum in range(1, roundsToPlay + 1):
+        pairingList, byePlayer = setByePlayer(tourNum) if playerNum % 2 != 0 else ([], 0)
+        players = [playerId for playerId in playerIds if playerId != byePlayer]
+        shuffle(players)
+        pairs = zip(players[0::2], players[1::2])
+        insertPairs(pairingList + [(p1, "", p2, "") for p1, p2 in pairs], tourNum, roundNum)
+        recordMatchResults(tourNum, roundNum,
+                           [(byePlayer, 0, byePlayer)] * (byePlayer != 0) +
+                           [(p1, p2, -1 if random() < drawRate else p1) for p1, p2 in pairs])
+    return tourNum
+
+class Rollback(Exception):
+    """ Raised to roll back the transaction of a measure, so that the next one starts from the same state."""
+
+def measureOnce(fn, args=()):
+    """ Returns (seconds, statements) of the call fn(*args)."""
+    with operation("benchmark") as stats:
+        fn(*args)
+    return stats["seconds"], stats["statements"]
+
+def measure(fn, repeat, setup=None):
+    """ Call fn(*setup()) 'repeat' times, every call in a transaction rolled back afterwards so that
+        the next one starts from the same state, and return a list of (seconds, statements) per call.
+        setup() is not measured.
+    """
+    measures = []
+    for i in range(repeat):
+        try:
+            with transaction():
+                measures.append(measureOnce(fn, setup() if setup else ()))
+                raise Rollback()
+        except Rollback:
+            pass
+    return measures
+
+def summary(playerNum, operation, measures):
+    """ The latency percentiles (in seconds) and the mean number of statements of the measures of an operation."""
+    times = sorted(seconds for seconds, statements in measures)
+    return {"players" : playerNum, "operation" : operation, "calls" : len(times),
+            "mean" : sum(times) / len(times), "p50" : percentile(times, 50), "p90" : percentile(times, 90),
+            "p99" : percentile(times, 99), "max" : times[-1],
+            "queriesPerCall" : float(sum(statements for seconds, statements in measures)) / len(measures)}
+
+def randomResults(pairingList, drawRate):
+    """ Random results (p1, p2, winner) of the pairs of a pairingList; a bye player always wins."""
+    return [(id1, id2, id1 if id2 == 0 else -1 if random() < drawRate else id2)
+            for id1, name1, id2, name2 in pairingList]
+
+def benchmarkOperations(playerNum, roundsToPlay, drawRate, repeat):
+    """ Time the hot operations in isolation on a synthetic tournament of 'playerNum' players which
+        has played 'roundsToPlay' - 1 rounds, then every round of a new tournament end to end.
+        Returns a list of summaries.
+    """
+    results = []
+    tourNum = createSyntheticTournament(playerNum, roundsToPlay - 1, drawRate)
+    roundNum = roundsToPlay
+    try:
+        def pairingList():
+            return (swissPairings(tourNum, roundNum),)
+
+        def pairedRound():
+            pairingList = swissPairings(tourNum, roundNum)
+            insertPairs(pairingList, tourNum, roundNum)
+            return (randomResults(pairingList, drawRate),)
+
+        operations = [
+            ("registerPlayer", registerPlayer, lambda: ("Benchmark new player",)),
+            ("setByePlayer", lambda: setByePlayer(tourNum), None),
+            ("swissPairings", lambda: swissPairings(tourNum, roundNum), None),
+            ("playerStandings", lambda: playerStandings(tourNum, roundNum - 1), None),
+            ("insertPairs", lambda pairs: insertPairs(pairs, tourNum, roundNum), pairingList),
+            ("recordMatchResults", lambda results: recordMatchResults(tourNum, roundNum, results), pairedRound),
+        ]
+        for operation, fn, setup in operations:
+            results.append(summary(playerNum, operation, measure(fn, repeat, setup)))
+
+        # Outside of a transaction, the standing list of a finished round comes from the read cache.
+        playerStandings(tourNum, roundNum - 1)
+        results.append(summary(playerNum, "playerStandings (cached)",
+                               [measureOnce(playerStandings, (tourNum, roundNum - 1)) for i in range(repeat)]))
+    finally:
+        dropTournament(tourNum, withPlayers=True)
+
+    # Whole rounds: bye, standings, pairing, writing the pairs and then the results.
+    tourNum = createSyntheticTournament(playerNum, 0, drawRate)
+    try:
+        def playRound():
+            roundNum, pairingList, timings = addRound(tourNum)
+            recordMatchResults(tourNum, roundNum, randomResults(pairingList, drawRate))
+
+        results.append(summary(playerNum, "round (end to end)",
+                               [measureOnce(playRound) for i in range(roundsToPlay)]))
+    finally:
+        dropTournament(tourNum, withPlayers=True)
+    return results
+
+def showSuite(results, baseline=None):
+    """ Print the percentiles of every operation, and the scaling curves (p50 by number of players).
+        'baseline' is the list of results of a former run to compare with.
+    """
+    former = dict(((result["players"], result["operation"]), result["p50"]) for result in baseline or [])
+    print "\n {0:>8} {1:<26} {2:>6} {3:>9} {4:>9} {5:>9} {6:>9} {7:>8} {8}".format(
+        "players", "operation", "calls", "p50 ms", "p90 ms", "p99 ms", "max ms", "queries",
+        "speedup" if baseline else "")
+    for result in results:
+        key = (result["players"], result["operation"])
+        print " {0:>8} {1:<26} {2:>6} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>9.2f} {7:>8.1f} {8}".format(
+            result["players"], result["operation"], result["calls"], result["p50"] * 1000,
+            result["p90"] * 1000, result["p99"] * 1000, result["max"] * 1000, result["queriesPerCall"],
+            "{0:.2f}x".format(former[key] / max(result["p50"], 1e-9)) if key in former else "")
+
+    playerNumbers = sorted(set(result["players"] for result in results))
+    operations = []
+    for result in results:
+        if result["operation"] not in operations:
+            operations.append(result["operation"])
+    p50 = dict(((result["players"], result["operation"]), result["p50"]) for result in results)
+
+    print "\n Scaling, p50 (ms) by number of players:\n"
+    print " {0:<26}".format("operation") + "".join(" {0:>10}".format(playerNum) for playerNum in playerNumbers)
+    for operation in operations:
+        print " {0:<26}".format(operation) + "".join(" {0:>10.2f}".format(p50[(playerNum, operation)] * 1000)
+                                                     for playerNum in playerNumbers)
+
+def benchmarkSuite(playerNumbers, rounds=None, drawRate=DRAW_RATE, repeat=20, jsonPath=None, comparePath=None):
+    """ Run benchmarkOperations for every number of players ('rounds' rounds, or ceil(log2(players))),
+        print the results, compared with the JSON file 'comparePath' if given, and save them as JSON
+        into 'jsonPath'. Returns the list of summaries.
+    """
+    results = []
+    for playerNum in playerNumbers:
+        roundsToPlay = rounds or max(2, int(ceil(log(playerNum, 2))))
+        results.extend(benchmarkOperations(playerNum, roundsToPlay, drawRate, repeat))
+
+    baseline = None
+    if comparePath:
+        with open(comparePath) as baselineFile:
+            baseline = json.load(baselineFile)["results"]
+    showSuite(results, baseline)
+
+    if jsonPath:
+        with open(jsonPath, "w") as jsonFile:
+            json.dump({"backend" : tournament.backend.name, "time" : time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "drawRate" : drawRate, "repeat" : repeat, "results" : results},
+                      jsonFile, indent=2, sort_keys=True)
+        print "\n Results saved into", jsonPath
+    return results
+
+def timeIt(fn, repeat):
+    """ Returns the median time in seconds of 'repeat' calls of fn()."""
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+def benchmarkStandings(playerNumbers, repeat=5):
+    """ Compare the standing list of the function chain, of standings_fn and of the Standings table
+        for growing tournaments. The function chain only exists in the PostgreSQL database; the
+        speedup is the one of the Standings table over the function chain (over standings_fn on SQLite).
+    """
+    withChain = backend.name == "postgresql"
+    print "\n Standing list after ceil(log2(players)) rounds, median of {0} runs (ms):\n".format(repeat)
+    print " {0:>8} {1:>8} {2:>16} {3:>14} {4:>16} {5:>8}".format(
+        "players", "rounds", "function chain", "standings_fn", "Standings table", "speedup")
+
+    for playerNum in playerNumbers:
+        roundNum = int(ceil(log(playerNum, 2)))
+        tourNum = createSyntheticTournament(playerNum, roundNum)
+        try:
+            args = [tourNum, roundNum]
+            chain = lambda: db_CRUD([{"sql" : FUNCTION_CHAIN_STANDINGS, "args" : args * 3}])
+            computed = lambda: db_CRUD([{"prepared" : "computedStandings", "args" : args}])
+            stored = lambda: db_CRUD([{"prepared" : "standings", "args" : args}])
+
+            if sorted(computed()) != sorted(stored()):
+                raise ValueError("The Standings table differs from standings_fn for {0} players."
+                                 .format(playerNum))
+            if withChain and sorted(chain()) != sorted(computed()):
+                raise ValueError("standings_fn differs from the function chain for {0} players."
+                                 .format(playerNum))
+
+            chainTime = timeIt(chain, repeat) if withChain else None
+            computedTime = timeIt(computed, repeat)
+            storedTime = timeIt(stored, repeat)
+            print " {0:>8} {1:>8} {2:>16} {3:>14.1f} {4:>16.1f} {5:>7.1f}x".format(
+                playerNum, roundNum, "{0:.1f}".format(chainTime * 1000) if withChain else "-",
+                computedTime * 1000, storedTime * 1000, (chainTime if withChain else computedTime) / storedTime)
+        finally:
+            dropTournament(tourNum, withPlayers=True)
+
+def benchmarkPairings(playerNumbers):
+    """ Time the pairing engine alone (in memory, no database) over all the rounds of tournaments
+        with random results, checking that nobody meets the same opponent twice.
+    """
+    print "\n Pairing engine over ceil(log2(players)) rounds (ms):\n"
+    print " {0:>8} {1:>8} {2:>12} {3:>12}".format("players", "rounds", "mean/round", "worst round")
+
+    for playerNum in playerNumbers:
+        roundNum = int(ceil(log(playerNum, 2)))
+        wins = dict((playerId, 0) for playerId in range(1, playerNum + 1))
+        opponents = dict((playerId, set()) for playerId in wins)
+
+        times = []
+        for i in range(roundNum):
+            standing = sorted(wins, key=lambda playerId: -wins[playerId])
+            start = time.time()
+            pairs = swissPairs(standing, [wins[playerId] for playerId in standing], opponents)
+            times.append(time.time() - start)
+
+            for p1, p2 in pairs:
+                if p2 in opponents[p1]:
+                    raise ValueError("The players {0} and {1} met twice.".format(p1, p2))
+                opponents[p1].add(p2)
+                opponents[p2].add(p1)
+                if random() >= DRAW_RATE:
+                    wins[p1 if random() < 0.5 else p2] += 1
+
+        print " {0:>8} {1:>8} {2:>12.1f} {3:>12.1f}".format(
+            playerNum, roundNum, sum(times) / len(times) * 1000, max(times) * 1000)
+
+def benchmarkTiebreaks(playerNumbers, rounds=15, repeat=5):
+    """ Time tiebreaks.rankPlayers alone (in memory, no database) over 'rounds' rounds of random
+        pairings and results, with numpy if it is installed.
+    """
+    print "\n Points, Buchholz and Sonneborn-Berger after {0} rounds, median of {1} runs (ms, {2}):\n".format(
+        rounds, repeat, "numpy" if tiebreaks.numpy is not None else "no numpy")
+    print " {0:>8} {1:>10} {2:>10}".format("players", "matches", "time")
+
+    for playerNum in playerNumbers:
+        playerIds = range(1, playerNum + 1)
+        matches = []
+        for i in range(rounds):
+            order = list(playerIds)
+            shuffle(order)
+            if playerNum % 2 != 0:
+                byePlayer = order.pop()
+                matches.append((0, byePlayer, byePlayer))
+            for k in range(0, len(order), 2):
+                p1, p2 = sorted(order[k:k + 2])
+                matches.append((p1, p2, -1 if random() < DRAW_RATE else (p1 if random() < 0.5 else p2)))
+
+        elapsed = timeIt(lambda: tiebreaks.rankPlayers(playerIds, matches, tiebreaks.SCORING,
+                                                       ("buchholz", "sonneborn-berger")), repeat)
+        print " {0:>8} {1:>10} {2:>10.1f}".format(playerNum, len(matches), elapsed * 1000)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the hot paths of tournament.py.")
+    parser.add_argument("benchmark", nargs="?", default="standings", choices=["standings", "pairings", "tiebreaks", "suite"])
+    parser.add_argument("players", nargs="*", type=int, help="the numbers of players")
+    parser.add_argument("--rounds", type=int, help="the rounds of the synthetic tournaments (suite, tiebreaks)")
+    parser.add_argument("--draw-rate", type=float, default=DRAW_RATE)
+    parser.add_argument("--repeat", type=int, default=20, help="the calls per operation (suite)")
+    parser.add_argument("--json", help="save the results of the suite into this file")
+    parser.add_argument("--compare", help="compare the suite with the results saved into this file")
+    args = parser.parse_args()
+
+    DRAW_RATE = args.draw_rate
+    try:
+        if args.benchmark == "standings":
+            benchmarkStandings(args.players or [16, 64, 256, 1024])
+        elif args.benchmark == "pairings":
+            benchmarkPairings(args.players or [16, 1000, 10000])
+        elif args.benchmark == "tiebreaks":
+            benchmarkTiebreaks(args.players or [16, 1000, 10000], args.rounds or 15)
+        else:
+            benchmarkSuite(args.players or [15, 64, 255, 1024], args.rounds, args.draw_rate, args.repeat,
+                           args.json, args.compare)
+    finally:
+        tournament.connectionPool.closeAll()
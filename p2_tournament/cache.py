@@ -0,0 +1,117 @@
+"""
+ cache.py -- a thread-safe LRU cache of query results used by tournament.py
+"""
+import threading
+from collections import OrderedDict
+
+
+class ReadCache(object):
+    """ Keeps the results of up to 'maxEntries' reads, the least recently used one being dropped first.
+
+        - A key is a tuple whose first item is the tournament the result belongs to, e.g.
+          (tourNum, "standings", roundNum), so all the results of a tournament can be dropped
+          at once by invalidate(tourNum) when it is written to.
+        - A result read while the tournament was invalidated by another thread is returned but not
+          kept, so a late reader can never put an outdated result back in the cache.
+        - maxEntries = 0 disables the cache.
+
+        Counters (see statistics()):
+            hits: a read served by the cache.
+            misses: a read that had to call the database.
+            invalidations: calls to invalidate() and clear().
+            evictions: results dropped because the cache was full.
+    """
+
+    def __init__(self, maxEntries=1024):
+        if maxEntries < 0:
+            raise ValueError("The cache size must be >= 0.")
+
+        self.maxEntries = maxEntries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> result, the most recently used last.
+        self.generations = {}        # tourNum -> number of invalidations of the tournament.
+        self.epoch = 0               # number of clear() calls.
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, key, loadFn):
+        """ Returns the result kept for 'key', or the result of loadFn() which is kept for next time."""
+        with self.lock:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.counters["hits"] += 1
+                return value
+            self.counters["misses"] += 1
+            version = (self.epoch, self.generations.get(key[0], 0))
+
+        value = loadFn()
+
+        self.keep(key, value, version)
+        return value
+
+    def stream(self, key, rowsFn, maxRows):
+        """ Yields the rows kept for 'key', or the rows of the iterator rowsFn() as they come; they are
+            kept for next time only if there are no more than 'maxRows' of them, so a large result is
+            never held in memory.
+        """
+        with self.lock:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.counters["hits"] += 1
+            else:
+                value = None
+                self.counters["misses"] += 1
+                version = (self.epoch, self.generations.get(key[0], 0))
+
+        if value is not None:
+            for row in value:
+                yield row
+            return
+
+        kept = [] if self.maxEntries > 0 else None
+        for row in rowsFn():
+            if kept is not None:
+                kept.append(row)
+                if len(kept) > maxRows:
+                    kept = None
+            yield row
+
+        if kept is not None:
+            self.keep(key, kept, version)
+
+    def keep(self, key, value, version):
+        """ Keep the result 'value' read at the 'version' of its tournament, unless the tournament
+            has been invalidated since then, and drop the least recently used result if the cache is full.
+        """
+        with self.lock:
+            if self.maxEntries > 0 and version == (self.epoch, self.generations.get(key[0], 0)):
+                self.entries[key] = value
+                if len(self.entries) > self.maxEntries:
+                    self.entries.popitem(last=False)
+                    self.counters["evictions"] += 1
+
+    def invalidate(self, tourNum):
+        """ Drop all the results of the tournament 'tourNum'."""
+        with self.lock:
+            self.generations[tourNum] = self.generations.get(tourNum, 0) + 1
+            for key in [key for key in self.entries if key[0] == tourNum]:
+                del self.entries[key]
+            self.counters["invalidations"] += 1
+
+    def clear(self):
+        """ Drop all the results, e.g. when a whole table is emptied."""
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+            self.counters["invalidations"] += 1
+
+    def statistics(self):
+        """ Returns the counters, the hit rate and the number of entries of the cache."""
+        with self.lock:
+            statistics = dict(self.counters)
+            statistics["entries"] = len(self.entries)
+            statistics["maxEntries"] = self.maxEntries
+        reads = statistics["hits"] + statistics["misses"]
+        statistics["hitRate"] = float(statistics["hits"]) / reads if reads else 0.0
+        return statistics
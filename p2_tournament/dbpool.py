@@ -0,0 +1,199 @@
+"""
+ dbpool.py -- a thread-safe pool of reusable database connections used by tournament.py
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(RuntimeError):
+    """ Raised when no connection became free within the timeout of the pool."""
+
+
+class ConnectionPool(object):
+    """ Keeps up to 'maxConnections' connections made by 'connectFn' and lends them out.
+
+        - 'minConnections' connections are opened the first time the pool is used, so the
+          first queries already find a warm connection.
+        - A connection that has been idle for more than 'healthCheckInterval' seconds is
+          checked with "select 1" before it is lent out again; a closed or broken connection
+          is dropped and replaced by a new one.
+        - When all the 'maxConnections' connections are in use, the caller waits until one
+          is returned, at most 'timeout' seconds (None means wait forever).
+
+        Counters (see statistics()):
+            hits: a request served by an idle connection.
+            misses: a request that had to open a new connection.
+            waits: a request that had to wait for a connection to be returned.
+            discarded: broken connections dropped by the pool.
+    """
+
+    def __init__(self, connectFn, minConnections=1, maxConnections=8,
+                 healthCheckInterval=30.0, timeout=None):
+        if minConnections < 0 or maxConnections < 1 or minConnections > maxConnections:
+            raise ValueError("The pool size must be 0 <= minConnections <= maxConnections and maxConnections >= 1.")
+
+        self.connectFn = connectFn
+        self.minConnections = minConnections
+        self.maxConnections = maxConnections
+        self.healthCheckInterval = healthCheckInterval
+        self.timeout = timeout
+
+        self.condition = threading.Condition()
+        self.idle = []       # (connection, time it was returned to the pool), the most recent last.
+        self.opened = 0      # connections currently open, idle or lent out.
+        self.warm = False
+        self.counters = {"hits": 0, "misses": 0, "waits": 0, "discarded": 0}
+
+    def getConnection(self):
+        """ Lend out an idle connection, open a new one, or wait for one to be returned."""
+        self.warmUp()
+
+        while True:
+            conn, returnedAt = self.takeIdleOrReserve()
+            if conn is None: # a slot was reserved for a new connection.
+                return self.openConnection()
+
+            if self.isHealthy(conn, returnedAt):
+                with self.condition:
+                    self.counters["hits"] += 1
+                return conn
+
+            self.discard(conn)
+
+    def putConnection(self, conn, broken=False):
+        """ Give back a connection. A broken or closed connection is dropped."""
+        if broken or conn.closed:
+            self.discard(conn)
+            return
+
+        with self.condition:
+            self.idle.append((conn, time.time()))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection for the duration of a 'with' block.
+            If the block raises (or is left by a KeyboardInterrupt or the close() of a generator),
+            the transaction is rolled back before the connection is returned.
+        """
+        conn = self.getConnection()
+        try:
+            yield conn
+        except BaseException:
+            broken = False
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            self.putConnection(conn, broken)
+            raise
+        else:
+            self.putConnection(conn)
+
+    def statistics(self):
+        """ Return the counters together with the current number of open and idle connections."""
+        with self.condition:
+            stats = dict(self.counters)
+            stats["opened"] = self.opened
+            stats["idle"] = len(self.idle)
+            stats["inUse"] = self.opened - len(self.idle)
+        return stats
+
+    def closeAll(self):
+        """ Close all the idle connections, e.g. at the end of the program."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.opened -= len(idle)
+            self.warm = False
+            self.condition.notify_all()
+        for conn, returnedAt in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    #--------------------------------------------------------------------------------------#
+
+    def warmUp(self):
+        """ Open 'minConnections' connections the first time the pool is used."""
+        with self.condition:
+            if self.warm:
+                return
+            self.warm = True
+            missing = max(self.minConnections - self.opened, 0)
+            self.opened += missing
+
+        for i in range(missing):
+            try:
+                conn = self.connectFn()
+            except Exception:
+                # Give back the slots of this connection and of the ones not opened yet, and let
+                # the next use of the pool try the warm-up again.
+                with self.condition:
+                    self.opened -= missing - i
+                    self.warm = False
+                    self.condition.notify_all()
+                raise
+            self.putConnection(conn)
+
+    def takeIdleOrReserve(self):
+        """ Return (connection, returnedAt) of the most recently used idle connection,
+            or (None, None) after reserving a slot for a new connection.
+        """
+        with self.condition:
+            waited = False
+            deadline = None if self.timeout is None else time.time() + self.timeout
+            while True:
+                if self.idle:
+                    return self.idle.pop()
+                if self.opened < self.maxConnections:
+                    self.opened += 1
+                    self.counters["misses"] += 1
+                    return None, None
+
+                if not waited:
+                    self.counters["waits"] += 1
+                    waited = True
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout("No database connection became free within {0} seconds."
+                                          .format(self.timeout))
+                    self.condition.wait(remaining)
+
+    def openConnection(self):
+        try:
+            return self.connectFn()
+        except Exception:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+    def isHealthy(self, conn, returnedAt):
+        if conn.closed:
+            return False
+        if self.healthCheckInterval is None or time.time() - returnedAt < self.healthCheckInterval:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("select 1;")
+            c.fetchall()
+            c.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.opened -= 1
+            self.counters["discarded"] += 1
+            self.condition.notify()
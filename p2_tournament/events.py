@@ -0,0 +1,296 @@
+"""
+ events.py -- the change events of the tournaments and the live standing lists following them.
+
+ tournament.py publishes an event (a dict) once a change of a tournament is committed:
+   {"type": "matchesCreated", "tournament": ..., "round": R, "pairs": [[id1, name1, id2, name2], ...],
+    "deltas": [...]}                                          the matches of the new round R (insertPairs)
+   {"type": "resultsRecorded", "tournament": ..., "round": R, "results": [[p1, p2, winner, former], ...],
+    "deltas": [...]}                                          results of the round R (recordMatchResults),
+                                                              former: the winner they replace, or None
+   {"type": "roundDeleted", "tournament": ..., "round": R, "deltas": [...]}   the round R (deleteRound)
+ deltas: the changes of the last standing list, a list of [player id, wins, opp_wins, matches] to add
+ (the dummy player left out), so a LiveStandings follows a tournament without reading it again.
+
+ The events go through the in-process pub/sub 'bus' (subscribe/publish). With PostgreSQL they can be
+ sent with NOTIFY on the channel NOTIFY_CHANNEL too (TOURNAMENT_NOTIFY=1, see tournament.py), in the
+ transaction of the change, and a PostgresListener of another process publishes them on its own bus.
+"""
+import json
+import uuid
+import select
+import itertools
+import threading
+import traceback
+from collections import defaultdict
+
+# The PostgreSQL channel of the events, and the largest NOTIFY payload sent (the server takes 8000 bytes).
+NOTIFY_CHANNEL = "tournament_events"
+NOTIFY_PAYLOAD_SIZE = 7000
+
+# The events published by this process carry its origin, so that its own listener skips them.
+ORIGIN = uuid.uuid4().hex
+
+class EventBus(object):
+    """ Calls the subscribers of a tournament (or of all the tournaments) with every event published
+        for it, in the thread which publishes it. An error of a subscriber is printed and does not
+        stop the others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {} # subscription number -> (tourNum or None, callback)
+        self.numbers = itertools.count(1)
+
+    def subscribe(self, callback, tourNum=None):
+        """ Call callback(event) with the events of the tournament 'tourNum' (all of them if None).
+            Returns the subscription, to be passed to unsubscribe.
+        """
+        with self.lock:
+            subscription = next(self.numbers)
+            self.subscribers[subscription] = (tourNum, callback)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.pop(subscription, None)
+
+    def subscribed(self):
+        return len(self.subscribers) > 0
+
+    def publish(self, event):
+        with self.lock:
+            callbacks = [callback for tourNum, callback in self.subscribers.values()
+                         if tourNum is None or tourNum == event["tournament"]]
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                traceback.print_exc()
+
+# The bus of this process.
+bus = EventBus()
+
+def addDeltas(deltas, playerId, wins=0, oppWins=0, matches=0):
+    if playerId != 0: # the dummy player is not in the standing lists.
+        delta = deltas[playerId]
+        delta[0] += wins
+        delta[1] += oppWins
+        delta[2] += matches
+
+def deltaList(deltas, keepZeros=False):
+    return [[playerId] + delta for playerId, delta in sorted(deltas.items()) if keepZeros or delta != [0, 0, 0]]
+
+def matchesCreated(tourNum, roundNum, pairingList, wins, opponents):
+    """ The event of the new matches 'pairingList' (id1, name1, id2, name2) of the round 'roundNum'.
+        wins: {player id: wins} at the end of the round before, opponents: the OpponentGraph before
+        the matches; two new opponents add the wins of each other to their opp_wins.
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for id1, name1, id2, name2 in pairingList:
+        met = opponents.met(id1, id2)
+        addDeltas(deltas, id1, oppWins=0 if met else wins.get(id2, 0))
+        addDeltas(deltas, id2, oppWins=0 if met else wins.get(id1, 0))
+    return {"type" : "matchesCreated", "tournament" : tourNum, "round" : roundNum,
+            "pairs" : [list(pair) for pair in pairingList],
+            "deltas" : deltaList(deltas, keepZeros=True)} # the first opp_wins of a player may be 0.
+
+def resultsRecorded(tourNum, roundNum, results, formerWinners, opponents):
+    """ The event of the results (p1, p2, winner) of the round 'roundNum'.
+        formerWinners: {(p1, p2): the winner recorded before, or None}, opponents: the OpponentGraph.
+        A winner earns a win and a win for the opp_wins of every one of his or her opponents; a
+        result replacing another one takes that one back first.
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    rows = []
+
+    def apply(p1, p2, winner, sign):
+        if winner is None:
+            return
+        if p1 != 0 and p2 != 0:
+            addDeltas(deltas, p1, matches=sign)
+            addDeltas(deltas, p2, matches=sign)
+        if winner != -1:
+            addDeltas(deltas, winner, wins=sign)
+            for opponent in opponents.opponentsOf(winner):
+                addDeltas(deltas, opponent, oppWins=sign)
+
+    for p1, p2, winner in results:
+        p1, p2 = min(p1, p2), max(p1, p2)
+        former = formerWinners.get((p1, p2))
+        rows.append([p1, p2, winner, former])
+        if winner != former:
+            apply(p1, p2, former, -1)
+            apply(p1, p2, winner, 1)
+    return {"type" : "resultsRecorded", "tournament" : tourNum, "round" : roundNum, "results" : rows,
+            "deltas" : deltaList(deltas)}
+
+def roundDeleted(tourNum, roundNum, standingsBefore, standingsAfter):
+    """ The event of the deletion of the round 'roundNum': the deltas turn the standing list of
+        that round (standingsBefore) into the one of the round before (standingsAfter).
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    before = dict((row[0], row) for row in standingsBefore)
+    for playerId, name, wins, oppWins, matches in standingsAfter:
+        if playerId in before:
+            formerId, formerName, formerWins, formerOppWins, formerMatches = before[playerId]
+            addDeltas(deltas, playerId, wins - formerWins, (oppWins or 0) - (formerOppWins or 0),
+                      matches - formerMatches)
+    return {"type" : "roundDeleted", "tournament" : tourNum, "round" : roundNum, "deltas" : deltaList(deltas)}
+
+notifyNumbers = itertools.count(1)
+
+def notifyPayloads(event):
+    """ The NOTIFY payloads of 'event': its JSON text cut into parts of NOTIFY_PAYLOAD_SIZE characters
+        at most, each one after a header line "origin event-id part parts".
+    """
+    text = json.dumps(event)
+    eventId = "{0}-{1}".format(ORIGIN, next(notifyNumbers))
+    chunks = [text[i:i + NOTIFY_PAYLOAD_SIZE] for i in range(0, len(text), NOTIFY_PAYLOAD_SIZE)]
+    return ["{0} {1} {2} {3}\n{4}".format(ORIGIN, eventId, i, len(chunks), chunk) for i, chunk in enumerate(chunks)]
+
+class PostgresListener(threading.Thread):
+    """ A thread listening to NOTIFY_CHANNEL on a connection of its own (opened with connectFn) and
+        publishing the events of the other processes on 'eventBus', after calling received(event) if
+        given (e.g. to drop the cached reads of the tournament). stop() ends it.
+    """
+
+    def __init__(self, connectFn, eventBus=bus, channel=NOTIFY_CHANNEL, pollSeconds=1.0, received=None):
+        threading.Thread.__init__(self, name="tournament-events")
+        self.daemon = True
+        self.connectFn = connectFn
+        self.eventBus = eventBus
+        self.channel = channel
+        self.pollSeconds = pollSeconds
+        self.received = received
+        self.stopped = threading.Event()
+        self.parts = {} # event id -> the parts of the payload received so far.
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        conn = self.connectFn()
+        try:
+            conn.autocommit = True # LISTEN takes effect at once, outside of any transaction.
+            conn.cursor().execute("listen " + self.channel)
+            while not self.stopped.is_set():
+                if select.select([conn], [], [], self.pollSeconds) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.receive(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def receive(self, payload):
+        header, data = payload.split("\n", 1)
+        origin, eventId, part, partNumber = header.split()
+        if origin == ORIGIN: # published on this bus already.
+            return
+        parts = self.parts.setdefault(eventId, [None] * int(partNumber))
+        parts[int(part)] = data
+        if None not in parts:
+            del self.parts[eventId]
+            event = json.loads("".join(parts))
+            if self.received is not None:
+                self.received(event)
+            self.eventBus.publish(event)
+
+class LiveStandings(object):
+    """ The standing list of the last round of the tournament 'tourNum', kept up to date in memory
+        from its events: reading it (standings(), waitForChange()) sends no query.
+
+        load() gives the first standing list; the events received before are kept and applied
+        after it, the ones it already includes skipped (a round already created or deleted, results
+        already known), so the view can subscribe before it is loaded and miss nothing.
+        The results of a round before the last one are applied as they come.
+    """
+
+    def __init__(self, tourNum):
+        self.tourNum = tourNum
+        self.condition = threading.Condition()
+        self.roundNum = None
+        self.rows = {}      # player id -> [name, wins, opp_wins, matches]
+        self.results = None # (p1, p2) -> the winner of the matches of the last round, None if unknown.
+        self.pending = []   # the events received before load().
+        self.version = 0    # the number of changes applied.
+
+    def load(self, roundNum, standingList, matches):
+        """ Start from the standing list 'standingList' (as playerStandings returns it) of the round
+            'roundNum' and its matches (p1, p2, win).
+        """
+        with self.condition:
+            self.roundNum = roundNum
+            self.rows = dict((playerId, [name, wins, oppWins, matchNumber])
+                             for playerId, name, wins, oppWins, matchNumber in standingList)
+            self.results = dict(((p1, p2), win) for p1, p2, win in matches)
+            for event in self.pending:
+                self.applyEvent(event)
+            self.pending = []
+            self.version += 1
+            self.condition.notify_all()
+
+    def apply(self, event):
+        """ The subscriber of the events of the tournament."""
+        with self.condition:
+            if self.roundNum is None:
+                self.pending.append(event)
+            elif self.applyEvent(event):
+                self.version += 1
+                self.condition.notify_all()
+
+    def applyEvent(self, event):
+        """ Returns False if the event was skipped."""
+        roundNum = event["round"]
+        if event["type"] == "matchesCreated":
+            if roundNum <= self.roundNum:
+                return False
+            self.roundNum = roundNum
+            self.results = {}
+            for id1, name1, id2, name2 in event["pairs"]:
+                for playerId, name in [(id1, name1), (id2, name2)]:
+                    if playerId != 0 and playerId not in self.rows:
+                        self.rows[playerId] = [name, 0, None, 0]
+                self.results[(min(id1, id2), max(id1, id2))] = None
+
+        elif event["type"] == "resultsRecorded":
+            if roundNum > self.roundNum:
+                return False
+            if roundNum == self.roundNum and self.results is not None:
+                if all(self.results.get((p1, p2)) == winner for p1, p2, winner, former in event["results"]):
+                    return False
+                for p1, p2, winner, former in event["results"]:
+                    self.results[(p1, p2)] = winner
+
+        elif event["type"] == "roundDeleted":
+            if roundNum != self.roundNum:
+                return False
+            self.roundNum = roundNum - 1
+            self.results = None
+            if self.roundNum == 0: # the registered players, as playerStandings before the first round.
+                self.rows = dict((playerId, [row[0], 0, 0, 0]) for playerId, row in self.rows.items())
+                return True
+
+        for playerId, wins, oppWins, matches in event["deltas"]:
+            row = self.rows.get(playerId)
+            if row is not None:
+                row[1] += wins
+                row[2] = (row[2] or 0) + oppWins
+                row[3] += matches
+        return True
+
+    def standings(self):
+        """ Returns (the round, the standing list sorted as playerStandings sorts it, the version)."""
+        with self.condition:
+            rows = [(playerId, name, wins, oppWins, matches)
+                    for playerId, (name, wins, oppWins, matches) in self.rows.items()]
+            roundNum, version = self.roundNum, self.version
+        rows.sort(key=lambda row: (-row[2], row[3] is not None, -(row[3] or 0), row[0]))
+        return roundNum, rows, version
+
+    def waitForChange(self, version, timeout=None):
+        """ Wait until the version is no longer 'version' (or 'timeout' seconds), then return standings()."""
+        with self.condition:
+            if self.version == version:
+                self.condition.wait(timeout)
+        return self.standings()
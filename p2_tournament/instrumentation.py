@@ -0,0 +1,128 @@
+"""
+ instrumentation.py -- measures of the statements, connections and operations of tournament.py
+
+ The backends report every statement they send (with its time and the number of rows it returned or
+ changed) and tournament.py reports the connections it opens and borrows from the pool. These measures
+ are:
+   - counted by every operation() running in the same thread, e.g.
+         with operation("newRound") as stats:
+             generateRound(tourNum, roundNum)
+         print stats["statements"], stats["connections"]
+     (the public functions of tournament.py run as operations of their own, see instrumented),
+   - passed as events (dicts) to the hooks added with addHook, to log or aggregate them.
+
+ Event kinds:
+   {"event": "statement", "kind": "prepared"/"bulk"/"sql", "sql": the statement or its name,
+    "seconds": ..., "rows": the rows returned or changed (None if unknown)}
+   {"event": "connect", "seconds": ...}                     a new connection was opened
+   {"event": "checkout"}                                    a connection was borrowed from the pool
+   {"event": "plan", "name": statement name, "plan": text}  see explainStatements
+   {"event": "operation", "operation": name, "seconds": ..., and the counters of the operation}
+
+ Capture mode: the plans of the statements of queries.PREPARED named in explainStatements (e.g. the
+ standings statements, or with the environment variable TOURNAMENT_EXPLAIN=standings,computedStandings)
+ are captured before they are executed: EXPLAIN ANALYZE on PostgreSQL (which runs the query once more)
+ for the read statements of queries.READ_ONLY, a plain EXPLAIN (the plan without running it) for the
+ statements which write, EXPLAIN QUERY PLAN on SQLite.
+"""
+import os
+import time
+import threading
+from math import ceil
+from functools import wraps
+from contextlib import contextmanager
+
+# The functions called with every event, see addHook.
+hooks = []
+
+# The names of the statements of queries.PREPARED whose plans are captured.
+explainStatements = set(name for name in os.environ.get("TOURNAMENT_EXPLAIN", "").split(",") if name)
+
+# The counters of the operations running in the current thread, the innermost last.
+state = threading.local()
+
+
+def addHook(hook):
+    """ Call hook(event) with every event, in the thread that caused it."""
+    hooks.append(hook)
+
+def removeHook(hook):
+    hooks.remove(hook)
+
+def emit(event):
+    for hook in list(hooks):
+        hook(event)
+
+def count(counter, value=1):
+    for stats in getattr(state, "operations", ()):
+        stats[counter] += value
+
+def recordStatement(kind, sql, seconds, rows=None):
+    """ Called by the backends after every statement."""
+    if rows is not None and rows < 0: # the drivers give -1 when they do not know.
+        rows = None
+    count("statements")
+    count("dbSeconds", seconds)
+    if rows is not None:
+        count("rows", rows)
+    if hooks:
+        emit({"event" : "statement", "kind" : kind, "sql" : sql, "seconds" : seconds, "rows" : rows})
+
+def recordConnect(seconds):
+    """ Called when a new database connection has been opened."""
+    count("connectionsOpened")
+    count("connectSeconds", seconds)
+    if hooks:
+        emit({"event" : "connect", "seconds" : seconds})
+
+def recordCheckout():
+    """ Called when a connection is borrowed from the pool."""
+    count("connections")
+    if hooks:
+        emit({"event" : "checkout"})
+
+def recordPlan(name, plan):
+    """ Called by the backends with the plan of a statement of explainStatements."""
+    count("plans")
+    if hooks:
+        emit({"event" : "plan", "name" : name, "plan" : plan})
+
+@contextmanager
+def operation(name):
+    """ Count the statements, rows, connections borrowed and opened, and the time spent in the
+        database of a 'with' block. Gives the dict of the counters, complete at the end of the block.
+    """
+    stats = {"operation" : name, "statements" : 0, "rows" : 0, "dbSeconds" : 0.0, "connections" : 0,
+             "connectionsOpened" : 0, "connectSeconds" : 0.0, "plans" : 0}
+    operations = state.__dict__.setdefault("operations", [])
+    operations.append(stats)
+    start = time.time()
+    try:
+        yield stats
+    finally:
+        stats["seconds"] = time.time() - start
+        for i in range(len(operations) - 1, -1, -1):
+            if operations[i] is stats:
+                del operations[i]
+                break
+        if hooks:
+            event = dict(stats)
+            event["event"] = "operation"
+            emit(event)
+
+def instrumented(fn):
+    """ Decorator running every call of fn as an operation() named after it."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with operation(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def formatStats(stats):
+    """ e.g. "9 queries, 7 connections (1 opened), 3.2 ms in the database" """
+    return "{0} queries, {1} connections ({2} opened), {3:.1f} ms in the database".format(
+        stats["statements"], stats["connections"], stats["connectionsOpened"], stats["dbSeconds"] * 1000)
+
+def percentile(times, p):
+    """ The p-th percentile (nearest rank) of the sorted list 'times', e.g. of the seconds of measured calls."""
+    return times[max(0, int(ceil(p / 100.0 * len(times))) - 1)]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# migrate.py -- apply the schema migrations of the migrations directory to the database.
+#
+# Usage: python migrate.py [status | up] [--to VERSION] [--dry-run]
+#
+#   status: list the migrations, applied or pending.
+#   up:     apply the pending migrations in order (the default), up to VERSION with --to; with
+#           --dry-run, only list the ones which would be applied.
+#
+# A migration is a file migrations/<version>_<name>.<backend>.sql, e.g.
+# 001_partition_by_tournament.postgresql.sql, with one file per backend (postgresql, sqlite).
+# Each one runs in a transaction of its own, committed with its row in the schema_migrations table,
+# so a failed migration leaves the database as it was and can be run again once fixed. A migration
+# without a file for the backend in use is recorded as applied, with nothing to change.
+# tournament.sql and tournament_sqlite.sql create the tables as they were before any migration
+# (with the functions of 002, which only replaces them).
+#
+# A line "-- include <file>: <function>" of a migration is replaced by the "create or replace
+# function" statement of that function in <file> (relative to the migration), so a function
+# replaced by a migration keeps a single definition, e.g. in tournament.sql.
+
+import os
+import re
+import argparse
+
+from tournament import *
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.(postgresql|sqlite)\.sql$")
+
+INCLUDE_LINE = re.compile(r"^-- include (\S+): (\w+)[ \t]*$", re.MULTILINE)
+
+def migrations(directory=MIGRATIONS_DIRECTORY):
+    """ Returns the list of the migrations of 'directory', sorted by version, each of which is a
+        tuple (version, name, the file for the backend in use or None).
+    """
+    found = {}
+    for fileName in os.listdir(directory):
+        match = MIGRATION_FILE.match(fileName)
+        if match is None:
+            continue
+        version, name, backendName = match.groups()
+        if found.get(version, (name,))[0] != name:
+            raise ValueError("Two migrations have the version {0}: {1} and {2}.".format(version, found[version][0], name))
+        fileNames = found.setdefault(version, (name, {}))[1]
+        fileNames[backendName] = os.path.join(directory, fileName)
+
+    return [(version, name, fileNames.get(backend.name))
+            for version, (name, fileNames) in sorted(found.items(), key=lambda item: int(item[0]))]
+
+def appliedVersions():
+    """ Returns the set of the versions already applied (creates the schema_migrations table)."""
+    db_CRUD([{"sql" : "create table if not exists schema_migrations ( \
+                           version text primary key, \
+                           name text, \
+                           applied_at timestamp default current_timestamp);",
+              "args" : []}])
+    return set(row[0] for row in db_CRUD([{"sql" : "select version from schema_migrations;", "args" : []}]))
+
+def pendingMigrations(toVersion=None, directory=MIGRATIONS_DIRECTORY):
+    """ The migrations not applied yet, up to the version 'toVersion' (all by default)."""
+    applied = appliedVersions()
+    return [(version, name, fileName) for version, name, fileName in migrations(directory)
+            if version not in applied and (toVersion is None or int(version) <= int(toVersion))]
+
+def functionDefinition(fileName, function):
+    """ Returns the "create or replace function 'function'" statement of the SQL file 'fileName'."""
+    with open(fileName) as source:
+        script = source.read()
+    match = re.search(r"create or replace function {0}\(.*?\$body\$.*?\$body\$\s*language \w+;".format(function),
+                      script, re.IGNORECASE | re.DOTALL)
+    if match is None:
+        raise ValueError("No function {0} in {1}.".format(function, fileName))
+    return match.group(0)
+
+def migrationScript(fileName):
+    """ Returns the script of the migration file 'fileName', its include lines replaced."""
+    with open(fileName) as migration:
+        script = migration.read()
+    directory = os.path.dirname(fileName)
+    return INCLUDE_LINE.sub(lambda match: functionDefinition(os.path.join(directory, match.group(1)), match.group(2)),
+                            script)
+
+def applyMigration(version, name, fileName):
+    """ Run the migration (its file, if any) and record it, in one transaction."""
+    script = migrationScript(fileName) if fileName is not None else ""
+
+    with connectionPool.connection() as conn:
+        if script:
+            backend.executeScript(conn, script)
+        else:
+            backend.begin(conn, immediate=True)
+        backend.executeSqlList(conn, [{"sql" : "insert into schema_migrations (version, name) values (%s, %s);",
+                                       "args" : [version, name]}])
+        conn.commit()
+
+def migrate(toVersion=None, dryRun=False, directory=MIGRATIONS_DIRECTORY):
+    """ Apply the pending migrations in order, up to the version 'toVersion'.
+        Returns the list of (version, name) applied (or to be applied, with 'dryRun').
+    """
+    done = []
+    for version, name, fileName in pendingMigrations(toVersion, directory):
+        if not dryRun:
+            applyMigration(version, name, fileName)
+        done.append((version, name))
+
+    if done and not dryRun:
+        readCache.clear() # the rows read before may be laid out differently now.
+    return done
+
+def migrationStatus(directory=MIGRATIONS_DIRECTORY):
+    """ Returns a list of tuples (version, name, "applied" or "pending", the file for the backend in use)."""
+    applied = appliedVersions()
+    return [(version, name, "applied" if version in applied else "pending",
+             os.path.basename(fileName) if fileName is not None else "(none for {0})".format(backend.name))
+            for version, name, fileName in migrations(directory)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply the schema migrations to the database.")
+    parser.add_argument("command", nargs="?", choices=["status", "up"], default="up")
+    parser.add_argument("--to", help="the last version to apply")
+    parser.add_argument("--dry-run", action="store_true", help="list the migrations to apply, apply none")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "status":
+            showRows("Migrations ({0}):\n\n version, name, status, file".format(backend.name), migrationStatus())
+        else:
+            showRows("Migrations to apply:" if args.dry_run else "Migrations applied:",
+                     migrate(args.to, args.dry_run))
+    finally:
+        connectionPool.closeAll()
@@ -0,0 +1,229 @@
+-- Migration 001 (PostgreSQL 12 or later): partition the tables of the tournaments by tournament.
+--
+-- Tested on PostgreSQL 16.2 with a populated database (6 tournaments of 8 to 102 players, up to 5
+-- rounds each): the standing lists and matches were the same before and after it, checkStandings
+-- found no difference, and new rounds, an archive import and dropTournament worked on the
+-- partitions; simulation.py --processes 8 then created, played and dropped 24 tournaments at once
+-- without a deadlock. Not tested on 12 to 15. It renames, copies and drops the live tables: run it on a
+-- copy of the database first (python migrate.py up, then checkStandings) and keep a backup.
+--
+-- Players_Tournaments, Matches, Standings and Opponents become list-partitioned tables with one
+-- partition per tournament (players_tournaments_<id>, matches_<id>, standings_<id>, opponents_<id>),
+-- created by a trigger when the tournament is inserted and dropped when it is deleted. The queries
+-- of a tournament, all filtered on tourNumber, read its partitions only, and drop_tournament()
+-- drops them instead of deleting their rows one by one through the cascades and the Standings
+-- triggers.
+--
+-- The per-player lookups get covering indexes, read without visiting the tables:
+--   matches_tour_p1_idx / matches_tour_p2_idx: the matches of a player as p1 / p2,
+--   standings_order_idx: the standing list of a round, in standing order.
+--
+-- Creating a tournament locks the four partitioned tables and Players until the end of the
+-- transaction, so a new tournament should be committed at once (as createTournament does).
+--
+-- Dropping a tournament locks them too: DETACH PARTITION and DROP TABLE of a partition take an
+-- ACCESS EXCLUSIVE lock on its parent, so the queries of every other tournament wait until the
+-- drop is committed. dropTournament commits it at once, but drops should be run when
+-- the other tournaments are quiet. (DETACH PARTITION ... CONCURRENTLY, PostgreSQL 14, would avoid
+-- the lock on Players_Tournaments, but cannot run in a transaction, so not in drop_tournament().)
+--
+-- Run by migrate.py, in one transaction: the former tables are renamed, copied into the new ones
+-- and dropped.
+
+-------------------------------------------------------------------------------------------------
+-- The former tables and their indexes and constraints step aside.
+
+drop trigger if exists matches_opponents_trg on Matches;
+drop trigger if exists matches_standings_trg on Matches;
+
+alter table Opponents rename to opponents_v0;
+alter table opponents_v0 rename constraint opponents_pkey to opponents_v0_pkey;
+alter table Standings rename to standings_v0;
+alter table standings_v0 rename constraint standings_pkey to standings_v0_pkey;
+alter index standings_order_idx rename to standings_v0_order_idx;
+alter table Matches rename to matches_v0;
+alter table matches_v0 rename constraint matches_pkey to matches_v0_pkey;
+alter index matches_tour_p1_idx rename to matches_v0_tour_p1_idx;
+alter index matches_tour_p2_idx rename to matches_v0_tour_p2_idx;
+alter table Players_Tournaments rename to players_tournaments_v0;
+alter table players_tournaments_v0 rename constraint players_tournaments_pkey to players_tournaments_v0_pkey;
+alter index players_tournaments_no_bye_idx rename to players_tournaments_v0_no_bye_idx;
+
+-------------------------------------------------------------------------------------------------
+-- The partitioned tables, with the same columns and constraints, except the foreign keys to
+-- Tournaments: a partition exists only as long as its tournament (created and dropped by the
+-- triggers of Tournaments below), and a foreign key to Tournaments would make every creation of a
+-- partition lock Tournaments against the inserts of the other new tournaments (see below).
+
+CREATE TABLE Players_Tournaments (
+    tourNumber INTEGER,
+    player_id INTEGER REFERENCES Players(id) on delete cascade,
+    bye INTEGER,
+    PRIMARY KEY (tourNumber, player_id)
+) PARTITION BY LIST (tourNumber);
+
+CREATE TABLE Matches (
+    tourNumber INTEGER,
+    roundNumber INTEGER,
+    p1 INTEGER REFERENCES Players(id) on delete cascade,
+    p2 INTEGER REFERENCES Players(id) on delete cascade,
+    win INTEGER,
+    PRIMARY KEY (tourNumber,roundNumber,p1,p2),
+    CONSTRAINT player_order CHECK (p1 < p2),
+    CONSTRAINT player_win CHECK (win = p1 OR win = p2 OR win = -1),
+    CONSTRAINT player1 FOREIGN KEY (tourNumber, p1)
+               REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade,
+    CONSTRAINT player2 FOREIGN KEY (tourNumber, p2)
+               REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+) PARTITION BY LIST (tourNumber);
+
+CREATE TABLE Standings (
+    tourNumber INTEGER,
+    roundNumber INTEGER,
+    player_id INTEGER,
+    wins INTEGER,
+    matches INTEGER,
+    opp_wins INTEGER,
+    PRIMARY KEY (tourNumber, roundNumber, player_id),
+    FOREIGN KEY (tourNumber, player_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+) PARTITION BY LIST (tourNumber);
+
+CREATE TABLE Opponents (
+    tourNumber INTEGER,
+    player_id INTEGER,
+    opponent_id INTEGER,
+    roundNumber INTEGER,
+    PRIMARY KEY (tourNumber, player_id, opponent_id),
+    FOREIGN KEY (tourNumber, player_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade,
+    FOREIGN KEY (tourNumber, opponent_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+) PARTITION BY LIST (tourNumber);
+
+-------------------------------------------------------------------------------------------------
+-- The partitions of a tournament are created when it is inserted into Tournaments, and dropped
+-- when it is deleted from it (drop_tournament()).
+--
+-- Creating or dropping a partition locks its partitioned table and Players, which its foreign keys
+-- refer to. Taken one by one, while the transactions of the other tournaments lock the same tables
+-- in their own order, those locks deadlock (simulation.py --processes 4 lost most tournaments so).
+-- lock_tournament_tables() first waits for the other creations and drops (an advisory lock, so
+-- they are made one at a time), then takes the table locks all at once or none: it does not wait
+-- holding some of them, but releases them and tries again after a short random pause.
+
+create or replace function lock_tournament_tables()
+  returns void
+as
+$body$
+begin
+    perform pg_advisory_xact_lock(hashtext('tournament partitions'));
+    loop
+        begin
+            lock table Players_Tournaments, Matches, Standings, Opponents, Players in access exclusive mode nowait;
+            return;
+        exception when lock_not_available then
+            perform pg_sleep(0.005 + random() * 0.02); -- the locks of this attempt are released.
+        end;
+    end loop;
+end;
+$body$
+language plpgsql;
+
+create or replace function create_tournament_partitions(tourNum integer)
+  returns void
+as
+$body$
+begin
+    perform lock_tournament_tables();
+    execute format('create table if not exists players_tournaments_%s partition of Players_Tournaments for values in (%s)',
+                   tourNum, tourNum);
+    execute format('create table if not exists matches_%s partition of Matches for values in (%s)', tourNum, tourNum);
+    execute format('create table if not exists standings_%s partition of Standings for values in (%s)', tourNum, tourNum);
+    execute format('create table if not exists opponents_%s partition of Opponents for values in (%s)', tourNum, tourNum);
+end;
+$body$
+language plpgsql;
+
+-- The partitions which refer to players_tournaments_<id> go first; that one is detached from
+-- Players_Tournaments before it is dropped, so the foreign keys to it are checked and removed.
+create or replace function drop_tournament_partitions(tourNum integer)
+  returns void
+as
+$body$
+begin
+    perform lock_tournament_tables();
+    execute format('drop table if exists standings_%s, opponents_%s, matches_%s', tourNum, tourNum, tourNum);
+    if to_regclass(format('players_tournaments_%s', tourNum)) is not null then
+        execute format('alter table Players_Tournaments detach partition players_tournaments_%s', tourNum);
+        execute format('drop table players_tournaments_%s', tourNum);
+    end if;
+end;
+$body$
+language plpgsql;
+
+create or replace function tournaments_partitions_trg()
+  returns trigger
+as
+$body$
+begin
+    if TG_OP = 'INSERT' then
+        perform create_tournament_partitions(new.id);
+    else
+        perform drop_tournament_partitions(old.id);
+    end if;
+    return null;
+end;
+$body$
+language plpgsql;
+
+create trigger tournaments_partitions_trg
+  after insert or delete on Tournaments
+  for each row execute procedure tournaments_partitions_trg();
+
+-- Delete the tournament "tourNum", which drops its partitions. Its players stay in Players.
+-- The partitioned tables stay locked (ACCESS EXCLUSIVE) until the transaction ends, see above.
+create or replace function drop_tournament(tourNum integer)
+  returns void
+as
+$body$
+    delete from Tournaments where id = $1;
+$body$
+language sql;
+
+-------------------------------------------------------------------------------------------------
+-- Copy the rows of the former tables into the partitions of their tournaments. The Matches
+-- triggers are created afterwards: Standings and Opponents are copied as they are.
+
+select create_tournament_partitions(id) from Tournaments;
+
+insert into Players_Tournaments select * from players_tournaments_v0;
+insert into Matches select * from matches_v0;
+insert into Standings select * from standings_v0;
+insert into Opponents select * from opponents_v0;
+
+drop table opponents_v0, standings_v0, matches_v0, players_tournaments_v0;
+
+-------------------------------------------------------------------------------------------------
+-- Indexes, created on every partition.
+
+CREATE INDEX players_tournaments_no_bye_idx ON Players_Tournaments (tourNumber, player_id) WHERE bye = 0;
+
+CREATE INDEX matches_tour_p1_idx ON Matches (tourNumber, p1) INCLUDE (roundNumber, p2, win);
+CREATE INDEX matches_tour_p2_idx ON Matches (tourNumber, p2) INCLUDE (roundNumber, p1, win);
+
+CREATE INDEX standings_order_idx ON Standings (tourNumber, roundNumber, wins desc, opp_wins desc)
+    INCLUDE (player_id, matches);
+
+-------------------------------------------------------------------------------------------------
+-- The triggers of tournament.sql, on the partitioned Matches table.
+
+create trigger matches_opponents_trg
+  after insert or delete on Matches
+  for each row execute procedure matches_opponents_trg();
+
+create trigger matches_standings_trg
+  after insert or update or delete on Matches
+  for each row execute procedure matches_standings_trg();
+
+analyze Players_Tournaments, Matches, Standings, Opponents;
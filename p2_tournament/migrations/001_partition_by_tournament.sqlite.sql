@@ -0,0 +1,15 @@
+-- Migration 001, SQLite version: SQLite has no partitioned tables, so only the per-player lookups
+-- get covering indexes (an index holding all the columns a query reads), as on PostgreSQL:
+--   matches_tour_p1_idx / matches_tour_p2_idx: the matches of a player as p1 / p2,
+--   standings_order_idx: the standing list of a round, in standing order.
+-- Dropping a tournament stays a cascade of deletes (drop_tournament has no SQLite counterpart).
+
+DROP INDEX IF EXISTS matches_tour_p1_idx;
+DROP INDEX IF EXISTS matches_tour_p2_idx;
+DROP INDEX IF EXISTS standings_order_idx;
+
+CREATE INDEX matches_tour_p1_idx ON Matches (tourNumber, p1, roundNumber, p2, win);
+CREATE INDEX matches_tour_p2_idx ON Matches (tourNumber, p2, roundNumber, p1, win);
+CREATE INDEX standings_order_idx ON Standings (tourNumber, roundNumber, wins desc, opp_wins desc, player_id, matches);
+
+ANALYZE;
@@ -0,0 +1,10 @@
+-- Migration 002: the triggers of Matches do nothing in a transaction which sets the setting
+-- tournament.bulk_load to 'on' (set local), so archive.importTournament loads the matches of a
+-- tournament without updating Opponents and Standings row by row, and builds them once afterwards.
+-- tournament.sql holds the one definition of the trigger functions, with that check: migrate.py
+-- replaces the functions with it (see the include lines); the triggers stay as they are.
+-- (SQLite: the import drops and creates again its insert trigger in its transaction, no migration.)
+
+-- include ../tournament.sql: matches_standings_trg
+
+-- include ../tournament.sql: matches_opponents_trg
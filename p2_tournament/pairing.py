@@ -0,0 +1,207 @@
+"""
+ pairing.py -- Swiss pairing engine working on in-memory arrays, used by tournament.swissPairings.
+
+ The players are kept in compact arrays (ids and scores in standing order) and every player is paired
+ with the nearest player below him or her in the standings that he or she has not met yet:
+   - players with the same score (a score group) are paired together first,
+   - a player left without a partner in his or her score group floats down to the next group,
+   - the few players left at the bottom whose remaining candidates are all former opponents
+     are placed by re-pairing the lowest standings with augmenting paths (Edmonds' matching),
+ so no two players ever meet twice and no backtracking over the whole list is needed.
+"""
+from array import array
+
+
+def swissPairs(playerIds, scores, opponents):
+    """ Pair the players for the next round.
+
+        playerIds: the ids of the players, an even number of them, best standing first.
+        scores: the score (number of wins) of each player, in the same order as playerIds.
+        opponents: a dict {player id: set of the ids of the players he or she has already met},
+                   or an OpponentGraph.
+
+        Returns a list of pairs (id1, id2) ordered by the standing of id1; no pair has met before.
+        Raises ValueError if the players cannot be paired without a rematch.
+    """
+    n = len(playerIds)
+    if n % 2 != 0:
+        raise ValueError("An even number of players is needed to make pairs.")
+
+    # Sort by score (stable, so the standing order is kept inside a score group).
+    order = sorted(range(n), key=lambda i: -scores[i])
+    ids = array('l', [playerIds[i] for i in order])
+    points = array('l', [scores[i] for i in order])
+
+    partner = array('l', [-1]) * n
+    nextFree = array('l', range(n + 1)) # nextFree[k] leads to the first unpaired player at or below k.
+
+    def firstFree(k):
+        root = k
+        while nextFree[root] != root:
+            root = nextFree[root]
+        while nextFree[k] != root: # path compression
+            nextFree[k], k = root, nextFree[k]
+        return root
+
+    stranded = []
+    for i in range(n):
+        if partner[i] != -1:
+            continue
+        nextFree[i] = i + 1
+        met = opponents.get(ids[i], ())
+
+        j = firstFree(i + 1)
+        while j < n and ids[j] in met:
+            j = firstFree(j + 1)
+
+        if j < n:
+            partner[i], partner[j] = j, i
+            nextFree[j] = j + 1
+        else:
+            stranded.append(i)
+
+    # Every stranded player has already met all the players left unpaired below him or her,
+    # including the other stranded players: re-pair a window of the lowest standings, large enough
+    # to hold the stranded players, with augmenting paths.
+    if stranded:
+        start = min(stranded)
+        window = 2
+        while not repairWindow(max(start - window, 0), ids, partner, opponents):
+            if start - window <= 0:
+                raise ValueError("The players cannot be paired without a rematch.")
+            window *= 2
+
+    return [(ids[i], ids[partner[i]]) for i in range(n) if i < partner[i]]
+
+
+def repairWindow(start, ids, partner, opponents):
+    """ Complete the pairing of the players from the standing 'start' down (and their partners)
+        into a perfect matching of the players who have not met, keeping the existing pairs
+        unless an augmenting path goes through them.
+        Returns False, leaving 'partner' unchanged, if the window has no perfect matching.
+    """
+    n = len(ids)
+    members = sorted(set(range(start, n)) | set(partner[k] for k in range(start, n) if partner[k] != -1))
+    position = dict((k, i) for i, k in enumerate(members))
+
+    adjacency = []
+    for k in members:
+        met = opponents.get(ids[k], ())
+        adjacency.append([position[j] for j in members if j != k and ids[j] not in met])
+    match = [position[partner[k]] if partner[k] != -1 else -1 for k in members]
+
+    augmentMatching(adjacency, match)
+    if -1 in match:
+        return False
+
+    for i, k in enumerate(members):
+        partner[k] = members[match[i]]
+    return True
+
+
+def augmentMatching(adjacency, match):
+    """ Extend 'match' (match[v] is the vertex matched with v, or -1) to a maximum matching of the
+        graph 'adjacency' (lists of neighbours) with Edmonds' blossom algorithm: from every unmatched
+        vertex, search an augmenting path, contracting the odd cycles (blossoms) met on the way.
+    """
+    n = len(adjacency)
+
+    def commonBase(a, b, base, parent):
+        seen = [False] * n
+        while True:
+            a = base[a]
+            seen[a] = True
+            if match[a] == -1:
+                break
+            a = parent[match[a]]
+        while True:
+            b = base[b]
+            if seen[b]:
+                return b
+            b = parent[match[b]]
+
+    def markPath(v, b, child, inBlossom, base, parent):
+        while base[v] != b:
+            inBlossom[base[v]] = inBlossom[base[match[v]]] = True
+            parent[v] = child
+            child = match[v]
+            v = parent[match[v]]
+
+    def findPath(root):
+        used = [False] * n
+        parent = [-1] * n
+        base = list(range(n))
+        used[root] = True
+        queue = [root]
+        head = 0
+        while head < len(queue):
+            v = queue[head]
+            head += 1
+            for to in adjacency[v]:
+                if base[v] == base[to] or match[v] == to:
+                    continue
+                if to == root or (match[to] != -1 and parent[match[to]] != -1):
+                    b = commonBase(v, to, base, parent)
+                    inBlossom = [False] * n
+                    markPath(v, b, to, inBlossom, base, parent)
+                    markPath(to, b, v, inBlossom, base, parent)
+                    for i in range(n):
+                        if inBlossom[base[i]]:
+                            base[i] = b
+                            if not used[i]:
+                                used[i] = True
+                                queue.append(i)
+                elif parent[to] == -1:
+                    parent[to] = v
+                    if match[to] == -1:
+                        return to, parent
+                    used[match[to]] = True
+                    queue.append(match[to])
+        return -1, parent
+
+    for root in range(n):
+        if match[root] == -1:
+            to, parent = findPath(root)
+            while to != -1: # flip the matched and unmatched edges along the path.
+                previous = match[parent[to]]
+                match[to], match[parent[to]] = parent[to], to
+                to = previous
+
+
+class OpponentGraph(object):
+    """ The opponent graph of a tournament: for every player, the set of the players he or she has
+        already met, read from the edges (player_id, opponent_id) of the Opponents table. A bye is
+        a match with the dummy player 0, which is never one of the players to pair.
+
+        It is the 'opponents' mapping of swissPairs, and the lookups of the tiebreaks:
+            graph.met(id1, id2)                 True if id1 and id2 have already met (a rematch),
+            graph.opponentsOf(id)               the set of the opponents of id,
+            graph.sumOver(id, values)           the sum of values[opponent] over the opponents of id,
+                                                e.g. the opponents' wins of a player (Buchholz).
+    """
+
+    def __init__(self, edges=()):
+        self.adjacency = {}
+        for player, opponent in edges:
+            self.adjacency.setdefault(player, set()).add(opponent)
+
+    def add(self, id1, id2):
+        """ Record a match between id1 and id2 (both directions)."""
+        self.adjacency.setdefault(id1, set()).add(id2)
+        self.adjacency.setdefault(id2, set()).add(id1)
+
+    def met(self, id1, id2):
+        return id2 in self.adjacency.get(id1, ())
+
+    def opponentsOf(self, playerId):
+        return self.adjacency.get(playerId, frozenset())
+
+    def get(self, playerId, default=None):
+        return self.adjacency.get(playerId, default)
+
+    def sumOver(self, playerId, values):
+        return sum(values.get(opponent, 0) for opponent in self.adjacency.get(playerId, ()))
+
+    def __len__(self):
+        """ The number of players who have played at least one match."""
+        return len(self.adjacency)
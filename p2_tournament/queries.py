@@ -0,0 +1,261 @@
+"""
+ queries.py -- the hot queries of tournament.py, kept as named prepared statements.
+
+ Every connection prepares a statement the first time it is used (see db_CRUD), so PostgreSQL
+ parses and plans it once per connection instead of once per call.
+ The bodies use the $1, $2, ... placeholders of PREPARE; the arguments are sent as bound
+ parameters with EXECUTE.
+
+ BULK holds the statements of the bulk writes, and SQLITE and SQLITE_BULK the statements whose
+ SQLite dialect differs (see backends.py); the others run unchanged on SQLite with ?1, ?2, ...
+ in place of $1, $2, ...
+"""
+import re
+
+PREPARED = {
+    # Standing list at the end of the round $2 of the tournament $1, read from the Standings table
+    # (the last round with matches not later than $2).
+    "standings" : ("integer, integer",
+                   "select s.player_id, p.name, s.wins, s.opp_wins, s.matches \
+                    from Standings s join Players p on p.id = s.player_id \
+                    where s.tourNumber = $1 \
+                          and s.roundNumber = (select max(roundNumber) from Standings \
+                                               where tourNumber = $1 and roundNumber <= $2) \
+                    order by s.wins desc, s.opp_wins desc"),
+
+    # The standing list before the first round of the tournament $1: every registered player with
+    # no wins and no matches.
+    "registrations" : ("integer",
+                       "select pt.player_id, p.name, 0, 0, 0 \
+                        from Players_Tournaments pt join Players p on p.id = pt.player_id \
+                        where pt.tourNumber = $1 \
+                        order by pt.player_id"),
+
+    # The same standing list recomputed from the Matches table.
+    "computedStandings" : ("integer, integer",
+                           "select id, name, wins, opp_wins, matches \
+                            from standings_fn($1, $2) \
+                            order by wins desc, opp_wins desc"),
+
+    # All the matches of the rounds not later than the round $2 of the tournament $1.
+    "matchesUpTo" : ("integer, integer",
+                     "select tourNumber, roundNumber, p1, p2, win from Matches \
+                      where tourNumber = $1 and roundNumber <= $2 order by roundNumber, p1, p2"),
+
+    # The opponent graph of the tournament $1: both directions of every match.
+    "opponents" : ("integer",
+                   "select player_id, opponent_id from Opponents where tourNumber = $1"),
+
+    # The matches of the round $2 of the tournament $1 without a result.
+    "unplayedMatches" : ("integer, integer",
+                         "select p1, p2 from Matches \
+                          where tourNumber = $1 and roundNumber = $2 and win is null"),
+
+    # Choose a random player of the tournament $1 who has not been a bye player yet, set his or
+    # her bye attribute to 1 and return (id, name). A random id is drawn between the lowest and
+    # the highest id of those players, and the first of them from it is taken: three lookups of
+    # the partial index players_tournaments_no_bye_idx, whatever the number of players (a player
+    # after a gap in the ids is more likely to be chosen than one right after another).
+    "randomBye" : ("integer",
+                   "with chosen as ( \
+                        update Players_Tournaments set bye = 1 \
+                        where tourNumber = $1 \
+                              and player_id = (select player_id from Players_Tournaments \
+                                               where tourNumber = $1 and bye = 0 \
+                                                     and player_id >= (select min(player_id) \
+                                                                              + floor(random() * (max(player_id) - min(player_id) + 1))::integer \
+                                                                       from Players_Tournaments \
+                                                                       where tourNumber = $1 and bye = 0 and player_id > 0) \
+                                               order by player_id limit 1 \
+                                               for update) \
+                        returning player_id) \
+                    select c.player_id, p.name from chosen c join Players p on p.id = c.player_id"),
+
+    # The same for the lowest-ranked such player in the last standing list of the tournament $1
+    # (a random one among equals, or among all of them before the first round).
+    "lowestBye" : ("integer",
+                   "with chosen as ( \
+                        update Players_Tournaments set bye = 1 \
+                        where tourNumber = $1 \
+                              and player_id = (select pt.player_id \
+                                               from Players_Tournaments pt \
+                                                    left join Standings s \
+                                                    on s.tourNumber = pt.tourNumber and s.player_id = pt.player_id \
+                                                       and s.roundNumber = (select max(roundNumber) from Standings \
+                                                                            where tourNumber = $1) \
+                                               where pt.tourNumber = $1 and pt.bye = 0 and pt.player_id <> 0 \
+                                               order by s.wins asc, s.opp_wins asc nulls first, random() \
+                                               limit 1 \
+                                               for update of pt) \
+                        returning player_id) \
+                    select c.player_id, p.name from chosen c join Players p on p.id = c.player_id"),
+
+    # Reset the bye attribute of the bye player of the round $2 of the tournament $1, who is paired
+    # with the dummy player (id 0, so always p1).
+    "resetBye" : ("integer, integer",
+                  "update Players_Tournaments set bye = 0 \
+                   where tourNumber = $1 \
+                         and player_id in (select p2 from Matches \
+                                           where tourNumber = $1 and roundNumber = $2 and p1 = 0)"),
+
+    # Fill the Standings table of the tournament $1 with a full recomputation of every round.
+    "rebuildStandings" : ("integer",
+                          "insert into Standings \
+                           select $1, r.roundNumber, s.id, s.wins, s.matches, s.opp_wins \
+                           from (select distinct roundNumber from Matches where tourNumber = $1) r \
+                                cross join lateral standings_fn($1, r.roundNumber) s"),
+
+    # Fill the Opponents table of the tournament $1 from the Matches table, with the round in which
+    # each pair of players met first.
+    "rebuildOpponents" : ("integer",
+                          "insert into Opponents \
+                           select $1, player_id, opponent_id, min(roundNumber) \
+                           from (select p1 as player_id, p2 as opponent_id, roundNumber from Matches \
+                                 where tourNumber = $1 \
+                                 union all \
+                                 select p2, p1, roundNumber from Matches \
+                                 where tourNumber = $1) m \
+                           group by player_id, opponent_id"),
+
+    # Remove the tournament $1 and all its rows (drops its partitions once the tables are
+    # partitioned, see migrations/).
+    "dropTournament" : ("integer", "select drop_tournament($1)"),
+}
+
+# The statements of PREPARED which only read: their plans may be captured with EXPLAIN ANALYZE,
+# which runs them (see instrumentation.explainStatements).
+READ_ONLY = set(["standings", "registrations", "computedStandings", "matchesUpTo", "opponents", "unplayedMatches"])
+
+def prepareStatement(name):
+    """ Returns the PREPARE command of the statement 'name'."""
+    types, body = PREPARED[name]
+    return "prepare {0} ({1}) as {2};".format(name, types, body)
+
+def executeStatement(name):
+    """ Returns the EXECUTE command of the statement 'name', with a %s placeholder per argument."""
+    types, body = PREPARED[name]
+    placeholders = ", ".join(["%s"] * len(types.split(",")))
+    return "execute {0} ({1});".format(name, placeholders)
+
+# The statement of PREPARED used by each policy of choice of the bye player.
+BYE_POLICIES = {"random" : "randomBye", "lowest" : "lowestBye"}
+
+# The bulk writes: (statement, row template), the %s of the statement is replaced by the
+# multi-row VALUES list of a page of rows.
+BULK = {
+    # The ids of the new players come back in the order of their names (one serial per row).
+    "insertPlayers" : ("insert into Players (name) values %s returning id",
+                       "(%s)"),
+
+    "insertMatches" : ("insert into Matches (tourNumber, roundNumber, p1, p2) values %s",
+                       "(%s, %s, %s, %s)"),
+
+    "insertRegistrations" : ("insert into Players_Tournaments (tourNumber, player_id, bye) values %s",
+                             "(%s, %s, %s)"),
+
+    # rows (tourNumber, roundNumber, p1, p2, winner)
+    "updateResults" : ("update Matches m set win = v.win \
+                        from (values %s) as v(tourNumber, roundNumber, p1, p2, win) \
+                        where m.tourNumber = v.tourNumber and m.roundNumber = v.roundNumber \
+                              and m.p1 = v.p1 and m.p2 = v.p2",
+                       "(%s, %s, %s, %s, %s)"),
+}
+
+#-------------------------------------------------------------------------------------------#
+# SQLite dialect.
+
+# The standing lists of the rounds selected by {rounds} (matches, wins and opp_wins as standings_fn),
+# as a common table expression "standings(upTo, id, wins, opp_wins, matches)".
+SQLITE_STANDINGS = "with rounds(roundNumber) as ({rounds}), \
+                         results(upTo, id, opp, win) as ( \
+                             select r.roundNumber, m.p1, m.p2, m.win \
+                             from Matches m join rounds r on m.roundNumber <= r.roundNumber \
+                             where m.tourNumber = ?1 \
+                             union all \
+                             select r.roundNumber, m.p2, m.p1, m.win \
+                             from Matches m join rounds r on m.roundNumber <= r.roundNumber \
+                             where m.tourNumber = ?1), \
+                         records(upTo, id, wins, matches) as ( \
+                             select r.roundNumber, pt.player_id, \
+                                    count(case when x.win = pt.player_id then 1 end), \
+                                    count(case when x.id <> 0 and x.opp <> 0 then x.win end) \
+                             from rounds r \
+                                  join Players_Tournaments pt on pt.tourNumber = ?1 \
+                                  left join results x on x.upTo = r.roundNumber and x.id = pt.player_id \
+                             group by r.roundNumber, pt.player_id), \
+                         opponents(upTo, id, opp) as ( \
+                             select distinct upTo, id, opp from results), \
+                         standings(upTo, id, wins, opp_wins, matches) as ( \
+                             select rec.upTo, rec.id, rec.wins, sum(opp.wins), rec.matches \
+                             from records rec \
+                                  left join opponents o on o.upTo = rec.upTo and o.id = rec.id \
+                                  left join records opp on opp.upTo = rec.upTo and opp.id = o.opp \
+                             group by rec.upTo, rec.id, rec.wins, rec.matches) "
+
+SQLITE = {
+    "dropTournament" : "delete from Tournaments where id = ?1",
+
+    # SQLite sorts the nulls last in a descending order, PostgreSQL first.
+    "standings" : "select s.player_id, p.name, s.wins, s.opp_wins, s.matches \
+                   from Standings s join Players p on p.id = s.player_id \
+                   where s.tourNumber = ?1 \
+                         and s.roundNumber = (select max(roundNumber) from Standings \
+                                              where tourNumber = ?1 and roundNumber <= ?2) \
+                   order by s.wins desc, s.opp_wins desc nulls first",
+
+    "computedStandings" : SQLITE_STANDINGS.format(rounds="select ?2") +
+                          "select s.id, p.name, s.wins, s.opp_wins, s.matches \
+                           from standings s join Players p on p.id = s.id \
+                           order by s.wins desc, s.opp_wins desc nulls first",
+
+    "rebuildStandings" : SQLITE_STANDINGS.format(rounds="select distinct roundNumber from Matches \
+                                                         where tourNumber = ?1") +
+                         "insert into Standings (tourNumber, roundNumber, player_id, wins, matches, opp_wins) \
+                          select ?1, upTo, id, wins, matches, opp_wins from standings",
+
+    # UPDATE ... RETURNING cannot be a common table expression in SQLite, which reads min() and
+    # max() from an index only when each is alone in its query.
+    "randomBye" : "update Players_Tournaments set bye = 1 \
+                   where tourNumber = ?1 \
+                         and player_id = (select player_id from Players_Tournaments \
+                                          where tourNumber = ?1 and bye = 0 \
+                                                and player_id >= (select lowest + abs(random() % (highest - lowest + 1)) \
+                                                                  from (select (select min(player_id) from Players_Tournaments \
+                                                                                where tourNumber = ?1 and bye = 0 and player_id > 0) as lowest, \
+                                                                               (select max(player_id) from Players_Tournaments \
+                                                                                where tourNumber = ?1 and bye = 0 and player_id > 0) as highest)) \
+                                          order by player_id limit 1) \
+                   returning player_id, (select name from Players where id = player_id)",
+
+    "lowestBye" : "update Players_Tournaments set bye = 1 \
+                   where tourNumber = ?1 \
+                         and player_id = (select pt.player_id \
+                                          from Players_Tournaments pt \
+                                               left join Standings s \
+                                               on s.tourNumber = pt.tourNumber and s.player_id = pt.player_id \
+                                                  and s.roundNumber = (select max(roundNumber) from Standings \
+                                                                       where tourNumber = ?1) \
+                                          where pt.tourNumber = ?1 and pt.bye = 0 and pt.player_id <> 0 \
+                                          order by s.wins asc, s.opp_wins asc nulls first, random() \
+                                          limit 1) \
+                   returning player_id, (select name from Players where id = player_id)",
+}
+
+# The bulk writes run row by row on SQLite (executemany), there is no round-trip to save.
+SQLITE_BULK = {
+    "updateResults" : "update Matches set win = ?5 \
+                       where tourNumber = ?1 and roundNumber = ?2 and p1 = ?3 and p2 = ?4",
+}
+
+def sqliteStatement(name):
+    """ Returns the SQLite statement of the statement 'name' of PREPARED."""
+    if name in SQLITE:
+        return SQLITE[name]
+    return re.sub(r"\$(\d+)", r"?\1", PREPARED[name][1])
+
+def sqliteBulkStatement(name):
+    """ Returns the SQLite statement writing one row of the bulk write 'name' of BULK."""
+    if name in SQLITE_BULK:
+        return SQLITE_BULK[name]
+    sql, template = BULK[name]
+    return sql.replace("%s", template.replace("%s", "?"))
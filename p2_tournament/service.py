@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# service.py -- an HTTP/JSON service for the tournament operations, without the interactive menu.
+#
+# Usage: python service.py [--host HOST] [--port PORT]
+#        TOURNAMENT_DATABASE=sqlite::memory: python service.py    (a local stand-in database)
+#
+#   POST /tournaments                              {"name": ...}                -> {"id": ...}
+#   POST /tournaments/ID/players                   {"names": [...], "playerIds": [...]}
+#                                                                               -> {"playerIds": [new ids]}
+#   POST /tournaments/ID/rounds                    (the next round)             -> {"round": ..., "pairings": [...]}
+#   POST /tournaments/ID/rounds/ROUND/results      {"results": [[p1, p2, winner], ...]}
+#                                                                               -> {"recorded": ..., "unchanged": ...}
+#   GET  /tournaments/ID/rounds/ROUND              the matches of the rounds up to ROUND
+#   GET  /tournaments/ID/standings[?round=ROUND]   the standing list (after the last round by default)
+#   GET  /tournaments/ID/live[?version=V&wait=S]   the last standing list, kept in memory from the change
+#                                                  events (no query); with a version, waits up to S
+#                                                  seconds for the next one   -> {"round", "version", "standings"}
+#   GET  /statistics                               the connection pool and read cache counters
+#
+# Every request runs in a thread of its own over the shared connection pool. Submitting results
+# is idempotent: the results already recorded are skipped, and a different result for a match which
+# already has one is refused with 409 Conflict. The live standing lists of all the displays of a
+# tournament are served from one events.LiveStandings, updated by the writes of this service (and of
+# the other processes with TOURNAMENT_NOTIFY=1 on PostgreSQL).
+
+import re
+import json
+import argparse
+import threading
+import traceback
+from urlparse import urlparse, parse_qs
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from tournament import *
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def pairingRows(pairingList):
+    return [{"p1" : id1, "name1" : name1, "p2" : id2, "name2" : name2} for id1, name1, id2, name2 in pairingList]
+
+def postTournament(body, query):
+    if not isinstance(body.get("name"), basestring):
+        raise HTTPError(400, "The name of the tournament is missing.")
+    return 201, {"id" : createTournament(body["name"])}
+
+def postPlayers(body, query, tourNum):
+    names, playerIds = body.get("names", []), body.get("playerIds", [])
+    if not isinstance(names, list) or not all(isinstance(name, basestring) for name in names):
+        raise HTTPError(400, "The names must be a list of strings.")
+    if not isinstance(playerIds, list) or not all(type(playerId) in (int, long) for playerId in playerIds):
+        raise HTTPError(400, "The playerIds must be a list of player ids.")
+    newIds = registerPlayers(tourNum, names, playerIds)
+    return 201, {"playerIds" : newIds, "players" : countPlayers(tourNum)}
+
+def postRound(body, query, tourNum):
+    roundNum, pairingList, timings = addRound(tourNum)
+    return 201, {"round" : roundNum, "pairings" : pairingRows(pairingList)}
+
+def postResults(body, query, tourNum, roundNum):
+    try:
+        results = [(int(p1), int(p2), int(winner)) for p1, p2, winner in body["results"]]
+    except (KeyError, TypeError, ValueError):
+        raise HTTPError(400, "The results must be a list of [p1, p2, winner].")
+    recorded, unchanged = submitMatchResults(tourNum, roundNum, results)
+    return 200, {"recorded" : recorded, "unchanged" : unchanged}
+
+def getRound(body, query, tourNum, roundNum):
+    columns = ["tourNumber", "roundNumber", "p1", "p2", "win"]
+    return 200, {"round" : roundNum, "matches" : [dict(zip(columns, row)) for row in getMatches(tourNum, roundNum)]}
+
+def getStandings(body, query, tourNum):
+    roundNum = int(query["round"][0]) if "round" in query else lastRoundNumber(tourNum)
+    columns = ["id", "name", "wins", "opp_wins", "matches"]
+    return 200, {"round" : roundNum,
+                 "standings" : [dict(zip(columns, row)) for row in playerStandings(tourNum, roundNum)]}
+
+# The LiveStandings of the tournaments followed, by tournament.
+liveStandings = {}
+liveLock = threading.Lock()
+
+# The longest wait of a live request, in seconds.
+MAX_LIVE_WAIT = 60.0
+
+def getLive(body, query, tourNum):
+    with liveLock:
+        if tourNum not in liveStandings:
+            if db_CRUD([{"sql" : "select id from Tournaments where id = %s;", "args" : [tourNum]}]) == []:
+                raise HTTPError(404, "Invalid tournament ID.")
+            liveStandings[tourNum] = followTournament(tourNum)
+        live = liveStandings[tourNum]
+
+    if "version" in query:
+        roundNum, standingList, version = live.waitForChange(int(query["version"][0]),
+                                                             min(float(query.get("wait", ["30"])[0]), MAX_LIVE_WAIT))
+    else:
+        roundNum, standingList, version = live.standings()
+    columns = ["id", "name", "wins", "opp_wins", "matches"]
+    return 200, {"round" : roundNum, "version" : version,
+                 "standings" : [dict(zip(columns, row)) for row in standingList]}
+
+def getStatistics(body, query):
+    return 200, {"pool" : poolStatistics(), "cache" : cacheStatistics()}
+
+# (method, path pattern, handler): the groups of the pattern are passed to the handler as integers.
+ROUTES = [
+    ("POST", r"^/tournaments$", postTournament),
+    ("POST", r"^/tournaments/(\d+)/players$", postPlayers),
+    ("POST", r"^/tournaments/(\d+)/rounds$", postRound),
+    ("POST", r"^/tournaments/(\d+)/rounds/(\d+)/results$", postResults),
+    ("GET", r"^/tournaments/(\d+)/rounds/(\d+)$", getRound),
+    ("GET", r"^/tournaments/(\d+)/standings$", getStandings),
+    ("GET", r"^/tournaments/(\d+)/live$", getLive),
+    ("GET", r"^/statistics$", getStatistics),
+]
+
+class TournamentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive connections for the clients sending many requests.
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        data = self.readData() # before anything can fail: the next request of the connection follows it.
+        try:
+            if data is None:
+                raise HTTPError(400, "The body must be sent with a valid Content-Length.")
+            for routeMethod, pattern, handler in ROUTES:
+                match = re.match(pattern, url.path)
+                if match and routeMethod == method:
+                    break
+            else:
+                raise HTTPError(404, "Unknown resource: {0} {1}".format(method, url.path))
+
+            status, payload = handler(self.parseBody(data), parse_qs(url.query), *[int(group) for group in match.groups()])
+        except HTTPError as e:
+            status, payload = e.status, {"error" : str(e)}
+        except ResultConflict as e:
+            status, payload = 409, {"error" : str(e)}
+        except UnknownTournament as e:
+            status, payload = 404, {"error" : str(e)}
+        except ValueError as e:
+            status, payload = 400, {"error" : str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            status, payload = 500, {"error" : "{0}: {1}".format(type(e).__name__, e)}
+        self.sendJson(status, payload)
+
+    def readData(self):
+        """ Read the body of the request. Returns None, and closes the connection after the answer, if
+            its end cannot be found (no valid Content-Length).
+        """
+        try:
+            length = int(self.headers.getheader("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or self.headers.getheader("Transfer-Encoding"):
+            self.close_connection = 1
+            return None
+        return self.rfile.read(length)
+
+    def parseBody(self, data):
+        if data == "":
+            return {}
+        try:
+            body = json.loads(data)
+        except ValueError:
+            raise HTTPError(400, "The body is not valid JSON.")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "The body must be a JSON object.")
+        return body
+
+    def sendJson(self, status, payload):
+        data = json.dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class TournamentServer(ThreadingMixIn, HTTPServer):
+    """ An HTTP server handling every request in a thread of its own."""
+    daemon_threads = True
+    allow_reuse_address = True
+    verbose = True
+
+def makeServer(host="localhost", port=8000, verbose=True):
+    """ Returns the service listening on (host, port); call serve_forever() to run it (port 0 picks a free port)."""
+    server = TournamentServer((host, port), TournamentRequestHandler)
+    server.verbose = verbose
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HTTP/JSON service for the tournament operations.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    server = makeServer(args.host, args.port)
+    if notifying(): # the live standing lists follow the writes of the other processes too.
+        listenForChanges()
+    print "\n Serving on http://{0}:{1}/ (Ctrl-C to stop)".format(*server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        connectionPool.closeAll()
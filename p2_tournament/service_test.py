@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# service_test.py -- tests of service.py over HTTP, on its local stand-in database (an in-memory
+# SQLite database), the server listening on a free port of this host.
+#
+# Usage: python service_test.py
+
+import os
+os.environ["TOURNAMENT_DATABASE"] = "sqlite::memory:" # before tournament.py chooses its backend.
+
+import json
+import httplib
+import threading
+import unittest
+
+import service
+
+
+class ServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = service.makeServer("localhost", 0, verbose=False)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.conn = httplib.HTTPConnection(*self.server.server_address) # one keep-alive connection.
+
+    def tearDown(self):
+        self.conn.close()
+
+    def call(self, method, path, body=None):
+        """ Returns (the status, the JSON payload) of the request."""
+        data = json.dumps(body) if body is not None else ""
+        self.conn.request(method, path, data, {"Content-Type" : "application/json"})
+        response = self.conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def createTournament(self, playerNum):
+        status, payload = self.call("POST", "/tournaments", {"name" : "Service"})
+        self.assertEqual(status, 201)
+        tourNum = payload["id"]
+        status, payload = self.call("POST", "/tournaments/{0}/players".format(tourNum),
+                                    {"names" : ["Player {0}".format(i) for i in range(playerNum)]})
+        self.assertEqual(status, 201)
+        return tourNum, payload["playerIds"]
+
+    def testWholeRound(self):
+        tourNum, playerIds = self.createTournament(4)
+        self.assertEqual(len(playerIds), 4)
+
+        status, payload = self.call("POST", "/tournaments/{0}/rounds".format(tourNum))
+        self.assertEqual((status, payload["round"], len(payload["pairings"])), (201, 1, 2))
+        results = [[pair["p1"], pair["p2"], pair["p1"]] for pair in payload["pairings"]]
+
+        path = "/tournaments/{0}/rounds/1/results".format(tourNum)
+        self.assertEqual(self.call("POST", path, {"results" : results}), (200, {"recorded" : 2, "unchanged" : 0}))
+        self.assertEqual(self.call("POST", path, {"results" : results}), (200, {"recorded" : 0, "unchanged" : 2}))
+        p1, p2, winner = results[0]
+        status, payload = self.call("POST", path, {"results" : [[p1, p2, p2]]})
+        self.assertEqual(status, 409)
+
+        status, payload = self.call("GET", "/tournaments/{0}/standings".format(tourNum))
+        self.assertEqual((status, payload["round"]), (200, 1))
+        self.assertEqual(sorted(row["id"] for row in payload["standings"]), sorted(playerIds))
+        self.assertEqual([row["wins"] for row in payload["standings"]], [1, 1, 0, 0])
+
+        status, payload = self.call("GET", "/tournaments/{0}/rounds/1".format(tourNum))
+        self.assertEqual((status, len(payload["matches"])), (200, 2))
+
+    def testStandingsBeforeTheFirstRound(self):
+        tourNum, playerIds = self.createTournament(3)
+        status, payload = self.call("GET", "/tournaments/{0}/standings".format(tourNum))
+        self.assertEqual((status, payload["round"]), (200, 0))
+        self.assertEqual(sorted(row["id"] for row in payload["standings"]), sorted(playerIds))
+        self.assertEqual(set((row["wins"], row["matches"]) for row in payload["standings"]), set([(0, 0)]))
+
+    def testUnknownTournament(self):
+        self.assertEqual(self.call("POST", "/tournaments/9999/rounds")[0], 404)
+        self.assertEqual(self.call("POST", "/tournaments/9999/rounds/1/results", {"results" : []})[0], 404)
+        self.assertEqual(self.call("POST", "/tournaments/9999/rounds/1/results", {"results" : [[1, 2, 1]]})[0], 404)
+        self.assertEqual(self.call("POST", "/tournaments/9999/players", {"names" : ["x"]})[0], 404)
+
+    def testUnknownRouteKeepsTheConnection(self):
+        """ The body of a request to an unknown resource is read, so the next request of the
+            connection is read from its first byte.
+        """
+        self.assertEqual(self.call("POST", "/nothing", {"name" : "x" * 100})[0], 404)
+        self.assertEqual(self.call("POST", "/tournaments", {"name" : "After"})[0], 201)
+
+    def testNamesMustBeStrings(self):
+        tourNum, playerIds = self.createTournament(0)
+        path = "/tournaments/{0}/players".format(tourNum)
+        self.assertEqual(self.call("POST", path, {"names" : "xyz"})[0], 400)
+        self.assertEqual(self.call("POST", path, {"names" : [1, 2]})[0], 400)
+        self.assertEqual(self.call("POST", path, {"playerIds" : ["1"]})[0], 400)
+        self.assertEqual(service.countPlayers(tourNum), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#
+# simulation.py -- play out whole tournaments with simulated results, for load and capacity tests.
+#
+# Usage: python simulation.py [--players N] [--tournaments N] [--processes N] [--memory]
+#                             [--spread RATING] [--draw-rate X] [--seed N] [--keep]
+#
+#   Every tournament gets N players, rated by a RatingModel, and is played through all its
+#   ceil(log2(N)) rounds: the bye player, the Swiss pairings and the new matches (addRound), then the
+#   results of the round (recordMatchResults), each drawn from the Elo expectation of the two ratings.
+#   The tournaments are spread over a pool of processes, each with its own connection pool.
+#
+#   --memory: play the tournaments in memory with the pairing engine alone (no database), the same
+#             steps on an OpponentGraph, to size the pairing path apart from the database.
+#   --keep:   keep the simulated tournaments and their players in the database (they are deleted
+#             at the end otherwise).
+#
+# Reports the tournaments and matches per second, the latency percentiles of the rounds, how well the
+# final standings follow the ratings, and the failures.
+
+import time
+import argparse
+from random import Random
+from multiprocessing import Pool
+
+from tournament import *
+from pairing import swissPairs, OpponentGraph
+from instrumentation import percentile
+
+class RatingModel(object):
+    """ The Elo model of the simulated players:
+            - the ratings are drawn from a normal distribution (mean, spread),
+            - a match is a draw with the probability drawRate; otherwise the first player wins with
+              the probability 1 / (1 + 10 ** ((rating2 - rating1) / 400)), so a player rated 200
+              points higher wins about 3 matches out of 4.
+        spread = 0 gives every player the same chance. With a seed, the ratings and results can
+        be replayed.
+    """
+
+    def __init__(self, mean=1500.0, spread=200.0, drawRate=0.1, seed=None):
+        if spread < 0 or not 0 <= drawRate <= 1:
+            raise ValueError("The spread must be >= 0 and the draw rate between 0 and 1.")
+
+        self.mean = mean
+        self.spread = spread
+        self.drawRate = drawRate
+        self.random = Random(seed)
+
+    def ratings(self, playerIds):
+        """ Returns a dict {player id: rating}."""
+        return dict((playerId, self.random.gauss(self.mean, self.spread)) for playerId in playerIds)
+
+    def expectedScore(self, rating1, rating2):
+        return 1.0 / (1.0 + 10 ** ((rating2 - rating1) / 400.0))
+
+    def result(self, id1, id2, ratings):
+        """ Returns the winner of the match between id1 and id2, or -1 for a draw; a bye player
+            (paired with the dummy player 0) always wins.
+        """
+        if id1 == 0 or id2 == 0:
+            return id1 or id2
+        if self.random.random() < self.drawRate:
+            return -1
+        return id1 if self.random.random() < self.expectedScore(ratings[id1], ratings[id2]) else id2
+
+def rankCorrelation(standingIds, ratings):
+    """ Spearman's rank correlation between the standing list 'standingIds' (best first) and the
+        ratings: 1.0 when the standings follow the ratings, about 0 for a random order (and 1.0
+        when all the ratings are equal, spread = 0).
+    """
+    n = len(standingIds)
+    if n < 2:
+        return 1.0
+    ratingRanks = dict((playerId, rank) for rank, playerId in
+                       enumerate(sorted(standingIds, key=lambda playerId: -ratings[playerId])))
+    squares = sum((rank - ratingRanks[playerId]) ** 2 for rank, playerId in enumerate(standingIds))
+    return 1.0 - 6.0 * squares / (n * (n * n - 1))
+
+def simulateInDatabase(playerNum, model, keep=False):
+    """ Play a whole tournament of 'playerNum' players in the database.
+        Returns (the standing ids, the ratings, the seconds of every round, the number of statements).
+    """
+    with operation("simulation") as stats:
+        tourNum = createTournament("Simulation {0} players".format(playerNum))
+        try:
+            ratings = model.ratings(registerPlayers(tourNum, ["Simulated player {0}".format(i)
+                                                               for i in range(1, playerNum + 1)]))
+
+            roundTimes = []
+            for i in range(finalRoundNumber(tourNum)):
+                start = time.time()
+                roundNum, pairingList, timings = addRound(tourNum)
+                recordMatchResults(tourNum, roundNum, [(id1, id2, model.result(id1, id2, ratings))
+                                                       for id1, name1, id2, name2 in pairingList])
+                roundTimes.append(time.time() - start)
+
+            standingIds = [row[0] for row in playerStandings(tourNum, lastRoundNumber(tourNum))]
+        finally:
+            if not keep:
+                dropTournament(tourNum, withPlayers=True)
+    return standingIds, ratings, roundTimes, stats["statements"]
+
+def simulateInMemory(playerNum, model, byePolicy=BYE_POLICY):
+    """ Play a whole tournament of 'playerNum' players in memory: the same bye policy, standing order
+        (wins, then the wins of the opponents) and pairing engine as in the database.
+        Returns (the standing ids, the ratings, the seconds of every round, 0 statements).
+    """
+    playerIds = range(1, playerNum + 1)
+    ratings = model.ratings(playerIds)
+    wins = dict((playerId, 0) for playerId in playerIds)
+    opponents = OpponentGraph()
+    byePlayers = set()
+
+    def standing():
+        oppWins = dict((playerId, opponents.sumOver(playerId, wins)) for playerId in playerIds)
+        return sorted(playerIds, key=lambda playerId: (-wins[playerId], -oppWins[playerId]))
+
+    roundTimes = []
+    finalRoundNum = int(ceil(log(playerNum, 2))) if playerNum > 0 else 0
+    for roundNum in range(1, finalRoundNum + 1):
+        start = time.time()
+        standingIds = standing()
+
+        pairs = []
+        if playerNum % 2 != 0:
+            eligible = [playerId for playerId in standingIds if playerId not in byePlayers]
+            byePlayer = eligible[-1] if byePolicy == "lowest" else model.random.choice(eligible)
+            byePlayers.add(byePlayer)
+            standingIds.remove(byePlayer)
+            pairs.append((byePlayer, 0))
+
+        pairs += swissPairs(standingIds, [wins[playerId] for playerId in standingIds], opponents)
+        for id1, id2 in pairs:
+            opponents.add(id1, id2)
+            winner = model.result(id1, id2, ratings)
+            if winner > 0:
+                wins[winner] += 1
+        roundTimes.append(time.time() - start)
+
+    return standing(), ratings, roundTimes, 0
+
+def simulateTournament(task):
+    """ Play one tournament (in a worker process). Returns a dict of its measures, with the error
+        message if it failed: the exception is not raised, so Pool.map still returns the measures
+        of the other tournaments and the summary lists the failed ones.
+    """
+    playerNum, inMemory, keep, modelArgs, seed = task
+    model = RatingModel(*modelArgs, seed=seed)
+    start = time.time()
+    try:
+        if inMemory:
+            standingIds, ratings, roundTimes, statements = simulateInMemory(playerNum, model)
+        else:
+            standingIds, ratings, roundTimes, statements = simulateInDatabase(playerNum, model, keep)
+        return {"error" : None, "seconds" : time.time() - start, "rounds" : roundTimes,
+                "matches" : len(roundTimes) * ((playerNum + 1) // 2), "statements" : statements,
+                "correlation" : rankCorrelation(standingIds, ratings)}
+    except Exception as e:
+        return {"error" : "{0}: {1}".format(type(e).__name__, e), "seconds" : time.time() - start,
+                "rounds" : [], "matches" : 0, "statements" : 0, "correlation" : None}
+
+def runSimulation(playerNum, tournaments=1, processes=1, inMemory=False, keep=False,
+                  mean=1500.0, spread=200.0, drawRate=0.1, seed=None):
+    """ Play 'tournaments' tournaments of 'playerNum' players each, over 'processes' processes (in
+        this process if 1). The tournament i uses the seed 'seed' + i, so a seeded run can be replayed.
+
+        Returns a summary dict:
+            players, tournaments, succeeded, failed (a list of error messages), seconds (wall-clock),
+            tournamentsPerSecond, matchesPerSecond, round (p50/p90/p99/max of the round latencies),
+            statementsPerTournament, correlation (the mean rankCorrelation of the final standings).
+    """
+    tasks = [(playerNum, inMemory, keep, (mean, spread, drawRate), None if seed is None else seed + i)
+             for i in range(tournaments)]
+    start = time.time()
+
+    if processes > 1:
+        # Every worker plays its tournaments over a connection pool of its own: close the connections
+        # of this process first, or the forked workers would inherit them.
+        connectionPool.closeAll()
+        workerPool = Pool(processes)
+        try:
+            results = workerPool.map(simulateTournament, tasks, chunksize=1)
+        finally:
+            workerPool.close()
+            workerPool.join()
+    else:
+        results = [simulateTournament(task) for task in tasks]
+
+    seconds = time.time() - start
+    succeeded = [result for result in results if result["error"] is None]
+    roundTimes = sorted(roundTime for result in succeeded for roundTime in result["rounds"])
+    return {"players" : playerNum,
+            "tournaments" : tournaments,
+            "succeeded" : len(succeeded),
+            "failed" : [result["error"] for result in results if result["error"] is not None],
+            "seconds" : seconds,
+            "tournamentsPerSecond" : len(succeeded) / seconds if seconds > 0 else 0.0,
+            "matchesPerSecond" : sum(result["matches"] for result in succeeded) / seconds if seconds > 0 else 0.0,
+            "round" : dict((name, percentile(roundTimes, p) if roundTimes else 0.0)
+                           for name, p in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]),
+            "statementsPerTournament" : (float(sum(result["statements"] for result in succeeded)) / len(succeeded)
+                                         if succeeded else 0.0),
+            "correlation" : (sum(result["correlation"] for result in succeeded) / len(succeeded)
+                           if succeeded else 0.0)}
+
+def showSimulation(summary, inMemory):
+    print "\n {0} tournaments of {1} players ({2}): {3} succeeded, {4} failed in {5:.2f} s".format(
+        summary["tournaments"], summary["players"], "in memory" if inMemory else backend.name,
+        summary["succeeded"], len(summary["failed"]), summary["seconds"])
+    print " {0:.2f} tournaments/s, {1:.0f} matches/s, {2:.0f} statements per tournament".format(
+        summary["tournamentsPerSecond"], summary["matchesPerSecond"], summary["statementsPerTournament"])
+    print " round latency (ms): p50 {p50:.1f}, p90 {p90:.1f}, p99 {p99:.1f}, max {max:.1f}".format(
+        **dict((name, value * 1000) for name, value in summary["round"].items()))
+    print " rank correlation of the final standings with the ratings: {0:.2f}".format(summary["correlation"])
+    showRows("Failures:", summary["failed"])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play out whole tournaments with simulated results.")
+    parser.add_argument("--players", type=int, default=64, help="the players of every tournament")
+    parser.add_argument("--tournaments", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=1, help="the worker processes")
+    parser.add_argument("--memory", action="store_true", help="play in memory, without the database")
+    parser.add_argument("--spread", type=float, default=200.0, help="the standard deviation of the ratings")
+    parser.add_argument("--draw-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, help="replay the same ratings and results")
+    parser.add_argument("--keep", action="store_true", help="keep the simulated tournaments in the database")
+    args = parser.parse_args()
+
+    try:
+        showSimulation(runSimulation(args.players, args.tournaments, args.processes, args.memory, args.keep,
+                                     spread=args.spread, drawRate=args.draw_rate, seed=args.seed),
+                       args.memory)
+    finally:
+        connectionPool.closeAll()
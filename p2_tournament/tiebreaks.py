@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- standing lists with configurable scoring and a chain of tiebreaks, computed in memory.
+#
+# Usage: python tiebreaks.py TOURNAMENT_ID [ROUND] [--scoring WIN,DRAW,BYE] [--tiebreaks NAME,...]
+#
+# playerStandings ranks the players by wins and opponents' wins, as the Standings table keeps them,
+# and a draw earns nothing. standings() loads the matches of a tournament once (getMatches) and
+# computes from them:
+#   points: the win, draw and bye points of a Scoring,
+#   then the tiebreaks of the chain, in order:
+#     "buchholz" (or "sos"): the sum of the points of the player's opponents,
+#     "sonneborn-berger": the points of the opponents the player has beaten, plus half of the points
+#                         of those he or she has drawn with,
+#     "omw": the sum of the wins of the player's opponents (the opp_wins of playerStandings),
+#     "wins": the number of matches the player has won (byes included).
+# With numpy installed, the arrays are built column by column and every sum is one bincount over
+# them (a few tens of milliseconds for 10000 players and 15 rounds, most of it reading the rows);
+# otherwise the sums are two plain loops over the matches, into array.array objects. Both give the
+# same results.
+
+import os
+import argparse
+from array import array
+from operator import itemgetter
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from tournament import *
+
+# The points of a won match, a draw and a bye (a lost or unplayed match gives none).
+Scoring = namedtuple("Scoring", ["win", "draw", "bye"])
+
+# The default scoring and chain of tiebreaks, can be set with the environment variables
+# TOURNAMENT_SCORING (e.g. "3,1,3") and TOURNAMENT_TIEBREAKS (e.g. "sonneborn-berger,buchholz").
+SCORING = Scoring(*[float(points) for points in os.environ.get("TOURNAMENT_SCORING", "1,0.5,1").split(",")])
+TIEBREAKS = tuple(os.environ.get("TOURNAMENT_TIEBREAKS", "buchholz,sonneborn-berger").split(","))
+
+# The outcome of a match for one of its sides.
+WIN, DRAW, LOSS, BYE, UNPLAYED = range(5)
+
+# The winner standing for "no result yet" in the numpy arrays of the matches.
+UNPLAYED_WIN = -2
+
+# The share of the opponent's points a player earns for the Sonneborn-Berger score, by outcome.
+SONNEBORN_BERGER_SHARE = [1.0, 0.5, 0.0, 0.0, 0.0]
+
+TIEBREAK_NAMES = ["buchholz", "sos", "sonneborn-berger", "omw", "wins"]
+
+def outcomePoints(scoring):
+    """ The points of a side of a match, by outcome."""
+    return [float(scoring.win), float(scoring.draw), 0.0, float(scoring.bye), 0.0]
+
+def numpyMatchSides(playerIds, matches):
+    """ Returns the numpy arrays (player, opponent, outcome) with two entries per match (p1, p2, win),
+        built column by column, the players given by their index in playerIds; the dummy player
+        gets the index len(playerIds).
+    """
+    p1 = numpy.fromiter(map(itemgetter(0), matches), int, len(matches))
+    p2 = numpy.fromiter(map(itemgetter(1), matches), int, len(matches))
+    win = numpy.fromiter((UNPLAYED_WIN if winner is None else winner for p1Id, p2Id, winner in matches),
+                         int, len(matches))
+
+    ids = numpy.array(list(playerIds) + [0])
+    index = numpy.zeros(ids.max() + 1, dtype=int) # player id -> index, the dummy player last.
+    index[ids] = numpy.arange(len(ids))
+    i1, i2 = index[p1], index[p2]
+
+    def outcomeOf(me, other):
+        return numpy.select([win == UNPLAYED_WIN, win == -1, (win == me) & (other == 0), win == me],
+                            [UNPLAYED, DRAW, BYE, WIN], LOSS)
+
+    return (numpy.concatenate([i1, i2]), numpy.concatenate([i2, i1]),
+            numpy.concatenate([outcomeOf(p1, p2), outcomeOf(p2, p1)]))
+
+def numpyRanking(playerIds, matches, scoring, tiebreaks):
+    """ Returns (the indexes of the players in standing order, the dict of their points, matches and
+        tiebreaks by name), the sums computed with numpy.
+    """
+    n = len(playerIds)
+    player, opponent, outcome = numpyMatchSides(playerIds, matches)
+
+    def total(weights):
+        return numpy.bincount(player, weights=weights, minlength=n + 1)
+
+    points = total(numpy.array(outcomePoints(scoring))[outcome])
+    wins = total(((outcome == WIN) | (outcome == BYE)).astype(float))
+    points[n] = wins[n] = 0 # the dummy player counts for nothing.
+    totals = {"points" : points, "wins" : wins, "matches" : total((outcome <= LOSS).astype(float))}
+
+    for name in tiebreaks:
+        if name in ("buchholz", "sos"):
+            totals[name] = total(points[opponent])
+        elif name == "sonneborn-berger":
+            totals[name] = total(points[opponent] * numpy.array(SONNEBORN_BERGER_SHARE)[outcome])
+        elif name == "omw":
+            totals[name] = total(wins[opponent])
+
+    # lexsort sorts by the last key first: the id breaks the ties left.
+    keys = [numpy.array(playerIds)] + [-totals[name][:n] for name in reversed(tiebreaks)] + [-points[:n]]
+    return numpy.lexsort(keys).tolist(), dict((name, values.tolist()) for name, values in totals.items())
+
+def pythonRanking(playerIds, matches, scoring, tiebreaks):
+    """ The same as numpyRanking, without numpy: one loop over the matches for the points, wins
+        and matches, and one for the tiebreaks.
+    """
+    n = len(playerIds)
+    index = dict((playerId, i) for i, playerId in enumerate(playerIds))
+    index[0] = n
+    sidePoints = outcomePoints(scoring)
+
+    sides = array('l') # index of p1, index of p2, outcome for p1, outcome for p2, for every match.
+    points, wins, matchNumbers = [array('d', [0.0]) * (n + 1) for i in range(3)]
+    for p1, p2, win in matches:
+        i1, i2 = index[p1], index[p2]
+        if win is None:
+            result1 = result2 = UNPLAYED
+        elif win == -1:
+            result1 = result2 = DRAW
+        elif win == p1:
+            result1, result2 = WIN, LOSS
+        else:
+            result1, result2 = LOSS, (BYE if p1 == 0 else WIN)
+        sides.extend((i1, i2, result1, result2))
+
+        points[i1] += sidePoints[result1]
+        points[i2] += sidePoints[result2]
+        if win is not None and win > 0:
+            wins[index[win]] += 1
+        if result1 <= LOSS and p1 != 0:
+            matchNumbers[i1] += 1
+            matchNumbers[i2] += 1
+    points[n] = wins[n] = matchNumbers[n] = 0 # the dummy player counts for nothing.
+
+    buchholz, sonnebornBerger, omw = [array('d', [0.0]) * (n + 1) for i in range(3)]
+    share = SONNEBORN_BERGER_SHARE
+    for k in range(0, len(sides), 4):
+        i1, i2, result1, result2 = sides[k:k + 4]
+        buchholz[i1] += points[i2]
+        buchholz[i2] += points[i1]
+        sonnebornBerger[i1] += points[i2] * share[result1]
+        sonnebornBerger[i2] += points[i1] * share[result2]
+        omw[i1] += wins[i2]
+        omw[i2] += wins[i1]
+
+    totals = {"points" : points, "wins" : wins, "matches" : matchNumbers, "buchholz" : buchholz,
+              "sos" : buchholz, "sonneborn-berger" : sonnebornBerger, "omw" : omw}
+    order = sorted(range(n), key=lambda i: ([-points[i]] + [-totals[name][i] for name in tiebreaks], playerIds[i]))
+    return order, totals
+
+def rankPlayers(playerIds, matches, scoring=SCORING, tiebreaks=TIEBREAKS):
+    """ Rank the players 'playerIds' (the dummy player 0 excepted) after the matches (p1, p2, win).
+
+        Returns a list of tuples (id, points, tiebreaks, matches), sorted by points and then by the
+        values of the tuple 'tiebreaks', in the order of the chain; the players equal on all of
+        them are sorted by id.
+    """
+    for name in tiebreaks:
+        if name not in TIEBREAK_NAMES:
+            raise ValueError("Unknown tiebreak: {0} (one of {1}).".format(name, ", ".join(TIEBREAK_NAMES)))
+
+    order, totals = (numpyRanking if numpy is not None else pythonRanking)(playerIds, matches, scoring, tiebreaks)
+
+    points, matchNumbers = totals["points"], totals["matches"]
+    values = list(zip(*[totals[name] for name in tiebreaks])) if tiebreaks else [()] * (len(playerIds) + 1)
+    return [(playerIds[i], points[i], values[i], int(matchNumbers[i])) for i in order]
+
+def standings(tourNum, roundNum=None, scoring=SCORING, tiebreaks=TIEBREAKS):
+    """ Returns the standing list of the tournament 'tourNum' at the end of the round 'roundNum'
+        (the last round by default) with the points of 'scoring' and the chain 'tiebreaks'.
+
+        A list of tuples, each of which contains (id, name, points, tiebreaks, matches), as the
+        tuples (id, name, wins, opp_wins, matches) of playerStandings:
+            points: the points of the player (wins, draws and bye),
+            tiebreaks: the tuple of the values of the tiebreaks, in the order of the chain,
+            matches: the number of matches the player has played.
+    """
+    if roundNum is None:
+        roundNum = lastRoundNumber(tourNum)
+    scoring, tiebreaks = Scoring(*scoring), tuple(tiebreaks)
+
+    def load():
+        players = db_CRUD([{"sql" : "select p.id, p.name from Players p \
+                                     join Players_Tournaments pt on pt.player_id = p.id \
+                                     where pt.tourNumber = %s and p.id <> 0 order by p.id;",
+                            "args" : [tourNum]}])
+        names = dict(players)
+        matches = [(p1, p2, win) for tour, roundNumber, p1, p2, win in getMatches(tourNum, roundNum)]
+        return [(playerId, names[playerId], points, values, matchNumber)
+                for playerId, points, values, matchNumber in rankPlayers([row[0] for row in players], matches,
+                                                                         scoring, tiebreaks)]
+
+    return list(cachedRead((tourNum, "tiebreaks", roundNum, scoring, tiebreaks), load))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Standing list with configurable scoring and tiebreaks.")
+    parser.add_argument("tournament", type=int)
+    parser.add_argument("round", type=int, nargs="?", help="the last round counted (the last round by default)")
+    parser.add_argument("--scoring", default=",".join(str(points) for points in SCORING),
+                        help="the points of a win, a draw and a bye, e.g. 3,1,3")
+    parser.add_argument("--tiebreaks", default=",".join(TIEBREAKS),
+                        help="the chain of tiebreaks among " + ", ".join(TIEBREAK_NAMES))
+    args = parser.parse_args()
+
+    try:
+        chain = [name for name in args.tiebreaks.split(",") if name]
+        showRows("Standing list:\n\n id, name, points, ({0}), matches".format(", ".join(chain)),
+                 standings(args.tournament, args.round,
+                           Scoring(*[float(points) for points in args.scoring.split(",")]), chain))
+    finally:
+        connectionPool.closeAll()
@@ -2,36 +2,279 @@
 
  tournament.py -- implementation of a Swiss-system tournament
 """
-from random import randint
+import os
+import time
+import threading
+from contextlib import contextmanager
 from math import log, ceil
-import psycopg2
-MAX_NUMBER_OF_PLAYERS = 16
+import queries
+from dbpool import ConnectionPool
+from cache import ReadCache
+from instrumentation import operation, instrumented, recordConnect, recordCheckout, formatStats
+from backends import backendFromEnvironment
+from pairing import swissPairs, OpponentGraph
+import events
+
+# How setByePlayer chooses a bye player: "random" or "lowest" (the lowest-ranked player),
+# can be set with the environment variable TOURNAMENT_BYE_POLICY.
+BYE_POLICY = os.environ.get("TOURNAMENT_BYE_POLICY", "random")
+
+# The maximum number of players of a tournament, can be set with the environment variable TOURNAMENT_MAX_PLAYERS.
+MAX_NUMBER_OF_PLAYERS = int(os.environ.get("TOURNAMENT_MAX_PLAYERS", 100000))
+
+# The pool size can be set with the environment variables TOURNAMENT_POOL_MIN and TOURNAMENT_POOL_MAX.
+POOL_MIN_CONNECTIONS = int(os.environ.get("TOURNAMENT_POOL_MIN", 1))
+POOL_MAX_CONNECTIONS = int(os.environ.get("TOURNAMENT_POOL_MAX", 8))
+
+# The number of rows written by one statement of a bulk write.
+BULK_PAGE_SIZE = 1000
+
+# The number of rows read per round-trip by streamRows, can be set with the environment variable
+# TOURNAMENT_FETCH_SIZE, and the default number of rows of a page of the paginated reads.
+FETCH_SIZE = int(os.environ.get("TOURNAMENT_FETCH_SIZE", 1000))
+PAGE_SIZE = 100
+
+# The number of standing lists and match lists kept in memory, can be set with the environment
+# variable TOURNAMENT_CACHE_SIZE (0 disables the cache).
+CACHE_SIZE = int(os.environ.get("TOURNAMENT_CACHE_SIZE", 1024))
+
+# Send the change events (see events.py) with PostgreSQL NOTIFY too, for the listeners of the other
+# processes: the environment variable TOURNAMENT_NOTIFY=1.
+NOTIFY_CHANGES = os.environ.get("TOURNAMENT_NOTIFY", "") == "1"
+
+# The storage backend (PostgreSQL by default, see backends.py and useBackend).
+backend = backendFromEnvironment(BULK_PAGE_SIZE)
 
 def connect():
-    """ Connect to the PostgreSQL database. Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    """ Connect to the database of the backend. Returns a database connection."""
+    start = time.time()
+    conn = backend.connect()
+    recordConnect(time.time() - start)
+    return conn
+
+def newConnectionPool():
+    maxConnections = min(POOL_MAX_CONNECTIONS, backend.maxConnections or POOL_MAX_CONNECTIONS)
+    return ConnectionPool(lambda: connect(), min(POOL_MIN_CONNECTIONS, maxConnections), maxConnections)
+
+# All the queries share the connections of this pool instead of connecting for every query,
+# so a whole round (several db_CRUD calls in a row) runs over the same warm connection.
+connectionPool = newConnectionPool()
+
+def useBackend(newBackend):
+    """ Switch to another storage backend, e.g. useBackend(SQLiteBackend(":memory:")).
+        The connections of the former backend are closed.
+    """
+    global backend, connectionPool
+    connectionPool.closeAll()
+    backend = newBackend
+    connectionPool = newConnectionPool()
+    readCache.clear()
+
+def poolStatistics():
+    """ Returns the hits/misses/waits counters and the connection numbers of the connection pool."""
+    return connectionPool.statistics()
+
+# The standing lists and match lists already read, by (tourNum, "standings" or "matches", roundNum).
+# A process has its own cache: it only sees the writes made through this module in the same process.
+readCache = ReadCache(CACHE_SIZE)
+
+def cacheStatistics():
+    """ Returns the hits/misses counters, the hit rate and the number of entries of the read cache."""
+    return readCache.statistics()
+
+# The connection of the transaction opened by transaction() in the current thread, if any,
+# and the tournaments written in it.
+transactionState = threading.local()
+
+def cachedRead(key, loadFn):
+    """ Read through the cache. Inside a transaction() the database is always read, since the
+        transaction may see writes of its own that are not committed yet.
+    """
+    if getattr(transactionState, "conn", None) is not None:
+        return loadFn()
+    return readCache.get(key, loadFn)
+
+def cachedStream(key, rowsFn):
+    """ Stream through the cache: a cached result is replayed, otherwise the rows are yielded as they
+        are read and kept only if there are at most FETCH_SIZE of them.
+    """
+    if getattr(transactionState, "conn", None) is not None:
+        return rowsFn()
+    return readCache.stream(key, rowsFn, FETCH_SIZE)
+
+def invalidateTournament(tourNum):
+    """ Drop the cached reads of the tournament 'tourNum' after a write. Inside a transaction()
+        they are dropped again at its end, so that no other thread keeps a result read before the commit.
+    """
+    readCache.invalidate(tourNum)
+    if getattr(transactionState, "conn", None) is not None:
+        transactionState.written.add(tourNum)
+
+@contextmanager
+def transaction():
+    """ Run all the db_CRUD calls of a 'with' block on one pooled connection, in one transaction:
+        it is committed at the end of the block, or rolled back if the block raises an exception.
+        A transaction() inside another one of the same thread simply joins it.
+    """
+    if getattr(transactionState, "conn", None) is not None:
+        yield transactionState.conn
+        return
+
+    with connectionPool.connection() as conn:
+        recordCheckout()
+        backend.begin(conn, immediate=True)
+        transactionState.conn = conn
+        transactionState.written = set()
+        transactionState.changes = []
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            transactionState.conn = None
+            for tourNum in transactionState.written:
+                readCache.invalidate(tourNum)
+
+    for event in transactionState.changes: # committed, and the connection is back in the pool.
+        events.bus.publish(event)
+
+def notifying():
+    return NOTIFY_CHANGES and backend.name == "postgresql"
+
+def publishing():
+    """ True if the change events are published: someone subscribed to them in this process, or
+        they are sent with NOTIFY. Otherwise the writes do not build them.
+    """
+    return events.bus.subscribed() or notifying()
+
+def publishChange(event):
+    """ Publish the change event 'event' on the bus of this process once the change is committed
+        (at the end of the transaction() if there is one), and send it with NOTIFY in the same
+        transaction as the change if NOTIFY_CHANGES.
+    """
+    if notifying():
+        db_CRUD([{"sql" : "select pg_notify(%s, %s);", "args" : [events.NOTIFY_CHANNEL, payload]}
+                 for payload in events.notifyPayloads(event)])
+    if getattr(transactionState, "conn", None) is not None:
+        transactionState.changes.append(event)
+    else:
+        events.bus.publish(event)
+
+def followTournament(tourNum):
+    """ Returns an events.LiveStandings of the tournament 'tourNum': its last standing list, kept
+        up to date from the change events without any further query. unfollowTournament(live)
+        stops it.
+    """
+    live = events.LiveStandings(tourNum)
+    live.subscription = events.bus.subscribe(live.apply, tourNum)
+    roundNum = lastRoundNumber(tourNum)
+    live.load(roundNum, playerStandings(tourNum, roundNum),
+              [(p1, p2, win) for tour, roundNumber, p1, p2, win in getMatches(tourNum, roundNum)
+               if roundNumber == roundNum])
+    return live
+
+def unfollowTournament(live):
+    events.bus.unsubscribe(live.subscription)
+
+def listenForChanges():
+    """ Start an events.PostgresListener publishing the change events NOTIFYed by the other processes
+        (including the ones of async_tournament with notify=True) on the bus of this process, after
+        dropping the cached reads of their tournament (PostgreSQL only). Returns it; its stop() ends it.
+    """
+    if backend.name != "postgresql":
+        raise ValueError("The change events of the other processes need the PostgreSQL backend.")
+    listener = events.PostgresListener(connect, received=lambda event: readCache.invalidate(event["tournament"]))
+    listener.start()
+    return listener
 
 def db_CRUD(sqlList):
-    """ execute every sql in sqlList and return the result of the last one."""
-    conn = connect()
-    c = conn.cursor()
-    for sql in sqlList:
-        c.execute(sql["sql"].format(*sql["args"]))
-    try:
-        result = c.fetchall()
-    except:
-        result =  []
-    conn.commit()
-    conn.close()
+    """ execute every sql in sqlList over a pooled connection and return the result of the last one.
+        Inside a transaction() block, the connection of the transaction is used and nothing is
+        committed before the end of the block; otherwise the sqlList is committed at once.
+
+        Every item of sqlList is either
+            {"sql" : a statement with %s placeholders, "args" : [its arguments]} or
+            {"prepared" : the name of a statement in queries.PREPARED, "args" : [its arguments]} or
+            {"bulk" : the name of a bulk write in queries.BULK, "values" : rows (any iterable)},
+                written with BULK_PAGE_SIZE rows per statement (the rows it returns, if any).
+        The arguments are always sent as bound parameters, never pasted into the statement.
+        The backend runs them in its own SQL dialect.
+    """
+    conn = getattr(transactionState, "conn", None)
+    if conn is not None:
+        return backend.executeSqlList(conn, sqlList)
+
+    with connectionPool.connection() as conn:
+        recordCheckout()
+        backend.begin(conn)
+        result = backend.executeSqlList(conn, sqlList)
+        conn.commit()
     return result
 
+def streamRows(sql, args=[], fetchSize=None):
+    """ A generator of the rows of the query 'sql' (with %s placeholders and the arguments 'args'),
+        read 'fetchSize' rows (FETCH_SIZE by default) per round-trip instead of all at once as db_CRUD
+        does: the first rows are available at once and the memory used does not grow with the table.
+
+        Outside of a transaction() the generator holds a pooled connection until it is exhausted or
+        closed, so do not leave it half-read and do not call db_CRUD while iterating over it if the
+        pool has a single connection (e.g. an in-memory SQLite database).
+    """
+    conn = getattr(transactionState, "conn", None)
+    if conn is not None:
+        for row in backend.streamRows(conn, sql, args, fetchSize or FETCH_SIZE):
+            yield row
+        return
+
+    with connectionPool.connection() as conn:
+        recordCheckout()
+        backend.begin(conn)
+        for row in backend.streamRows(conn, sql, args, fetchSize or FETCH_SIZE):
+            yield row
+        conn.commit()
+
+def pagePlayers(afterId=-1, limit=PAGE_SIZE):
+    """ Returns the next 'limit' players (id, name) by id after the player 'afterId' (keyset
+        pagination: each page is an index range scan however far it is). Pass the id of the last
+        row of a page to get the next one; an empty list is the end.
+    """
+    return db_CRUD([{"sql" : "select id, name from Players where id > %s order by id limit %s;",
+                     "args" : [afterId, limit]}])
+
+def pageTournaments(afterId=0, limit=PAGE_SIZE):
+    """ Returns the next 'limit' tournaments (id, name) by id after the tournament 'afterId'."""
+    return db_CRUD([{"sql" : "select id, name from Tournaments where id > %s order by id limit %s;",
+                     "args" : [afterId, limit]}])
+
+def pagePlayersInTournament(tourNum, afterId=-1, limit=PAGE_SIZE):
+    """ Returns the next 'limit' registrations (tourNumber, player_id, bye) of the tournament
+        'tourNum' by player id after the player 'afterId'.
+    """
+    return db_CRUD([{"sql" : "select tourNumber, player_id, bye from Players_Tournaments \
+                              where tourNumber = %s and player_id > %s order by player_id limit %s;",
+                     "args" : [tourNum, afterId, limit]}])
+
+def pageMatches(tourNum, roundNum=None, after=None, limit=PAGE_SIZE):
+    """ Returns the next 'limit' matches (tourNumber, roundNumber, p1, p2, win) of the tournament
+        'tourNum', of the round 'roundNum' only if it is given, ordered by (roundNumber, p1, p2).
+        'after' is the (roundNumber, p1, p2) of the last match of the previous page, None for the first page.
+    """
+    roundNumber, p1, p2 = after or (0, -1, -1)
+    sql = "select tourNumber, roundNumber, p1, p2, win from Matches \
+           where tourNumber = %s and (roundNumber, p1, p2) > (%s, %s, %s)"
+    args = [tourNum, roundNumber, p1, p2]
+    if roundNum is not None:
+        sql += " and roundNumber = %s"
+        args.append(roundNum)
+    return db_CRUD([{"sql" : sql + " order by roundNumber, p1, p2 limit %s;", "args" : args + [limit]}])
+
 def countPlayers(tourNum):
     """ Returns the number of players currently registered for the tournament "tourNum"."""
-    result = db_CRUD([{"sql" : "select count(*) from Players_Tournaments where tourNumber = {0};",
+    result = db_CRUD([{"sql" : "select count(*) from Players_Tournaments where tourNumber = %s;",
                        "args" : [tourNum]}]
              )
     return int(result[0][0])
 
+@instrumented
 def registerPlayer(name):
     """ Adds a player to the tournament database.
     The database assigns a unique serial id number for the player. (This will be handled by
@@ -39,16 +282,85 @@ def registerPlayer(name):
     Args:
         name: the player's full name (need not be unique).
     """
-    result = db_CRUD([{"sql" : "insert into Players (id, name) values (DEFAULT, '{0}') returning id;",
+    result = db_CRUD([{"sql" : "insert into Players (name) values (%s) returning id;",
                        "args" : [name]}]
              )
     return result[0][0] # return the id of the new player.
 
+def createTournament(name):
+    """ Adds a tournament to the database and returns its id."""
+    result = db_CRUD([{"sql" : "insert into Tournaments (name) values (%s) returning id;",
+                       "args" : [name]}])
+    return result[0][0]
+
+def dropTournament(tourNum, withPlayers=False):
+    """ Remove the tournament 'tourNum' with its registrations, matches and standing lists (its
+        players stay in the Players table, unless 'withPlayers': e.g. the generated players of
+        benchmark.py and simulation.py). Once the tables are partitioned by tournament, its
+        partitions are dropped instead of its rows deleted (see drop_tournament in migrations/),
+        which locks the tables of all the tournaments until it is committed.
+    """
+    sqlList = [{"prepared" : "dropTournament", "args" : [tourNum]}]
+    if withPlayers:
+        # Read before the drop, in a transaction of its own: the drop must not wait for the locks
+        # of the partitioned tables holding any of them (see migrations/).
+        playerIds = [row[0] for row in db_CRUD([{"sql" : "select player_id from Players_Tournaments \
+                                                          where tourNumber = %s and player_id <> 0;",
+                                                 "args" : [tourNum]}])]
+        for i in range(0, len(playerIds), BULK_PAGE_SIZE):
+            page = playerIds[i:i + BULK_PAGE_SIZE]
+            sqlList.append({"sql" : "delete from Players where id in ({0});".format(", ".join(["%s"] * len(page))),
+                            "args" : page})
+    db_CRUD(sqlList)
+    invalidateTournament(tourNum)
+
+@instrumented
+def registerPlayers(tourNum, names=[], playerIds=[]):
+    """ Register new players (their names) and existing players (their ids) for the tournament
+        'tourNum' at once, in one transaction. The tournament must not have any round yet.
+        The dummy player is added to or removed from the tournament so that its number of players
+        stays even.
+        Returns the ids of the new players.
+    """
+    with transaction():
+        if db_CRUD([{"sql" : "select id from Tournaments where id = %s for update;", "args" : [tourNum]}]) == []:
+            raise UnknownTournament("Invalid tournament ID.")
+        if lastRoundNumber(tourNum) > 0:
+            raise ValueError("Players cannot be added after the first round.")
+
+        playerIds = [int(playerId) for playerId in playerIds]
+        if playerIds:
+            result = db_CRUD([{"sql" : "select id from Players where id in ({0}) and id <> 0;"
+                                       .format(", ".join(["%s"] * len(playerIds))),
+                               "args" : playerIds}])
+            missing = set(playerIds) - set(row[0] for row in result)
+            if missing:
+                raise ValueError("The player id {0} is not exist.".format(min(missing)))
+
+        # The new players in multi-row inserts; their ids increase in the order of the names.
+        newIds = sorted(row[0] for row in db_CRUD([{"bulk" : "insertPlayers",
+                                                    "values" : [(name,) for name in names]}]))
+        db_CRUD([{"bulk" : "insertRegistrations",
+                  "values" : [(tourNum, playerId, 0) for playerId in newIds + playerIds]},
+                 {"sql" : "delete from Players_Tournaments where tourNumber = %s and player_id = 0;",
+                  "args" : [tourNum]}])
+
+        playerNumber = countPlayers(tourNum)
+        if playerNumber > MAX_NUMBER_OF_PLAYERS:
+            raise ValueError("A tournament can have {0} players at most.".format(MAX_NUMBER_OF_PLAYERS))
+        if playerNumber % 2 != 0: # Add a dummy player to this tournament.
+            db_CRUD([{"bulk" : "insertRegistrations", "values" : [(tourNum, 0, 0)]}])
+        invalidateTournament(tourNum)
+    return newIds
+
+@instrumented
 def playerStandings(tourNum, roundNum):
-    """ Using functions: matches_number_fn(), wins_fn(), and total_opponent_wins_fn().
+    """ Read from the Standings table, which the database keeps up to date on every change of
+    the Matches table (see checkStandings to compare it with a full recomputation).
 
     Returns a list of the players and their win records at the end of the round "roundNum"
     of the tournament "tourNum", sorted by wins and the total wins of the player's opponents.
+    Before the first round (roundNum 0), every registered player with 0 wins and 0 matches.
 
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
@@ -61,23 +373,58 @@ def playerStandings(tourNum, roundNum):
             opp_wins: the number of matches the player's opponents has won
             matches: the number of matches the player has played
     """
-    result = db_CRUD([{"sql" :"select t1.id, name, wins, opp_wins, matches \
-                               from (select p.id as id, p.name as name, wins, matches \
-                                     from matches_number_fn({0}, {1}) p \
-                                          left join wins_fn({0}, {1}) w \
-                                          on p.id = w.id) t1 \
-                                    left join total_opponent_wins_fn({0}, {1}) t2 \
-                                    on t1.id = t2.id \
-                               order by wins desc, opp_wins desc;",
-
-                       "args" : [tourNum, roundNum]}]
-             )
+    def load():
+        result = db_CRUD([{"prepared" : "standings", "args" : [tourNum, roundNum]}])
+        if result == []: # no round played yet (roundNum 0 or before the first pairings).
+            result = db_CRUD([{"prepared" : "registrations", "args" : [tourNum]}])
+        return [row for row in result if row[0] != 0] # eliminate dummy player if exists.
 
-    standingList = [row for row in result if row[0] != 0] # eliminate dummy player if exists.
+    standingList = list(cachedRead((tourNum, "standings", roundNum), load))
     return standingList
 
+@instrumented
+def checkStandings(tourNum):
+    """ Compare the Standings table of the tournament "tourNum" with the standing lists recomputed
+        from the Matches table by standings_fn(), for every round of the tournament.
+
+        Returns a list of tuples (roundNumber, player_id, stored, computed) for the players whose
+        (wins, opp_wins, matches) differ, stored being None when the row is missing.
+        An empty list means the Standings table is consistent.
+    """
+    result = db_CRUD([{"sql" : "select distinct roundNumber from Matches where tourNumber = %s \
+                                union select distinct roundNumber from Standings where tourNumber = %s \
+                                order by roundNumber;",
+                       "args" : [tourNum, tourNum]}])
+
+    differences = []
+    for (roundNum,) in result:
+        stored = db_CRUD([{"sql" : "select player_id, wins, opp_wins, matches from Standings \
+                                    where tourNumber = %s and roundNumber = %s;",
+                           "args" : [tourNum, roundNum]}])
+        computed = db_CRUD([{"prepared" : "computedStandings", "args" : [tourNum, roundNum]}])
+
+        storedRecords = dict((row[0], tuple(row[1:])) for row in stored)
+        computedRecords = dict((row[0], (row[2], row[3], row[4])) for row in computed)
+        for player_id in sorted(set(storedRecords) | set(computedRecords)):
+            if storedRecords.get(player_id) != computedRecords.get(player_id):
+                differences.append((roundNum, player_id,
+                                    storedRecords.get(player_id), computedRecords.get(player_id)))
+    return differences
+
+@instrumented
+def rebuildStandings(tourNum):
+    """ Replace the Standings table of the tournament "tourNum" by a full recomputation,
+        after the opponent graph (the Opponents table) it is computed from.
+    """
+    db_CRUD([{"sql" : "delete from Opponents where tourNumber = %s;", "args" : [tourNum]},
+             {"prepared" : "rebuildOpponents", "args" : [tourNum]},
+             {"sql" : "delete from Standings where tourNumber = %s;", "args" : [tourNum]},
+             {"prepared" : "rebuildStandings", "args" : [tourNum]}])
+    invalidateTournament(tourNum)
+
+@instrumented
 def swissPairings(tourNum, roundNum):
-    """ Call functions setByePlayer, playerStandings.
+    """ Call functions setByePlayer, playerStandings and pairing.swissPairs.
 
     Returns a list of pairs of players for the next round of a tournament.
 
@@ -85,8 +432,9 @@ def swissPairings(tourNum, roundNum):
     If there were some rounds of that tournament, the playersList will be updated from the standingList.
 
     Each player appears exactly once in the pairings. Each player is paired with another
-    player with an equal or nearly-equal win record, it means, a player adjacent
-    to him or her in the standings.
+    player with an equal or nearly-equal win record, it means, the nearest player below
+    him or her in the standings that he or she has not met yet in this tournament.
+    A ValueError is raised if the players cannot be paired without a rematch.
 
     Returns the pairingList:
         A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -96,118 +444,142 @@ def swissPairings(tourNum, roundNum):
             name2: the second player's name
     """
 
-    pairingList, playersList, byePlayer = setByePlayer(tourNum)
+    pairingList, byePlayer = setByePlayer(tourNum)
+    playerIds, scores, names, opponents = pairingInput(tourNum, roundNum, byePlayer)
 
-    # If there are some rounds of the tournament, take a playersList from a standingList.
-    result = db_CRUD([{"sql" :"select * from Matches where tourNumber = {0};",
-                       "args" : [tourNum]}]
-             )
+    for id1, id2 in swissPairs(playerIds, scores, opponents):
+        pairingList.append((id1, names[id1], id2, names[id2]))
 
-    if result != []:
-        standingList = playerStandings(tourNum, roundNum)
-        playersList = [(row[0], row[1])  for row in standingList if row[0] != byePlayer]
+    return pairingList
 
-    for i,row in enumerate(playersList):
-        if i%2 == 0:
-            [c1, c2] = [row[0], row[1]]
-        else:
-            [c3, c4] = [row[0], row[1]]
-            pairingList.append((c1, c2, c3, c4))
+def pairingInput(tourNum, roundNum, byePlayer):
+    """ Load what the pairing engine needs for the round 'roundNum' of the tournament 'tourNum':
+        returns (playerIds, scores, names, opponents) for all the players except the byePlayer,
+        in standing order, and the players each of them has already met.
+    """
+    opponents = opponentGraph(tourNum)
 
-    return pairingList
+    # If there are some rounds of the tournament, take a playersList from a standingList.
+    if len(opponents) > 0:
+        playersList = playerStandings(tourNum, roundNum)  # rows (id, name, wins, ...)
+    else:
+        playersList = db_CRUD([{"sql" : "select p.id, name, 0 \
+                                         from players p join Players_Tournaments pt \
+                                                        on p.id = pt.Player_id \
+                                         where tourNumber = %s and p.id <> 0;",
+                                "args" : [tourNum]}]
+                      )
+
+    playerIds, scores, names = [], [], {}
+    for row in playersList:
+        if row[0] != byePlayer:
+            playerIds.append(row[0])
+            scores.append(row[2])
+            names[row[0]] = row[1]
+
+    return playerIds, scores, names, opponents
+
+def opponentGraph(tourNum):
+    """ Returns the OpponentGraph of the tournament 'tourNum': the players each player has already
+        met, read from the Opponents table which the triggers on Matches keep up to date.
+    """
+    return cachedRead((tourNum, "opponents"),
+                      lambda: OpponentGraph(db_CRUD([{"prepared" : "opponents", "args" : [tourNum]}])))
 
-def setByePlayer(tourNum):
+@instrumented
+def setByePlayer(tourNum, policy=None):
     """ If the player number is odd:
-            - a player is set to a "bye player" by random.
-            - Once someone is set to a bye player, the info is written to the Players_Tournaments table,
-              to ensure that he or she is a bye player no more than one time in a tournament.
+            - a player is set to a "bye player" by the policy 'policy' (BYE_POLICY by default):
+                "random": a random player,
+                "lowest": the lowest-ranked player in the last standing list.
+              Only the players who have not been a bye player yet in this tournament are eligible;
+              the database chooses one of them with the partial index on Players_Tournaments.
+            - Once someone is set to a bye player, the info is written to the Players_Tournaments table
+              (in the same statement), to ensure that he or she is a bye player no more than one time
+              in a tournament.
             - The pairingList will be added a pair of that bye player with the dummy player.
-            - The playersList will be eliminated that player.
 
             (A dummy player is a player with the id = 0, it is inserted to the Players table
-             at the begining to be used in some algorithms in the program)
+             at the begining to be used in some algorithms in the program. It is added to a
+             tournament exactly when the number of its players is odd.)
 
             return a pairingList with the first pair of the byePlayer with the dummy player,
-                   a playersList, and byePlayer is set to byePlayer ID.
+                   and byePlayer is set to byePlayer ID.
 
         If the player number is even:
-           return an empty pairingList, a playersList, and byePlayer is set to 0.
+           return an empty pairingList, and byePlayer is set to 0.
     """
 
     pairingList = []
     byePlayer = 0
 
-    result = db_CRUD([{"sql" : "select p.id, name, bye \
-                                from players p join Players_Tournaments pt \
-                                               on p.id = pt.Player_id \
-                                where tourNumber = {0} and p.id <> 0;",
-                        "args" : [tourNum]}]
+    result = db_CRUD([{"sql" : "select 1 from Players_Tournaments where tourNumber = %s and player_id = 0;",
+                       "args" : [tourNum]}]
              )
 
-    playersList = result
+    if result != []: # the dummy player is in this tournament, the player number is odd.
+        result = db_CRUD([{"prepared" : queries.BYE_POLICIES[policy or BYE_POLICY], "args" : [tourNum]}])
 
-    playerNum = len(playersList)
-    if playerNum % 2 != 0:
-
-        r = randint(0, playerNum - 1)
-        count = 0
-        while byePlayer == 0:
-            if playersList[r][2] == 0: # The bye attribute is still equal 0 in this tournament.
-                byePlayer = playersList[r][0] # The id of the chosen bye player.
-
-                pair = (playersList[r][0], playersList[r][1], 0, "")
-                pairingList.append(pair) # a pair of the bye player and the dummy player.
-
-                db_CRUD([{"sql" : "update Players_Tournaments set bye = 1 \
-                                   where player_id = {0} and tourNumber = {1};",
-                          "args" : [playersList[r][0], tourNum]}]
-                )
-
-                playersList = playersList[0:r] + playersList[r+1:] # eliminate the bye player.
-
-            else:
-                r = (r + 1) % playerNum  # try to find another player with bye attribute is still equal 0.
-            count += 1
+        if result == []:
+            raise ValueError("The round number is over the actual available round of the tournament.")
+            # Actually, we always found the new byePlayer because the number of rounds is equal
+            # ceil(log2(playerNum)).
 
-            if count > playerNum:
-                raise ValueError("The round number is over the actual available round of the tournament.")
-                # Actually, we always found the new byePlayer because the number of rounds is equal
-                # ceil(log2(playerNum)). So the loop will never be infinite loop.
+        byePlayer, name = result[0]
+        pairingList.append((byePlayer, name, 0, "")) # a pair of the bye player and the dummy player.
 
-    return pairingList, playersList, byePlayer
+    return pairingList, byePlayer
 
 def removeByePlayer(tourNum, lastRoundNum):
     """ When some round is aborted the byePlayer of that round if exists must be reset,
         so that he or she can be a byePlayer for some further round.
     """
-    result = db_CRUD([{"sql" : "select * from Matches where tourNumber = {0} and roundNumber = {1};",
-                       "args" : [tourNum, lastRoundNum]}])
-    for match in result:
-        if match[2] == 0 or match[3] == 0:
-            byePlayer = match[2] if match[3] == 0 else match[3]
+    db_CRUD([{"prepared" : "resetBye", "args" : [tourNum, lastRoundNum]}])
+    invalidateTournament(tourNum)
 
-            db_CRUD([{"sql" : "update Players_Tournaments set bye = 0 \
-                               where player_id = {0} and tourNumber = {1};",
-                      "args" : [byePlayer, tourNum]}]
-            )
+def lastRoundNumber(tourNum):
+    """ Returns the number of the last round of the tournament 'tourNum', 0 if there is not any round."""
+    result = db_CRUD([{"sql" : "select max(roundNumber) from Matches where tourNumber = %s;",
+                       "args" : [tourNum]}]
+             )
+    result = result[0]
+    return 0 if result[0] == None else int(result[0])
+
+def finalRoundNumber(tourNum):
+    """ Returns the number of rounds of the tournament 'tourNum', ceil(log2(number of players))."""
+    playersNum = countPlayers(tourNum)
+    return int(ceil(log(playersNum, 2))) if playersNum > 0 else 0
+
+@instrumented
+def addRound(tourNum):
+    """ Create the next round of the tournament 'tourNum' without any prompt (see generateRound).
+        Returns (roundNum, pairingList, timings).
+    """
+    lastRoundNum = lastRoundNumber(tourNum)
+    finalRoundNum = finalRoundNumber(tourNum)
+    if finalRoundNum == 0:
+        if db_CRUD([{"sql" : "select id from Tournaments where id = %s;", "args" : [tourNum]}]) == []:
+            raise UnknownTournament("Invalid tournament ID.")
+        raise ValueError("The tournament {0} has no players.".format(tourNum))
+    if lastRoundNum >= finalRoundNum:
+        raise ValueError("There has already been the final round.")
+
+    pairingList, timings = generateRound(tourNum, lastRoundNum + 1)
+    return lastRoundNum + 1, pairingList, timings
 
 def selectTournament():
-    tourNum = raw_input("\n Enter the ID of the tournament: ")
+    tourNum = int(raw_input("\n Enter the ID of the tournament: "))
 
-    result = db_CRUD([{"sql" : "select * from Tournaments where id = {0};",
+    result = db_CRUD([{"sql" : "select * from Tournaments where id = %s;",
                        "args" : [tourNum]}]
              )
 
     if result != []:
         print "\n Welcome to the tournament ", result[0][1]
     else:
-        raise ValueError("Invalid tournament ID.")
+        raise UnknownTournament("Invalid tournament ID.")
 
-    result = db_CRUD([{"sql" : "select max(roundNumber) from Matches where tourNumber = {0};",
-                       "args" : [tourNum]}]
-             )
-    result = result[0]
-    lastRoundNum = 0 if result[0] == None else int(result[0])
+    lastRoundNum = lastRoundNumber(tourNum)
 
     if lastRoundNum > 0:
         print "\n There have already been ", lastRoundNum," round(s)."
@@ -216,15 +588,22 @@ def selectTournament():
 
     return tourNum, lastRoundNum
 
+@instrumented
 def deleteRound(tourNum, lastRoundNum):
     """ Delete all the match records of the last round of the tournament 'tourNum'.
         The bye player in that round if exists will be reset so that he or she can be a
         bye player for some further round in this tournament.
     """
-    removeByePlayer(tourNum, lastRoundNum)
-    db_CRUD([{"sql" : "delete from Matches where tourNumber = {0} and roundNumber = {1};",
-              "args" : [tourNum, lastRoundNum]}]
-    )
+    with transaction():
+        standingsBefore = playerStandings(tourNum, lastRoundNum) if publishing() else None
+        removeByePlayer(tourNum, lastRoundNum)
+        db_CRUD([{"sql" : "delete from Matches where tourNumber = %s and roundNumber = %s;",
+                  "args" : [tourNum, lastRoundNum]}]
+        )
+        invalidateTournament(tourNum)
+        if standingsBefore is not None:
+            publishChange(events.roundDeleted(tourNum, lastRoundNum, standingsBefore,
+                                              playerStandings(tourNum, lastRoundNum - 1)))
 
 def showRound(tourNum, roundNum):
     """ Show match results and the standingList of the rounds not later than 'roundNum' in the tournament 
@@ -236,24 +615,81 @@ def showRound(tourNum, roundNum):
 def newRound(tourNum, roundNum):
     """ Get a list of pairs of players for the round 'roundNum' of the tournament 'tourNum' 
         and write to database (Matches table)."""
-    pairingList = swissPairings(tourNum, roundNum)
+    with operation("newRound") as stats:
+        pairingList, timings = generateRound(tourNum, roundNum)
 
-    insertPairs(pairingList, tourNum, roundNum)
     showMatches(tourNum, roundNum)
+    print "\n Round created in {0:.1f} ms ({1}), {2}.".format(
+        sum(seconds for stage, seconds in timings) * 1000,
+        ", ".join("{0}: {1:.1f} ms".format(stage, seconds * 1000) for stage, seconds in timings),
+        formatStats(stats))
+
+@instrumented
+def generateRound(tourNum, roundNum):
+    """ Create the round 'roundNum' of the tournament 'tourNum' atomically: the bye player, the
+        standings, the pairings and the new matches are read and written in one transaction on one
+        connection, so either the whole round is written or nothing (not even the bye flag).
+
+        The row of the tournament is locked first, so two rounds of the same tournament cannot be
+        generated at the same time; 'roundNum' must be the round after the last one.
+
+        Returns (pairingList, timings), timings: a list of (stage, seconds) for the stages
+        "lock", "bye", "standings", "pairing", "insert" and "commit".
+    """
+    timings = []
+    lastLap = [time.time()]
+    def lap(stage):
+        now = time.time()
+        timings.append((stage, now - lastLap[0]))
+        lastLap[0] = now
+
+    with transaction():
+        if db_CRUD([{"sql" : "select id from Tournaments where id = %s for update;", "args" : [tourNum]}]) == []:
+            raise UnknownTournament("Invalid tournament ID.")
+        result = db_CRUD([{"sql" : "select max(roundNumber) from Matches where tourNumber = %s;",
+                           "args" : [tourNum]}])
+        lastRoundNum = result[0][0] or 0
+        if roundNum != lastRoundNum + 1:
+            raise ValueError("The round {0} cannot be created after the round {1}.".format(roundNum, lastRoundNum))
+        lap("lock")
+
+        pairingList, byePlayer = setByePlayer(tourNum)
+        lap("bye")
+
+        playerIds, scores, names, opponents = pairingInput(tourNum, roundNum, byePlayer)
+        lap("standings")
+
+        for id1, id2 in swissPairs(playerIds, scores, opponents):
+            pairingList.append((id1, names[id1], id2, names[id2]))
+        lap("pairing")
+
+        insertPairs(pairingList, tourNum, roundNum)
+        lap("insert")
+    lap("commit")
+
+    return pairingList, timings
 
 def showMatches(tourNum, roundNum):
     """ Show match info of all the round not later than the round "roundNum" in the tournament "tourNum"."""
 
-    result = db_CRUD([{"sql" : "select * from Matches where tourNumber = {0} and roundNumber <= {1};",
-                       "args" : [tourNum, roundNum]}]
-             )
+    result = cachedStream((tourNum, "matches", roundNum),
+                          lambda: streamRows("select tourNumber, roundNumber, p1, p2, win from Matches \
+                                              where tourNumber = %s and roundNumber <= %s \
+                                              order by roundNumber, p1, p2;", [tourNum, roundNum]))
 
     showRows("Matches table:\n\n tourNumber, roundNumber, player1, player2, winner (-1 means draw)", result)
 
+def getMatches(tourNum, roundNum):
+    """ Returns the matches (tourNumber, roundNumber, p1, p2, win) of all the rounds not later than
+        the round "roundNum" in the tournament "tourNum"."""
+    return list(cachedRead((tourNum, "matches", roundNum),
+                           lambda: db_CRUD([{"prepared" : "matchesUpTo", "args" : [tourNum, roundNum]}])))
+
+@instrumented
 def insertPairs(pairingList, tourNum, roundNum):
     """ Write the list of pairs of players for the round 'roundNum' in the tournament 'tourNum' 
-        to database (Matches table)."""
-    sqlList = []
+        to database (Matches table), BULK_PAGE_SIZE matches per statement."""
+    rows = []
     for row in pairingList:
         p1, p1name, p2, p2name = row
 
@@ -262,18 +698,94 @@ def insertPairs(pairingList, tourNum, roundNum):
             p1 = p2
             p2 = p
 
-        sqlList.append({"sql" : "insert into Matches values ({0}, {1}, {2}, {3});",
-                        "args" : [tourNum, roundNum, p1, p2]}
-        )
-    db_CRUD(sqlList)
-    
+        rows.append((tourNum, roundNum, p1, p2))
+
+    with transaction():
+        event = None
+        if publishing():
+            wins = dict((row[0], row[2]) for row in playerStandings(tourNum, roundNum - 1))
+            event = events.matchesCreated(tourNum, roundNum, pairingList, wins, opponentGraph(tourNum))
+
+        db_CRUD([{"bulk" : "insertMatches", "values" : rows}])
+        invalidateTournament(tourNum)
+        if event is not None:
+            publishChange(event)
+
+@instrumented
+def recordMatchResults(tourNum, roundNum, results):
+    """ Record the results of many matches of the round 'roundNum' in the tournament 'tourNum' at once.
+
+        results: a list (or any iterable, e.g. a generator reading a file) of tuples (p1, p2, winner),
+                 winner is the id of p1 or p2, or -1 for a draw match.
+
+        All the results are written in one transaction, BULK_PAGE_SIZE matches per statement.
+    """
+    def checkedRows():
+        for p1, p2, winner in results:
+            if winner not in [-1, p1, p2]:
+                raise ValueError("The winner {0} did not play in the match between {1} and {2}."
+                                 .format(winner, p1, p2))
+            yield (tourNum, roundNum, min(p1, p2), max(p1, p2), winner)
+
+    with transaction():
+        event = None
+        if publishing():
+            results = list(results)
+            formerWinners = dict(((p1, p2), win) for p1, p2, win in
+                                 db_CRUD([{"sql" : "select p1, p2, win from Matches \
+                                                    where tourNumber = %s and roundNumber = %s;",
+                                           "args" : [tourNum, roundNum]}]))
+            event = events.resultsRecorded(tourNum, roundNum, results, formerWinners, opponentGraph(tourNum))
+
+        db_CRUD([{"bulk" : "updateResults", "values" : checkedRows()}])
+        invalidateTournament(tourNum)
+        if event is not None:
+            publishChange(event)
+
+class ResultConflict(ValueError):
+    """ Raised when a match already has another result than the one submitted."""
+
+class UnknownTournament(ValueError):
+    """ Raised when the tournament of an operation does not exist."""
+
+@instrumented
+def submitMatchResults(tourNum, roundNum, results):
+    """ Record the results (p1, p2, winner) of the round 'roundNum' in the tournament 'tourNum'
+        idempotently: a result already recorded is skipped, so the same results can be sent again
+        (e.g. after a timeout) without any effect. Nothing is written if a match does not exist or
+        already has another result (ResultConflict); deleteRound is the way to change a result.
+
+        Returns (the number of results recorded, the number of results already recorded).
+    """
+    with transaction():
+        if db_CRUD([{"sql" : "select id from Tournaments where id = %s for update;", "args" : [tourNum]}]) == []:
+            raise UnknownTournament("Invalid tournament ID.")
+        recorded = dict(((p1, p2), win) for p1, p2, win in
+                        db_CRUD([{"sql" : "select p1, p2, win from Matches \
+                                           where tourNumber = %s and roundNumber = %s;",
+                                  "args" : [tourNum, roundNum]}]))
+        newResults = []
+        for p1, p2, winner in results:
+            match = (min(p1, p2), max(p1, p2))
+            if match not in recorded:
+                raise ValueError("There is no match between {0} and {1} in the round {2}."
+                                 .format(p1, p2, roundNum))
+            if recorded[match] == winner:
+                continue
+            if recorded[match] is not None:
+                raise ResultConflict("The match between {0} and {1} already has the winner {2}."
+                                     .format(p1, p2, recorded[match]))
+            recorded[match] = winner
+            newResults.append((p1, p2, winner))
+
+        if newResults:
+            recordMatchResults(tourNum, roundNum, newResults)
+    return len(newResults), len(results) - len(newResults)
+
 def matchResults(tourNum, roundNum):
     """ Allow to report the match results."""
     
-    result = db_CRUD([{"sql" : "select p1, p2 from Matches \
-                                where tourNumber = {0} and roundNumber = {1} and win is null;",
-                       "args" : [tourNum, roundNum]}]
-             )
+    result = db_CRUD([{"prepared" : "unplayedMatches", "args" : [tourNum, roundNum]}])
     if result == []:
         print "\n You must select the option '6.4- Add a new round' first."
         return False
@@ -281,7 +793,7 @@ def matchResults(tourNum, roundNum):
         print '\n\n Report match results: '
         print "\n    Please enter the id of the winner or -1 for a draw match:"
 
-        sqlList = []
+        resultList = []
         for row in result:
             p1, p2 = row
 
@@ -292,15 +804,11 @@ def matchResults(tourNum, roundNum):
                 winner = int(raw_input("                            winner: "))
 
             if winner in [-1, p1, p2]:
-                sqlList.append({"sql" : "update Matches set win = {0} \
-                                         where tourNumber = {1} and roundNumber = {2} \
-                                               and p1 = {3} and p2 = {4};",
-                                "args" : [winner, tourNum, roundNum, p1, p2]}
-                )
+                resultList.append((p1, p2, winner))
             else:
                 raise ValueError("You entered a wrong number.")
 
-        db_CRUD(sqlList)
+        recordMatchResults(tourNum, roundNum, resultList)
         return True
 
 def showRows(rowsName, rows):
@@ -312,32 +820,30 @@ def showRows(rowsName, rows):
 # Functions called from main menu:
 
 def showTournaments():
-    result = db_CRUD([{"sql" : "SELECT * FROM tournaments;", "args" : []}])
+    result = streamRows("select id, name from Tournaments order by id;")
     showRows("Tournaments:\n\n tourNumber, name", result)
 
 def showPlayers():
-    result = db_CRUD([{"sql" : "SELECT * FROM players;", "args" : []}])
+    result = streamRows("select id, name from Players order by id;")
     showRows("Players:\n\n id, name", result)
 
 def addNewTournament():
 
     name = raw_input("\nEnter the name of the new tournament: ")
-    db_CRUD([{"sql" : "insert into Tournaments (id, name) values (DEFAULT, '{0}');",
-              "args" : [name]}]
-    )
+    createTournament(name)
 
 def deleteTournament():
     """ Delete the selected tournament. All the records in Players_Tournaments related to this tournament
         will be deleted on cascade.
         This in its turn calls to delete all the related matches in Matches on cascade.
     """
-    delete_id = raw_input("\nEnter the id of an existent tournament: ")
-    db_CRUD([{"sql" : "delete from Tournaments where id = {0};", "args" : [delete_id]}])
+    delete_id = int(raw_input("\nEnter the id of an existent tournament: "))
+    dropTournament(delete_id)
 
 def addPlayers():
     """ Allows to add all players for a tournament."""
 
-    playersList = []
+    rows = []
     tourNum, lastRoundNum = selectTournament()
     playerNum = countPlayers(tourNum)
 
@@ -353,9 +859,7 @@ def addPlayers():
         raise ValueError("\nYou enter a wrong number.")
 
     if playerNumber % 2 != 0: # Add a dummy player to this tournament.
-        playersList.append({"sql" : "insert into Players_Tournaments values ({0}, 0, 0);",
-                            "args" : [tourNum]}
-        )
+        rows.append((tourNum, 0, 0))
 
     for i in range(playerNumber):
         print "\n Player number {0}:".format(i+1)
@@ -368,7 +872,7 @@ def addPlayers():
             player_id = raw_input("\nEnter the id of the existent player: ")
             player_id = int(player_id)
 
-            result = db_CRUD([{"sql" :"select id, name from Players where id = {0} and id <> 0;",
+            result = db_CRUD([{"sql" :"select id, name from Players where id = %s and id <> 0;",
                                "args" : [player_id]}]
                      )
 
@@ -377,16 +881,15 @@ def addPlayers():
             else:
                 showRows("Players:\n\n id, name", result[0])
 
-        playersList.append({"sql" :"insert into Players_Tournaments values ({0}, {1}, 0);",
-                            "args" : [tourNum, player_id]}
-        )
-    db_CRUD(playersList)
+        rows.append((tourNum, player_id, 0))
+
+    db_CRUD([{"bulk" : "insertRegistrations", "values" : rows}])
+    invalidateTournament(tourNum)
 
 def showPlayersInTournament():
     tourNum, lastRoundNum = selectTournament()
-    result = db_CRUD([{"sql" : "SELECT * FROM players_tournaments where tourNumber = {0};",
-                       "args" : [tourNum]}]
-             )
+    result = streamRows("select tourNumber, player_id, bye from Players_Tournaments \
+                         where tourNumber = %s order by player_id;", [tourNum])
     showRows("Players_Tournaments table: (bye=1 means the player is a byePlayer in some round)\
               \n\n tourNumber, player_id, bye", result)
 
@@ -407,8 +910,7 @@ def addNewRound():
     tourNum, lastRoundNum = selectTournament()
     playersNum = countPlayers(tourNum)
     if playersNum > 0:
-        max_round = log(playersNum,2)
-        if lastRoundNum >= ceil(max_round):
+        if lastRoundNum >= finalRoundNumber(tourNum):
             raise ValueError("There has already been the final round.")
         newRound(tourNum, lastRoundNum+1)
     else:
@@ -447,12 +949,14 @@ def deleteTournamentsTable():
         This in its turn calls to delete all the matches in Matches on cascade.
     """
     db_CRUD([ {"sql" : "delete from Tournaments;", "args" : [] } ])
+    readCache.clear()
 
 def deletePlayers_TournamentsTable():
     """ Remove all the records from the Players_Tournaments table.
         All the matches in Matches will be deleted on cascade.
     """
     db_CRUD([{"sql" : "delete from Players_Tournaments;", "args" : []}])
+    readCache.clear()
 
 def deleteMatchesTable():
     """ Remove all the matches from the database.
@@ -461,6 +965,19 @@ def deleteMatchesTable():
     sqlList = [{"sql" : "update Players_Tournaments set bye = 0;", "args" : []},
                {"sql" : "delete from Matches;", "args" : []}]
     db_CRUD(sqlList)
+    readCache.clear()
+
+def checkStandingsTable():
+    """ Check the Standings table of a tournament against a full recomputation and repair it if needed."""
+    tourNum, lastRoundNum = selectTournament()
+    differences = checkStandings(tourNum)
+    if differences == []:
+        print "\n The Standings table of this tournament is consistent."
+    else:
+        showRows("Differences:\n\n roundNumber, player_id, (wins, opp_wins, matches) stored, computed",
+                 differences)
+        rebuildStandings(tourNum)
+        print "\n The Standings table of this tournament has been rebuilt."
 
 def deletePlayersTable():
     """ Remove all the players from the database except the dummy player.
@@ -468,6 +985,7 @@ def deletePlayersTable():
         All the records in Players_Tournaments will be deleted on cascade also.
     """
     db_CRUD([ {"sql" : "delete from Players where id <> 0;", "args" : [] } ])
+    readCache.clear()
 
 #-------------------------------------------------------------------------------------------#
 
@@ -16,7 +16,16 @@ drop function if exists matches_fn(integer, integer);
 drop function if exists matches_number_fn(integer, integer);
 drop function if exists opponent_wins_fn(integer, integer);
 drop function if exists total_opponent_wins_fn(integer, integer);
+drop function if exists standings_fn(integer, integer);
+drop function if exists matches_standings_trg();
+drop function if exists standings_open_round(integer, integer);
+drop function if exists standings_add_opponent(integer, integer, integer, integer);
+drop function if exists standings_apply_result(integer, integer, integer, integer, integer, integer);
+drop function if exists matches_opponents_trg();
+drop function if exists drop_tournament(integer);
 
+drop table if exists Standings;
+drop table if exists Opponents;
 drop table if exists Matches;
 drop table if exists Players_Tournaments;
 drop table if exists Players cascade;
@@ -40,6 +49,9 @@ CREATE TABLE Players_Tournaments (
 );
 -- bye = 0 by DEFAULT, it is set to 1 when the player is set to a byePlayer
 
+-- The players who can still be a byePlayer in a tournament, to choose one without scanning the others.
+CREATE INDEX players_tournaments_no_bye_idx ON Players_Tournaments (tourNumber, player_id) WHERE bye = 0;
+
 CREATE TABLE Matches (
     tourNumber INTEGER, 
     roundNumber INTEGER,
@@ -59,6 +71,46 @@ CREATE TABLE Matches (
 --                                     in 1 round the two players must have only 1 match.
 --player_win CONSTRAINT:  win = match winner id or (-1) to represent a draw.
 
+-- The PRIMARY KEY already serves the lookups by (tourNumber, roundNumber); these two serve the
+-- lookups of the matches of a player in a tournament.
+CREATE INDEX matches_tour_p1_idx ON Matches (tourNumber, p1);
+CREATE INDEX matches_tour_p2_idx ON Matches (tourNumber, p2);
+
+CREATE TABLE Standings (
+    tourNumber INTEGER,
+    roundNumber INTEGER,
+    player_id INTEGER,
+    wins INTEGER,
+    matches INTEGER,
+    opp_wins INTEGER,
+    PRIMARY KEY (tourNumber, roundNumber, player_id),
+    FOREIGN KEY (tourNumber, player_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+);
+
+CREATE TABLE Opponents (
+    tourNumber INTEGER,
+    player_id INTEGER,
+    opponent_id INTEGER,
+    roundNumber INTEGER,
+    PRIMARY KEY (tourNumber, player_id, opponent_id),
+    FOREIGN KEY (tourNumber, player_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade,
+    FOREIGN KEY (tourNumber, opponent_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+);
+
+CREATE INDEX standings_order_idx ON Standings (tourNumber, roundNumber, wins desc, opp_wins desc);
+
+--Standings: the standing list of every player at the end of every round of a tournament, the same
+--           numbers as standings_fn(tourNumber, roundNumber) but kept up to date by the trigger
+--           matches_standings_trg on every change of Matches, so reading it is an indexed lookup.
+--           opp_wins is null as long as the player has no opponent, as in standings_fn.
+
+--Opponents: the opponent graph of every tournament, both directions of every match (a bye being a
+--           match with the dummy player), with the round they met in; kept up to date by the trigger
+--           matches_opponents_trg, so "who has met whom" is an index lookup instead of a scan of Matches.
+
 -------------------------------------------------------------------------------------------------
 -- players_fn and matches_fn will have data for tournament "tourNum" and 
 -- all the rounds not after "roundNum.
@@ -144,6 +196,221 @@ $body$
 $body$
 language sql;
 -------------------------------------------------------------------------------------------------
+-- The standing list (id, name, wins, opp_wins, matches) in a single pass over Matches:
+-- it gives the same numbers as matches_number_fn, wins_fn and total_opponent_wins_fn together,
+-- but every match is read once and turned into one row for each of its two players,
+-- instead of scanning Matches again for every function and for every player.
+
+create or replace function standings_fn(tourNum integer, roundNum integer)
+  returns table (id integer, name text, wins integer, opp_wins integer, matches integer)
+as
+$body$
+    with results as (
+        select r.id, r.opp, m.win
+        from Matches m
+             cross join lateral (values (m.p1, m.p2), (m.p2, m.p1)) r(id, opp)
+        where m.tourNumber = $1 and m.roundNumber <= $2
+    ),
+    records as (
+        select pt.player_id as id,
+               count(case when r.win = pt.player_id then 1 end)::integer as wins,
+               count(case when r.id <> 0 and r.opp <> 0 then r.win end)::integer as matches
+        from Players_Tournaments pt
+             left join results r on r.id = pt.player_id
+        where pt.tourNumber = $1
+        group by pt.player_id
+    ),
+    opponents as (
+        select distinct id, opp
+        from results
+    )
+    select rec.id, p.name, rec.wins, sum(opp.wins)::integer, rec.matches
+    from records rec
+         join Players p on p.id = rec.id
+         left join opponents o on o.id = rec.id
+         left join records opp on opp.id = o.opp
+    group by rec.id, p.name, rec.wins, rec.matches;
+$body$
+language sql;
+-------------------------------------------------------------------------------------------------
+-- The functions below keep the Standings table up to date incrementally.
+-------------------------------------------------------------------------------------------------
+-- The first time a match of the round "roundNum" is inserted, the standing list of that round
+-- starts as a copy of the one of the round before (or zeros for the first round).
+
+create or replace function standings_open_round(tourNum integer, roundNum integer)
+  returns void
+as
+$body$
+begin
+    if not exists (select 1 from Standings where tourNumber = tourNum and roundNumber = roundNum) then
+        insert into Standings
+        select tourNum, roundNum, pt.player_id, coalesce(s.wins, 0), coalesce(s.matches, 0), s.opp_wins
+        from Players_Tournaments pt
+             left join Standings s
+             on s.tourNumber = tourNum and s.player_id = pt.player_id
+                and s.roundNumber = (select max(roundNumber)
+                                     from Standings
+                                     where tourNumber = tourNum and roundNumber < roundNum)
+        where pt.tourNumber = tourNum;
+    end if;
+end;
+$body$
+language plpgsql;
+-------------------------------------------------------------------------------------------------
+-- "player" meets "opponent" in the round "roundNum": unless they have already met before,
+-- the wins of "opponent" are added to the opp_wins of "player" from that round on.
+
+create or replace function standings_add_opponent(tourNum integer, roundNum integer,
+                                                  player integer, opponent integer)
+  returns void
+as
+$body$
+begin
+    if not exists (select 1
+                   from Opponents
+                   where tourNumber = tourNum and player_id = player and opponent_id = opponent
+                         and roundNumber < roundNum) then
+        update Standings s
+        set opp_wins = coalesce(s.opp_wins, 0) + o.wins
+        from Standings o
+        where s.tourNumber = tourNum and s.roundNumber >= roundNum and s.player_id = player
+              and o.tourNumber = tourNum and o.roundNumber = s.roundNumber and o.player_id = opponent;
+    end if;
+end;
+$body$
+language plpgsql;
+-------------------------------------------------------------------------------------------------
+-- Add (delta = 1) or take back (delta = -1) the result "winner" of the match between "player1"
+-- and "player2" in the round "roundNum", in the standing lists of that round and the later ones.
+
+create or replace function standings_apply_result(tourNum integer, roundNum integer,
+                                                  player1 integer, player2 integer,
+                                                  winner integer, delta integer)
+  returns void
+as
+$body$
+begin
+    if winner is null then
+        return;
+    end if;
+
+    if player1 <> 0 and player2 <> 0 then -- a match with the dummy player (a bye) is not counted.
+        update Standings
+        set matches = matches + delta
+        where tourNumber = tourNum and roundNumber >= roundNum and player_id in (player1, player2);
+    end if;
+
+    if winner <> -1 then
+        update Standings
+        set wins = wins + delta
+        where tourNumber = tourNum and roundNumber >= roundNum and player_id = winner;
+
+        -- Every player who has met the winner by the end of a round gets one more opp_win in it.
+        update Standings s
+        set opp_wins = s.opp_wins + delta
+        from Opponents o
+        where o.tourNumber = tourNum and o.player_id = winner
+              and s.tourNumber = tourNum and s.player_id = o.opponent_id
+              and s.roundNumber >= greatest(roundNum, o.roundNumber);
+    end if;
+end;
+$body$
+language plpgsql;
+-------------------------------------------------------------------------------------------------
+-- Inserting a match opens its round and adds the two players to each other's opponents,
+-- recording or changing a result applies the difference, and deleting the matches of a round
+-- drops the standing lists of that round and the later ones.
+-- Both triggers do nothing in a transaction which sets tournament.bulk_load to 'on' (set local):
+-- its matches are loaded at once and the tables built once after them (rebuildStandings).
+
+create or replace function matches_standings_trg()
+  returns trigger
+as
+$body$
+begin
+    if current_setting('tournament.bulk_load', true) = 'on' then
+        return null; -- the rows are being loaded in bulk (see archive.importTournament).
+    end if;
+
+    if TG_OP = 'INSERT' then
+        perform standings_open_round(new.tourNumber, new.roundNumber);
+        perform standings_add_opponent(new.tourNumber, new.roundNumber, new.p1, new.p2);
+        perform standings_add_opponent(new.tourNumber, new.roundNumber, new.p2, new.p1);
+        perform standings_apply_result(new.tourNumber, new.roundNumber, new.p1, new.p2, new.win, 1);
+
+    elsif TG_OP = 'UPDATE' then
+        if (new.tourNumber, new.roundNumber, new.p1, new.p2)
+           is distinct from (old.tourNumber, old.roundNumber, old.p1, old.p2) then
+            raise exception 'Only the winner of a match can be updated.';
+        end if;
+        if new.win is distinct from old.win then
+            perform standings_apply_result(old.tourNumber, old.roundNumber, old.p1, old.p2, old.win, -1);
+            perform standings_apply_result(new.tourNumber, new.roundNumber, new.p1, new.p2, new.win, 1);
+        end if;
+
+    elsif TG_OP = 'DELETE' then
+        delete from Standings
+        where tourNumber = old.tourNumber and roundNumber >= old.roundNumber;
+    end if;
+
+    return null;
+end;
+$body$
+language plpgsql;
+
+-------------------------------------------------------------------------------------------------
+-- Inserting a match adds both directions of it to the opponent graph,
+-- deleting it takes them out. The triggers of a table fire in the order of their names, so the
+-- graph is up to date when matches_standings_trg reads it.
+
+create or replace function matches_opponents_trg()
+  returns trigger
+as
+$body$
+begin
+    if current_setting('tournament.bulk_load', true) = 'on' then
+        return null; -- the rows are being loaded in bulk (see archive.importTournament).
+    end if;
+
+    if TG_OP = 'INSERT' then
+        insert into Opponents
+        values (new.tourNumber, new.p1, new.p2, new.roundNumber),
+               (new.tourNumber, new.p2, new.p1, new.roundNumber)
+        on conflict do nothing;
+
+    elsif TG_OP = 'DELETE' then
+        delete from Opponents
+        where tourNumber = old.tourNumber and roundNumber = old.roundNumber
+              and (player_id, opponent_id) in ((old.p1, old.p2), (old.p2, old.p1));
+    end if;
+
+    return null;
+end;
+$body$
+language plpgsql;
+
+create trigger matches_opponents_trg
+  after insert or delete on Matches
+  for each row execute procedure matches_opponents_trg();
+
+create trigger matches_standings_trg
+  after insert or update or delete on Matches
+  for each row execute procedure matches_standings_trg();
+-------------------------------------------------------------------------------------------------
+
+-------------------------------------------------------------------------------------------------
+-- Delete the tournament "tourNum": its registrations, matches, standings and opponents go with it on
+-- cascade. Its players stay in Players. The migration migrations/001 (see migrate.py) replaces it
+-- with a drop of the partitions of the tournament.
+
+create or replace function drop_tournament(tourNum integer)
+  returns void
+as
+$body$
+    delete from Tournaments where id = $1;
+$body$
+language sql;
 
 INSERT INTO Players VALUES (0, 'Dummy');
 -- For a general algorithm, a dummy player will be added to the number of players in a tournament
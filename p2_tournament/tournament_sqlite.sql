@@ -0,0 +1,188 @@
+-- Table definitions for the tournament project, SQLite version (see tournament.sql for the
+-- explanation of the database design). backends.SQLiteBackend creates them in a new database.
+
+CREATE TABLE Tournaments (
+    id INTEGER PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE Players (
+    id INTEGER PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE Players_Tournaments (
+    tourNumber INTEGER REFERENCES Tournaments(id) on delete cascade,
+    player_id INTEGER REFERENCES Players(id) on delete cascade,
+    bye INTEGER,
+    PRIMARY KEY (tourNumber, player_id)
+);
+
+CREATE INDEX players_tournaments_no_bye_idx ON Players_Tournaments (tourNumber, player_id) WHERE bye = 0;
+
+CREATE TABLE Matches (
+    tourNumber INTEGER,
+    roundNumber INTEGER,
+    p1 INTEGER REFERENCES Players(id) on delete cascade,
+    p2 INTEGER REFERENCES Players(id) on delete cascade,
+    win INTEGER,
+    PRIMARY KEY (tourNumber,roundNumber,p1,p2),
+    CONSTRAINT player_order CHECK (p1 < p2),
+    CONSTRAINT player_win CHECK (win = p1 OR win = p2 OR win = -1),
+    CONSTRAINT player1 FOREIGN KEY (tourNumber, p1)
+               REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade,
+    CONSTRAINT player2 FOREIGN KEY (tourNumber, p2)
+               REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+);
+
+CREATE INDEX matches_tour_p1_idx ON Matches (tourNumber, p1);
+CREATE INDEX matches_tour_p2_idx ON Matches (tourNumber, p2);
+
+CREATE TABLE Standings (
+    tourNumber INTEGER,
+    roundNumber INTEGER,
+    player_id INTEGER,
+    wins INTEGER,
+    matches INTEGER,
+    opp_wins INTEGER,
+    PRIMARY KEY (tourNumber, roundNumber, player_id),
+    FOREIGN KEY (tourNumber, player_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+);
+
+CREATE TABLE Opponents (
+    tourNumber INTEGER,
+    player_id INTEGER,
+    opponent_id INTEGER,
+    roundNumber INTEGER,
+    PRIMARY KEY (tourNumber, player_id, opponent_id),
+    FOREIGN KEY (tourNumber, player_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade,
+    FOREIGN KEY (tourNumber, opponent_id)
+                REFERENCES Players_Tournaments(tourNumber, player_id) on delete cascade
+);
+
+CREATE INDEX standings_order_idx ON Standings (tourNumber, roundNumber, wins desc, opp_wins desc);
+
+-------------------------------------------------------------------------------------------------
+-- The triggers keeping the Opponents and Standings tables up to date, the same steps as
+-- matches_opponents_trg and matches_standings_trg of tournament.sql (SQLite triggers have no IF:
+-- the conditions are in the WHERE clauses). The order in which SQLite fires the triggers of a table
+-- is not defined, so the opponent graph is added to by the trigger which reads it.
+
+CREATE TRIGGER matches_insert_standings_trg AFTER INSERT ON Matches
+BEGIN
+    -- Add the match to the opponent graph.
+    INSERT OR IGNORE INTO Opponents
+    VALUES (NEW.tourNumber, NEW.p1, NEW.p2, NEW.roundNumber), (NEW.tourNumber, NEW.p2, NEW.p1, NEW.roundNumber);
+
+    -- Open the round: copy the standing list of the round before (or zeros).
+    INSERT INTO Standings
+    SELECT NEW.tourNumber, NEW.roundNumber, pt.player_id, coalesce(s.wins, 0), coalesce(s.matches, 0), s.opp_wins
+    FROM Players_Tournaments pt
+         LEFT JOIN Standings s
+         ON s.tourNumber = NEW.tourNumber AND s.player_id = pt.player_id
+            AND s.roundNumber = (SELECT max(roundNumber) FROM Standings
+                                 WHERE tourNumber = NEW.tourNumber AND roundNumber < NEW.roundNumber)
+    WHERE pt.tourNumber = NEW.tourNumber
+          AND NOT EXISTS (SELECT 1 FROM Standings
+                          WHERE tourNumber = NEW.tourNumber AND roundNumber = NEW.roundNumber);
+
+    -- The two players become opponents, unless they have already met.
+    UPDATE Standings
+    SET opp_wins = coalesce(opp_wins, 0)
+                   + (SELECT o.wins FROM Standings o
+                      WHERE o.tourNumber = Standings.tourNumber AND o.roundNumber = Standings.roundNumber
+                            AND o.player_id = NEW.p2)
+    WHERE tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber AND player_id = NEW.p1
+          AND NOT EXISTS (SELECT 1 FROM Opponents
+                          WHERE tourNumber = NEW.tourNumber AND player_id = NEW.p1 AND opponent_id = NEW.p2
+                                AND roundNumber < NEW.roundNumber);
+
+    UPDATE Standings
+    SET opp_wins = coalesce(opp_wins, 0)
+                   + (SELECT o.wins FROM Standings o
+                      WHERE o.tourNumber = Standings.tourNumber AND o.roundNumber = Standings.roundNumber
+                            AND o.player_id = NEW.p1)
+    WHERE tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber AND player_id = NEW.p2
+          AND NOT EXISTS (SELECT 1 FROM Opponents
+                          WHERE tourNumber = NEW.tourNumber AND player_id = NEW.p1 AND opponent_id = NEW.p2
+                                AND roundNumber < NEW.roundNumber);
+
+    -- The result, if the match is inserted with one.
+    UPDATE Standings SET matches = matches + 1
+    WHERE NEW.win IS NOT NULL AND NEW.p1 <> 0 AND NEW.p2 <> 0
+          AND tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber AND player_id IN (NEW.p1, NEW.p2);
+
+    UPDATE Standings SET wins = wins + 1
+    WHERE NEW.win IS NOT NULL AND NEW.win <> -1
+          AND tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber AND player_id = NEW.win;
+
+    UPDATE Standings SET opp_wins = opp_wins + 1
+    WHERE NEW.win IS NOT NULL AND NEW.win <> -1
+          AND tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber
+          AND player_id IN (SELECT opponent_id FROM Opponents
+                            WHERE tourNumber = NEW.tourNumber AND player_id = NEW.win)
+          AND roundNumber >= (SELECT o.roundNumber FROM Opponents o
+                              WHERE o.tourNumber = NEW.tourNumber AND o.player_id = NEW.win
+                                    AND o.opponent_id = Standings.player_id);
+END;
+
+CREATE TRIGGER matches_update_keys_trg BEFORE UPDATE OF tourNumber, roundNumber, p1, p2 ON Matches
+WHEN NEW.tourNumber IS NOT OLD.tourNumber OR NEW.roundNumber IS NOT OLD.roundNumber
+     OR NEW.p1 IS NOT OLD.p1 OR NEW.p2 IS NOT OLD.p2
+BEGIN
+    SELECT raise(ABORT, 'Only the winner of a match can be updated.');
+END;
+
+CREATE TRIGGER matches_update_standings_trg AFTER UPDATE OF win ON Matches
+WHEN NEW.win IS NOT OLD.win
+BEGIN
+    -- Take back the former result...
+    UPDATE Standings SET matches = matches - 1
+    WHERE OLD.win IS NOT NULL AND OLD.p1 <> 0 AND OLD.p2 <> 0
+          AND tourNumber = OLD.tourNumber AND roundNumber >= OLD.roundNumber AND player_id IN (OLD.p1, OLD.p2);
+
+    UPDATE Standings SET wins = wins - 1
+    WHERE OLD.win IS NOT NULL AND OLD.win <> -1
+          AND tourNumber = OLD.tourNumber AND roundNumber >= OLD.roundNumber AND player_id = OLD.win;
+
+    UPDATE Standings SET opp_wins = opp_wins - 1
+    WHERE OLD.win IS NOT NULL AND OLD.win <> -1
+          AND tourNumber = OLD.tourNumber AND roundNumber >= OLD.roundNumber
+          AND player_id IN (SELECT opponent_id FROM Opponents
+                            WHERE tourNumber = OLD.tourNumber AND player_id = OLD.win)
+          AND roundNumber >= (SELECT o.roundNumber FROM Opponents o
+                              WHERE o.tourNumber = OLD.tourNumber AND o.player_id = OLD.win
+                                    AND o.opponent_id = Standings.player_id);
+
+    -- ...and apply the new one.
+    UPDATE Standings SET matches = matches + 1
+    WHERE NEW.win IS NOT NULL AND NEW.p1 <> 0 AND NEW.p2 <> 0
+          AND tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber AND player_id IN (NEW.p1, NEW.p2);
+
+    UPDATE Standings SET wins = wins + 1
+    WHERE NEW.win IS NOT NULL AND NEW.win <> -1
+          AND tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber AND player_id = NEW.win;
+
+    UPDATE Standings SET opp_wins = opp_wins + 1
+    WHERE NEW.win IS NOT NULL AND NEW.win <> -1
+          AND tourNumber = NEW.tourNumber AND roundNumber >= NEW.roundNumber
+          AND player_id IN (SELECT opponent_id FROM Opponents
+                            WHERE tourNumber = NEW.tourNumber AND player_id = NEW.win)
+          AND roundNumber >= (SELECT o.roundNumber FROM Opponents o
+                              WHERE o.tourNumber = NEW.tourNumber AND o.player_id = NEW.win
+                                    AND o.opponent_id = Standings.player_id);
+END;
+
+CREATE TRIGGER matches_delete_standings_trg AFTER DELETE ON Matches
+BEGIN
+    DELETE FROM Opponents
+    WHERE tourNumber = OLD.tourNumber AND roundNumber = OLD.roundNumber
+          AND ((player_id = OLD.p1 AND opponent_id = OLD.p2) OR (player_id = OLD.p2 AND opponent_id = OLD.p1));
+
+    DELETE FROM Standings WHERE tourNumber = OLD.tourNumber AND roundNumber >= OLD.roundNumber;
+END;
+-------------------------------------------------------------------------------------------------
+
+INSERT INTO Players VALUES (0, 'Dummy');
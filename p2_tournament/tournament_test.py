@@ -27,6 +27,7 @@ def showMenu():
     print "\n |     '7.2': Delete Players_Tournaments table.                                   |"
     print "\n |     '7.3': Delete Matches table.                                               |"
     print "\n |     '7.4': Delete Players table.                                               |"
+    print "\n |     '7.5': Check the standing lists of a tournament.                           |"
     print "\n | 'q': quit.                                                                     |"
     print "\n +--------------------------------------------------------------------------------+"
 
@@ -87,9 +88,15 @@ def mainloop():
         elif option == '7.4':
             print "\n.........'7.4': Delete Players table.........................................."
             deletePlayersTable()
+        elif option == '7.5':
+            print "\n.........'7.5': Check the standing lists of a tournament......................"
+            checkStandingsTable()
         elif option != 'q':
             print "\n You entered a wrong option."
         print "\n******************************************************************************\n"
 
 if __name__ == '__main__':
-    mainloop()
+    try:
+        mainloop()
+    finally:
+        connectionPool.closeAll()